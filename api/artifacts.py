@@ -0,0 +1,286 @@
+import os
+import time
+import asyncio
+import json
+import shutil
+import uuid
+import hashlib
+import threading
+from pathlib import Path
+
+# ========================================================
+# 내용 해시(SHA-256) 기준 산출물 저장소
+# ========================================================
+# tempuploads/<sha256>/
+#   source.<ext>      업로드 원본
+#   audio.mp3         추출한 오디오
+#   transcript.json   Whisper 결과 (단어 타임스탬프 포함)
+#   segments.json     자막 분할 결과
+#   ko.<tag>.srt      번역 자막 (모델/프롬프트 버전별)
+#   subtitled.<tag>.mp4
+CHUNK_SIZE = 1024 * 1024
+
+# 디스크 한도 / 마지막 접근 후 보관 기간 / 정리 주기
+QUOTA_BYTES = int(float(os.getenv("WALNUT_ARTIFACT_QUOTA_GB", "50")) * 1024 ** 3)
+TTL_SEC = float(os.getenv("WALNUT_ARTIFACT_TTL_HOURS", "24")) * 3600
+CLEANUP_INTERVAL_SEC = float(os.getenv("WALNUT_CLEANUP_INTERVAL_SEC", "300"))
+# 업로드 중단 등으로 남은 .tmp- 파일/폴더는 이 시간 지나면 지움
+STALE_TMP_SEC = 6 * 3600
+
+
+def tree_stat(path):
+    # 작업용 .tmp- 폴더 (render / chunks / windows): 안에 든 파일 합계 크기, 제일 최근 수정 시각
+    st = path.stat()
+    size, last = 0, st.st_mtime
+    for dirpath, _, names in os.walk(path):
+        for name in names:
+            try:
+                st = os.stat(os.path.join(dirpath, name))
+            except FileNotFoundError:
+                continue
+            size += st.st_size
+            last = max(last, st.st_mtime)
+    return size, last
+
+
+class ArtifactStore:
+    def __init__(self, root, quota_bytes=QUOTA_BYTES, ttl_sec=TTL_SEC):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.quota_bytes = quota_bytes
+        self.ttl_sec = ttl_sec
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+        # 파일별 마지막 접근 시각 (재시작하면 mtime 으로 대신함)
+        self._access = {}
+        # 작업 중인 해시는 정리 대상에서 빠짐
+        self._pins = {}
+        self.evicted_files = 0
+        self.evicted_bytes = 0
+        self._janitor = None
+        self._stop = threading.Event()
+
+    def dir(self, digest):
+        d = self.root / digest
+        d.mkdir(exist_ok=True)
+        return d
+
+    def touch(self, digest, name):
+        self._access[(digest, name)] = time.time()
+
+    def touch_file(self, path):
+        # 결과물 다운로드/스트리밍도 사용으로 침 (보고 있는 영상이 먼저 정리되지 않게)
+        path = Path(path).resolve()
+        if path.parent.parent == self.root.resolve():
+            self.touch(path.parent.name, path.name)
+
+    def path(self, digest, name):
+        self.touch(digest, name)
+        return self.dir(digest) / name
+
+    def has(self, digest, name):
+        return (self.root / digest / name).exists()
+
+    def tmp_path(self, digest, name):
+        # 작업 중인 파일은 .tmp- 로 쓰고 끝나면 commit() 으로 이름 바꿈 (반쯤 쓴 파일이 캐시로 안 보이게)
+        return self.dir(digest) / f".tmp-{uuid.uuid4().hex}-{name}"
+
+    def commit(self, tmp, digest, name):
+        final = self.path(digest, name)
+        os.replace(tmp, final)
+        return final
+
+    def discard_tmp(self, digest):
+        d = self.root / digest
+        if d.exists():
+            for p in d.glob(".tmp-*"):
+                if p.is_dir():
+                    shutil.rmtree(p, ignore_errors=True)
+                else:
+                    p.unlink(missing_ok=True)
+
+    def read_json(self, digest, name):
+        with open(self.path(digest, name), "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def write_json(self, digest, name, data):
+        tmp = self.tmp_path(digest, name)
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        return self.commit(tmp, digest, name)
+
+    def write_text(self, digest, name, text):
+        tmp = self.tmp_path(digest, name)
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(text)
+        return self.commit(tmp, digest, name)
+
+    def pin(self, digest):
+        with self._locks_guard:
+            self._pins[digest] = self._pins.get(digest, 0) + 1
+
+    def unpin(self, digest):
+        with self._locks_guard:
+            n = self._pins.get(digest, 0) - 1
+            if n > 0:
+                self._pins[digest] = n
+            else:
+                self._pins.pop(digest, None)
+
+    def lock(self, digest):
+        # 같은 파일이 동시에 두 번 올라오면 한 쪽이 끝날 때까지 기다렸다가 캐시를 씀
+        with self._locks_guard:
+            return self._locks.setdefault(digest, threading.Lock())
+
+    def staging_path(self, ext):
+        # 해시를 아직 모를 때 쓰는 임시 파일 (adopt() 로 해시 폴더에 넣음)
+        return self.root / f".tmp-{uuid.uuid4().hex}.{ext}"
+
+    def adopt(self, staging, digest, name):
+        final = self.path(digest, name)
+        if final.exists():
+            Path(staging).unlink(missing_ok=True)
+        else:
+            os.replace(staging, final)
+        return final
+
+    async def ingest(self, upload, ext, tee=None):
+        """업로드를 청크로 읽으면서 SHA-256 계산 + 디스크 저장. (digest, 원본 경로) 반환, digest 는 pin 된 상태"""
+        async def chunks():
+            while True:
+                chunk = await upload.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+        return await self.ingest_stream(chunks(), ext, tee)
+
+    async def ingest_stream(self, chunks, ext, tee=None):
+        # tee: 청크마다 같이 넘겨줄 async 콜백 (예: FFmpeg stdin)
+        # 해시 계산 + 디스크 쓰기는 스레드에서 (몇 GB 올라오는 동안 다른 요청이 멈추지 않게)
+        # 요청 본문은 작은 조각으로 오니까 CHUNK_SIZE 만큼 모아서 한 번에 넘김
+        sha = hashlib.sha256()
+        staging = self.staging_path(ext)
+
+        def write(f, data):
+            sha.update(data)
+            f.write(data)
+
+        try:
+            with open(staging, "wb") as f:
+                pending, size = [], 0
+                async for chunk in chunks:
+                    if not chunk:
+                        continue
+                    if tee is not None:
+                        await tee(chunk)
+                    pending.append(chunk)
+                    size += len(chunk)
+                    if size >= CHUNK_SIZE:
+                        await asyncio.to_thread(write, f, b"".join(pending))
+                        pending, size = [], 0
+                if pending:
+                    await asyncio.to_thread(write, f, b"".join(pending))
+            digest = sha.hexdigest()
+            # 호출한 쪽이 작업 끝나면 unpin() 해야 함
+            self.pin(digest)
+            return digest, self.adopt(staging, digest, f"source.{ext}")
+        except Exception:
+            staging.unlink(missing_ok=True)
+            raise
+
+    # --------------------------------------------------------
+    # 정리 (TTL 만료 + 디스크 한도 LRU)
+    # --------------------------------------------------------
+    def _scan(self):
+        files = []
+        for d in self.root.iterdir():
+            if not d.is_dir():
+                continue
+            for p in d.iterdir():
+                if p.is_file():
+                    st = p.stat()
+                    files.append((d.name, p, st.st_size, self._access.get((d.name, p.name), st.st_mtime)))
+                elif p.is_dir() and p.name.startswith(".tmp-"):
+                    # 작업 중 만든 폴더도 디스크 쓰니까 한도에 넣고, 오래되면 통째로 지움
+                    files.append((d.name, p, *tree_stat(p)))
+        return files
+
+    def usage(self):
+        files = self._scan()
+        return {"bytes": sum(f[2] for f in files), "files": len(files), "quota_bytes": self.quota_bytes}
+
+    def _remove(self, digest, path, size):
+        if path.is_dir():
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            path.unlink(missing_ok=True)
+        self._access.pop((digest, path.name), None)
+        self.evicted_files += 1
+        self.evicted_bytes += size
+
+    def sweep(self):
+        now = time.time()
+        with self._locks_guard:
+            pinned = set(self._pins)
+
+        # 업로드 도중 끊긴 임시 파일
+        for p in self.root.glob(".tmp-*"):
+            if p.is_file() and now - p.stat().st_mtime > STALE_TMP_SEC:
+                p.unlink(missing_ok=True)
+            elif p.is_dir() and now - tree_stat(p)[1] > STALE_TMP_SEC:
+                shutil.rmtree(p, ignore_errors=True)
+
+        files = self._scan()
+        total = sum(f[2] for f in files)
+        alive = []
+        for digest, path, size, last in files:
+            if digest in pinned:
+                continue
+            if path.name.startswith(".tmp-"):
+                if now - last > STALE_TMP_SEC:
+                    self._remove(digest, path, size)
+                    total -= size
+                continue
+            if now - last > self.ttl_sec:
+                self._remove(digest, path, size)
+                total -= size
+            else:
+                alive.append((last, digest, path, size))
+
+        # 한도 넘으면 오래 안 쓴 파일부터 90% 까지 비움
+        if total > self.quota_bytes:
+            target = self.quota_bytes * 0.9
+            for last, digest, path, size in sorted(alive, key=lambda f: f[0]):
+                if total <= target:
+                    break
+                self._remove(digest, path, size)
+                total -= size
+
+        # 빈 폴더, 안 쓰는 락 정리
+        for d in self.root.iterdir():
+            if d.is_dir() and d.name not in pinned and not any(d.iterdir()):
+                d.rmdir()
+                with self._locks_guard:
+                    lock = self._locks.get(d.name)
+                    if lock is not None and not lock.locked():
+                        del self._locks[d.name]
+        return total
+
+    def start_janitor(self, interval=CLEANUP_INTERVAL_SEC, on_sweep=None):
+        # 요청 처리랑 상관없이 백그라운드 스레드에서 주기적으로 정리
+        def loop():
+            while not self._stop.wait(interval):
+                try:
+                    used = self.sweep()
+                    if on_sweep:
+                        on_sweep()
+                    print(f"🧹 산출물 정리 완료: {used / 1024 ** 2:.1f}MB 사용 중")
+                except Exception as e:
+                    print(f"⚠️ 산출물 정리 실패: {e}")
+
+        self._stop.clear()
+        self._janitor = threading.Thread(target=loop, name="walnut-janitor", daemon=True)
+        self._janitor.start()
+
+    def stop_janitor(self):
+        self._stop.set()
@@ -0,0 +1,199 @@
+import os
+import re
+import asyncio
+import subprocess
+from pathlib import Path
+
+# ========================================================
+# 오디오 추출 (FFmpeg)
+# ========================================================
+CREATE_NO_WINDOW = subprocess.CREATE_NO_WINDOW if os.name == "nt" else 0
+
+# STT 전용 프로필: 16kHz 모노 저비트레이트 (Whisper 는 어차피 16kHz 로 다운샘플함)
+# 32kbps 면 1시간에 약 14MB
+STT_SAMPLE_RATE = 16000
+STT_BITRATE = os.getenv("WALNUT_STT_BITRATE", "32k")
+
+# Whisper API 업로드 한도 25MB, 여유 두고 24MB
+WHISPER_MAX_BYTES = int(os.getenv("WALNUT_WHISPER_MAX_BYTES", str(24 * 1024 * 1024)))
+# 0 이면 용량 한도 넘을 때만 자름. 값을 주면 그 길이(초)로 잘라서 병렬 STT
+STT_CHUNK_SEC = float(os.getenv("WALNUT_STT_CHUNK_SEC", "0"))
+# 자를 위치를 찾을 무음 기준
+SILENCE_NOISE = os.getenv("WALNUT_SILENCE_NOISE", "-35dB")
+SILENCE_MIN_SEC = 0.3
+
+
+def extract_cmd(ffmpeg, src, dst):
+    # src 에 "pipe:0" 을 넣으면 stdin 으로 받음
+    return [
+        ffmpeg, "-y", "-i", str(src),
+        "-vn", "-ac", "1", "-ar", str(STT_SAMPLE_RATE),
+        "-acodec", "libmp3lame", "-b:a", STT_BITRATE, str(dst)
+    ]
+
+
+def extract_audio(ffmpeg, src, dst):
+    subprocess.run(extract_cmd(ffmpeg, src, dst), check=True, creationflags=CREATE_NO_WINDOW)
+
+
+def extract_window(ffmpeg, src, dst, start, duration):
+    # -ss / -t 를 입력 쪽에 줘서 그 구간만 읽음 (창 하나 뽑는데 처음부터 디코딩 안 함)
+    cmd = extract_cmd(ffmpeg, src, dst)
+    cmd[2:2] = ["-ss", f"{start:.3f}", "-t", f"{duration:.3f}"]
+    subprocess.run(cmd, check=True, creationflags=CREATE_NO_WINDOW)
+
+
+def plan_windows(duration, window_sec, overlap_sec):
+    """
+    긴 영상을 창 단위로 나눔. [(맡을 구간 시작, 끝, 오디오 시작, 끝), ...]
+    오디오는 앞뒤로 overlap 만큼 더 뽑아서 경계에 걸린 단어도 온전히 들리게 하고,
+    단어는 가운데 시점이 맡은 구간 안에 있는 것만 씀 (겹친 부분 중복 없이)
+    """
+    count = max(1, round(duration / window_sec))
+    size = duration / count
+    windows = []
+    for i in range(count):
+        start, end = i * size, duration if i == count - 1 else (i + 1) * size
+        windows.append((start, end, max(0.0, start - overlap_sec), min(duration, end + overlap_sec)))
+    return windows
+
+
+class StreamingExtractor:
+    """
+    업로드 바이트를 디스크에 쓰는 동시에 FFmpeg stdin 으로 흘려서 오디오를 뽑는다.
+    moov 가 파일 끝에 있는 MP4 처럼 파이프로 못 읽는 파일이면 ok=False 로 끝나고,
+    파이프라인이 저장된 원본으로 다시 추출한다.
+    """
+
+    def __init__(self, ffmpeg, dst):
+        self.ffmpeg = ffmpeg
+        self.dst = Path(dst)
+        self.proc = None
+        self.alive = False
+        self.ok = False
+
+    async def start(self):
+        self.proc = await asyncio.create_subprocess_exec(
+            *extract_cmd(self.ffmpeg, "pipe:0", self.dst),
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.DEVNULL,
+            creationflags=CREATE_NO_WINDOW,
+        )
+        self.alive = True
+        return self
+
+    async def feed(self, chunk):
+        if not self.alive:
+            return
+        try:
+            self.proc.stdin.write(chunk)
+            await self.proc.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            # FFmpeg 가 먼저 죽음 → 업로드는 계속 받고 나중에 파일로 추출
+            self.alive = False
+
+    async def finish(self, source=None):
+        if self.proc is None:
+            return False
+        if self.alive:
+            try:
+                self.proc.stdin.close()
+                await self.proc.stdin.wait_closed()
+            except (BrokenPipeError, ConnectionResetError):
+                self.alive = False
+        code = await self.proc.wait()
+        self.ok = self.alive and code == 0 and self.dst.exists()
+        if self.ok and source is not None:
+            # moov 가 끝에 있으면 FFmpeg 가 빈 오디오를 만들고도 0 으로 끝남 → 길이로 확인
+            expected, got = await asyncio.gather(
+                asyncio.to_thread(probe_duration, self.ffmpeg, source),
+                asyncio.to_thread(probe_duration, self.ffmpeg, self.dst),
+            )
+            self.ok = got > 0 and got >= expected - 1.0
+        if not self.ok:
+            self.dst.unlink(missing_ok=True)
+        return self.ok
+
+    async def abort(self):
+        if self.proc is not None and self.proc.returncode is None:
+            self.proc.kill()
+            await self.proc.wait()
+        self.dst.unlink(missing_ok=True)
+
+
+# --------------------------------------------------------
+# 용량 한도 넘는 오디오 자르기 (무음 위치 기준)
+# --------------------------------------------------------
+def _parse_time(h, m, sec):
+    return int(h) * 3600 + int(m) * 60 + float(sec)
+
+
+def probe_duration(ffmpeg, src):
+    # ffprobe 없이 ffmpeg -i 로그의 Duration 으로 길이 확인
+    res = subprocess.run(
+        [ffmpeg, "-hide_banner", "-i", str(src)],
+        capture_output=True, text=True, creationflags=CREATE_NO_WINDOW
+    )
+    m = re.search(r"Duration: (\d+):(\d+):([\d.]+)", res.stderr)
+    return _parse_time(*m.groups()) if m else 0.0
+
+
+def probe_silences(ffmpeg, src):
+    """(전체 길이, [(무음 시작, 무음 끝), ...]) — silencedetect 한 번으로 둘 다 얻음"""
+    res = subprocess.run(
+        [ffmpeg, "-hide_banner", "-i", str(src),
+         "-af", f"silencedetect=noise={SILENCE_NOISE}:d={SILENCE_MIN_SEC}", "-f", "null", "-"],
+        capture_output=True, text=True, check=True, creationflags=CREATE_NO_WINDOW
+    )
+    log = res.stderr
+    m = re.search(r"Duration: (\d+):(\d+):([\d.]+)", log)
+    duration = _parse_time(*m.groups()) if m else 0.0
+    starts = [float(x) for x in re.findall(r"silence_start: (-?[\d.]+)", log)]
+    ends = [float(x) for x in re.findall(r"silence_end: ([\d.]+)", log)]
+    silences = list(zip(starts, ends + [duration] * (len(starts) - len(ends))))
+    return duration, silences
+
+
+def plan_chunks(duration, silences, max_sec):
+    """max_sec 를 넘지 않게, 목표 지점 바로 앞 무음 가운데에서 자름. [(start, end), ...]"""
+    cuts = [0.0]
+    mids = sorted((a + b) / 2 for a, b in silences)
+    while duration - cuts[-1] > max_sec:
+        limit = cuts[-1] + max_sec
+        # 청크 뒤쪽 30% 구간 안에 있는 무음 중 제일 늦은 곳
+        window = [t for t in mids if limit - max_sec * 0.3 <= t < limit]
+        cuts.append(window[-1] if window else limit)
+    cuts.append(duration)
+    return list(zip(cuts[:-1], cuts[1:]))
+
+
+def split_audio(ffmpeg, src, out_dir, max_bytes=WHISPER_MAX_BYTES, chunk_sec=STT_CHUNK_SEC):
+    """
+    한도 안이면 [(src, 0.0)] 그대로.
+    넘으면 무음 위치에서 잘라 [(청크 경로, 시작 오프셋), ...] 반환
+    """
+    size = Path(src).stat().st_size
+    if size <= max_bytes and not chunk_sec:
+        return [(Path(src), 0.0)]
+
+    duration, silences = probe_silences(ffmpeg, src)
+    if duration <= 0:
+        return [(Path(src), 0.0)]
+    # 비트레이트 기준으로 한도에 맞는 길이 계산 (10% 여유)
+    max_sec = duration * max_bytes / size * 0.9
+    if chunk_sec:
+        max_sec = min(max_sec, chunk_sec)
+    if duration <= max_sec:
+        return [(Path(src), 0.0)]
+
+    chunks = []
+    for i, (start, end) in enumerate(plan_chunks(duration, silences, max_sec)):
+        dst = Path(out_dir) / f"chunk{i:03d}{Path(src).suffix}"
+        subprocess.run(
+            [ffmpeg, "-y", "-hide_banner", "-loglevel", "error",
+             "-ss", f"{start:.3f}", "-t", f"{end - start:.3f}", "-i", str(src), "-c", "copy", str(dst)],
+            check=True, creationflags=CREATE_NO_WINDOW
+        )
+        chunks.append((dst, start))
+    return chunks
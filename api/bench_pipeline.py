@@ -0,0 +1,433 @@
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import random
+import argparse
+import tempfile
+import threading
+import subprocess
+from pathlib import Path
+from types import SimpleNamespace
+from concurrent.futures import ThreadPoolExecutor
+
+# ========================================================
+# 파이프라인 전체 벤치마크 (오프라인)
+# - FFmpeg lavfi 로 테스트 영상 생성
+# - Whisper / Gemini 는 지연시간·실패율을 줄 수 있는 가짜로 교체 (네트워크 안 씀)
+# - /upload/video, /upload/text 를 동시 요청 수별로 돌려서
+#   단계별 지연, 분당 작업 수, 최대 RSS / 디스크 사용량 출력
+# 사용법: python bench_pipeline.py --seconds 60,300 --concurrency 1,2,4 --jobs 8
+# ========================================================
+WORDS = ["so", "we", "are", "going", "to", "talk", "about", "the", "model", "today", "and",
+         "it", "is", "really", "simple", "once", "you", "see", "how", "data", "flows"]
+
+
+def pick(values, cast=float):
+    return [cast(v) for v in str(values).split(",") if v]
+
+
+# --------------------------------------------------------
+# 테스트 영상 (lavfi)
+# --------------------------------------------------------
+def make_video(ffmpeg, path, seconds, size):
+    # 4초마다 1초 무음 → 무음 기준 오디오 분할도 실제처럼 동작
+    subprocess.run([
+        ffmpeg, "-hide_banner", "-loglevel", "error", "-y",
+        "-f", "lavfi", "-i", f"testsrc2=size={size}:rate=25",
+        "-f", "lavfi", "-i", "sine=frequency=300:sample_rate=44100",
+        "-af", "volume='if(lt(mod(t,4),3),1,0)':eval=frame",
+        "-t", str(seconds), "-c:v", "libx264", "-preset", "ultrafast", "-g", "50",
+        "-c:a", "aac", "-shortest", "-movflags", "+faststart", str(path)
+    ], check=True)
+
+
+def make_variant(ffmpeg, base, path, tag):
+    # 내용 해시가 작업마다 달라야 캐시 안 타고 전체 파이프라인을 돎 (메타데이터만 바꿔서 -c copy)
+    # faststart 안 주면 moov 가 파일 끝으로 가서 --stream 이 파이프 추출 실패 경로만 재게 됨
+    subprocess.run([
+        ffmpeg, "-hide_banner", "-loglevel", "error", "-y", "-i", str(base),
+        "-map", "0", "-c", "copy", "-metadata", f"comment=walnut-bench-{tag}",
+        "-movflags", "+faststart", str(path)
+    ], check=True)
+
+
+# --------------------------------------------------------
+# 가짜 Whisper / Gemini
+# --------------------------------------------------------
+class FakeRateLimit(Exception):
+    # openai / google SDK 의 429 예외처럼 status_code 를 달고 옴
+    status_code = 429
+
+
+class FakeFailure(Exception):
+    pass
+
+
+class Fakes:
+    def __init__(self, args):
+        self.args = args
+        self.rnd = random.Random(args.seed)
+        self.lock = threading.Lock()
+        self.calls = {"stt": 0, "llm": 0, "stt_fail": 0, "llm_fail": 0, "stt_429": 0, "llm_429": 0, "llm_dropped": 0}
+        self.recent = {"stt": [], "llm": []}
+        bitrate = os.getenv("WALNUT_STT_BITRATE", "32k").lower()
+        self.stt_bps = float(bitrate[:-1]) * 1000 if bitrate.endswith("k") else float(bitrate)
+
+    def _quota(self, kind, rpm):
+        # 최근 60초 호출 수가 rpm 을 넘으면 429 (실제 API 요청 한도 흉내)
+        if not rpm:
+            return
+        now = time.monotonic()
+        with self.lock:
+            recent = self.recent[kind] = [t for t in self.recent[kind] if now - t < 60]
+            if len(recent) >= rpm:
+                self.calls[f"{kind}_429"] += 1
+                raise FakeRateLimit(f"가짜 {kind} 요청 한도 초과")
+            recent.append(now)
+
+    def _roll(self, kind, rate):
+        with self.lock:
+            self.calls[kind] += 1
+            failed = self.rnd.random() < rate
+            if failed:
+                self.calls[f"{kind}_fail"] += 1
+            jitter = self.rnd.uniform(1 - self.args.jitter, 1 + self.args.jitter)
+        return failed, jitter
+
+    def transcribe(self, model, file, **kwargs):
+        self._quota("stt", self.args.stt_rpm)
+        data = file.read()
+        duration = len(data) * 8 / self.stt_bps
+        failed, jitter = self._roll("stt", self.args.stt_fail)
+        time.sleep((self.args.stt_latency + duration * self.args.stt_rtf) * jitter)
+        if failed:
+            raise FakeFailure("가짜 Whisper 실패")
+
+        # 같은 영상에서 뽑은 오디오라도 호출마다 다른 대본 (번역 캐시가 작업 간에 안 맞게)
+        with self.lock:
+            rnd = random.Random(self.rnd.random())
+        words, t = [], 0.0
+        while t < duration - 0.5:
+            w = " " + (rnd.choice(WORDS) if rnd.random() < 0.8 else f"n{rnd.randrange(10 ** 6)}")
+            if rnd.random() < 0.08:
+                w += rnd.choice(".?!")
+            dur = 1 / self.args.words_per_sec * rnd.uniform(0.6, 1.0)
+            words.append({"word": w, "start": round(t, 3), "end": round(t + dur, 3)})
+            t += 1 / self.args.words_per_sec + (rnd.uniform(0.35, 1.0) if rnd.random() < 0.04 else 0)
+        text = "".join(w["word"] for w in words).strip()
+        payload = {"language": "english", "text": text, "words": words,
+                   "segments": [{"start": 0.0, "end": duration, "text": text}]}
+        return SimpleNamespace(model_dump=lambda: payload)
+
+    def openai_client(self, *args, **kwargs):
+        return SimpleNamespace(audio=SimpleNamespace(transcriptions=SimpleNamespace(create=self.transcribe)))
+
+    def generative_model(self, *args, **kwargs):
+        fakes = self
+
+        class FakeModel:
+            def generate_content(self, prompt, **kw):
+                fakes._quota("llm", fakes.args.llm_rpm)
+                failed, jitter = fakes._roll("llm", fakes.args.llm_fail)
+                match = re.search(r"번역할 텍스트:\s*\n\s*(\[.*\])\s*\n", prompt)
+                items = json.loads(match.group(1)) if match else []
+                time.sleep((fakes.args.llm_latency + len(items) * fakes.args.llm_per_item) * jitter)
+                if failed:
+                    raise FakeFailure("가짜 Gemini 실패")
+                if match:
+                    # --llm-drop: 응답에서 문장 몇 개를 빼먹는 모델 흉내 (빠진 id 만 다시 보내는지 확인용)
+                    with fakes.lock:
+                        keep = [d for d in items if fakes.rnd.random() >= fakes.args.llm_drop]
+                        fakes.calls["llm_dropped"] += len(items) - len(keep)
+                    text = json.dumps([{"id": d["id"], "ko": f"[ko] {d['text'].strip()}"} for d in keep],
+                                      ensure_ascii=False)
+                else:
+                    text = "1. 강의\n2. 차분한 존댓말\n3. 설명하듯 자연스럽게"
+                usage = SimpleNamespace(prompt_token_count=len(prompt) // 3, candidates_token_count=len(text) // 3)
+                return SimpleNamespace(text=text, usage_metadata=usage)
+
+        return FakeModel()
+
+
+# --------------------------------------------------------
+# 자원 사용량 샘플링 (RSS: 서버 + FFmpeg 자식 프로세스 / 디스크: 산출물 폴더)
+# --------------------------------------------------------
+def _rss(pid):
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+
+def _children(pid):
+    out = []
+    for d in os.listdir("/proc"):
+        if d.isdigit():
+            try:
+                with open(f"/proc/{d}/stat") as f:
+                    if int(f.read().rsplit(")", 1)[1].split()[1]) == pid:
+                        out.append(int(d))
+            except (OSError, IndexError, ValueError):
+                pass
+    return out
+
+
+def _du(root):
+    total = 0
+    for dirpath, _, files in os.walk(root):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, name))
+            except OSError:
+                pass
+    return total
+
+
+class Sampler(threading.Thread):
+    def __init__(self, root, interval=0.25):
+        super().__init__(daemon=True)
+        self.root, self.interval = root, interval
+        self.peak_rss = self.peak_children_rss = self.peak_disk = 0
+        self._done = threading.Event()
+
+    def run(self):
+        pid = os.getpid()
+        has_proc = os.path.exists("/proc/self/status")
+        while not self._done.is_set():
+            if has_proc:
+                own = _rss(pid)
+                kids = sum(_rss(c) for c in _children(pid))
+                self.peak_rss = max(self.peak_rss, own + kids)
+                self.peak_children_rss = max(self.peak_children_rss, kids)
+            self.peak_disk = max(self.peak_disk, _du(self.root))
+            self._done.wait(self.interval)
+
+    def stop(self):
+        self._done.set()
+        self.join()
+        if not self.peak_rss:
+            # /proc 없는 환경: 프로세스 전체 기간 최대값으로 대신
+            import resource
+            self.peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+# --------------------------------------------------------
+# 서버 + 부하
+# --------------------------------------------------------
+def start_server(app):
+    import uvicorn
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=0, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+    port = server.servers[0].sockets[0].getsockname()[1]
+    return server, thread, f"http://127.0.0.1:{port}"
+
+
+def run_video(client, path, args):
+    t0 = time.perf_counter()
+    with open(path, "rb") as f:
+        if args.stream:
+            r = client.post(f"/upload/video/stream?output={args.output}", content=f)
+        else:
+            r = client.post(f"/upload/video?output={args.output}", files={"file": ("bench.mp4", f, "video/mp4")})
+    r.raise_for_status()
+    upload_sec = time.perf_counter() - t0
+    job_id = r.json()["job_id"]
+    while True:
+        job = client.get(f"/jobs/{job_id}").json()
+        if job["status"] in ("done", "failed"):
+            break
+        time.sleep(args.poll)
+    total = time.perf_counter() - t0
+    trace = client.get(f"/jobs/{job_id}?trace=1").json().get("trace", [])
+    return {"ok": job["status"] == "done", "sec": total, "upload_sec": upload_sec, "trace": trace, "error": job["error"]}
+
+
+def run_text(client, path, args):
+    t0 = time.perf_counter()
+    with open(path, "rb") as f:
+        r = client.post("/upload/text", files={"file": ("bench.mp4", f, "video/mp4")})
+    return {"ok": r.status_code == 200, "sec": time.perf_counter() - t0, "upload_sec": None, "trace": [],
+            "error": None if r.status_code == 200 else r.text[:200]}
+
+
+def pct(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def summarize(results, wall):
+    ok = [r for r in results if r["ok"]]
+    stages = {}
+    for r in ok:
+        per_job = {}
+        for sp in r["trace"]:
+            d = per_job.setdefault(sp["stage"], [0.0, 0.0])
+            d[0] += sp["sec"]
+            d[1] += sp.get("wait_sec", 0.0)
+        for name, (sec, wait) in per_job.items():
+            stages.setdefault(name, []).append((sec, wait))
+    return {
+        "jobs": len(results),
+        "ok": len(ok),
+        "failed": len(results) - len(ok),
+        "wall_sec": round(wall, 2),
+        "jobs_per_min": round(len(ok) / wall * 60, 2) if wall else 0.0,
+        "latency_p50": round(pct([r["sec"] for r in ok], 50), 3),
+        "latency_p95": round(pct([r["sec"] for r in ok], 95), 3),
+        "stages": {
+            name: {
+                "p50": round(pct([s for s, _ in v], 50), 3),
+                "p95": round(pct([s for s, _ in v], 95), 3),
+                "wait_p95": round(pct([w for _, w in v], 95), 3),
+            }
+            for name, v in stages.items()
+        },
+        "errors": sorted({r["error"] for r in results if r["error"]})[:5],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seconds", default="60", help="테스트 영상 길이(초), 쉼표로 여러 개")
+    parser.add_argument("--concurrency", default="1,2,4", help="동시 요청 수, 쉼표로 여러 개")
+    parser.add_argument("--jobs", type=int, default=0, help="단계(동시 요청 수)마다 돌릴 작업 수 (기본: 동시 요청 수 x2)")
+    parser.add_argument("--endpoint", choices=["video", "text", "both"], default="video")
+    parser.add_argument("--output", default="soft", help="soft / soft_mkv / hard")
+    parser.add_argument("--stream", action="store_true", help="/upload/video/stream 으로 업로드")
+    parser.add_argument("--size", default="640x360")
+    parser.add_argument("--stt-latency", type=float, default=0.5, help="Whisper 호출당 기본 지연(초)")
+    parser.add_argument("--stt-rtf", type=float, default=0.02, help="오디오 1초당 추가 지연(초)")
+    parser.add_argument("--stt-fail", type=float, default=0.0, help="Whisper 실패 확률")
+    parser.add_argument("--llm-latency", type=float, default=0.8, help="Gemini 호출당 기본 지연(초)")
+    parser.add_argument("--llm-per-item", type=float, default=0.01, help="번역 문장당 추가 지연(초)")
+    parser.add_argument("--llm-fail", type=float, default=0.0, help="Gemini 실패 확률")
+    parser.add_argument("--llm-drop", type=float, default=0.0, help="Gemini 응답에서 문장이 빠질 확률")
+    parser.add_argument("--stt-rpm", type=int, default=0, help="가짜 Whisper 분당 요청 한도 (넘으면 429, 0=무제한)")
+    parser.add_argument("--llm-rpm", type=int, default=0, help="가짜 Gemini 분당 요청 한도 (넘으면 429, 0=무제한)")
+    parser.add_argument("--jitter", type=float, default=0.2, help="지연 흔들림 비율 (0.2 = ±20%%)")
+    parser.add_argument("--words-per-sec", type=float, default=2.5)
+    parser.add_argument("--poll", type=float, default=0.2)
+    parser.add_argument("--seed", type=int, default=1022)
+    parser.add_argument("--ffmpeg", default="ffmpeg")
+    parser.add_argument("--json", help="결과를 JSON 파일로도 저장 (회귀 비교용)")
+    parser.add_argument("--keep", action="store_true")
+    args = parser.parse_args()
+
+    work = Path(tempfile.mkdtemp(prefix="walnut-bench-pipeline-"))
+    # main 을 import 하기 전에 저장 위치를 작업 폴더로 돌려놔야 실제 캐시/업로드 폴더를 안 건드림
+    os.environ["WALNUT_UPLOAD_DIR"] = str(work / "artifacts")
+    os.environ["WALNUT_TM_PATH"] = str(work / "tm.sqlite3")
+    os.environ.setdefault("OPENAI_API_KEY", "bench")
+    os.environ.setdefault("GEMINI_API_KEY", "bench")
+
+    import httpx
+    import main as walnut
+    from artifacts import ArtifactStore
+    from translation_cache import TranslationCache
+    from checkpoints import ManifestStore
+
+    fakes = Fakes(args)
+    walnut.OpenAI = fakes.openai_client
+    walnut.genai.GenerativeModel = fakes.generative_model
+    walnut.genai.configure = lambda **kwargs: None
+    walnut.FFMPEG_CMD = args.ffmpeg
+
+    server, thread, base_url = start_server(walnut.app)
+    levels = pick(args.concurrency, int)
+    endpoints = ["video", "text"] if args.endpoint == "both" else [args.endpoint]
+    report = {"args": vars(args), "cpu": os.cpu_count(), "runs": []}
+    serial = 0
+
+    try:
+        for seconds in pick(args.seconds):
+            base = work / f"base-{seconds:g}.mp4"
+            print(f"🎬 테스트 영상 생성 중... ({seconds:g}초, {args.size})")
+            make_video(args.ffmpeg, base, seconds, args.size)
+
+            for endpoint in endpoints:
+                for level in levels:
+                    n = args.jobs or level * 2
+                    # 단계마다 산출물/번역 캐시를 비워서 서로 영향 안 주게
+                    run_dir = work / f"run-{serial}"
+                    walnut.artifacts = ArtifactStore(run_dir / "artifacts")
+                    walnut.manifests = ManifestStore(walnut.artifacts)
+                    walnut.translation_cache = TranslationCache(str(run_dir / "tm.sqlite3"))
+                    files = []
+                    for i in range(n):
+                        path = work / f"input-{serial}-{i}.mp4"
+                        make_variant(args.ffmpeg, base, path, f"{serial}-{i}")
+                        files.append(path)
+                    serial += 1
+
+                    sampler = Sampler(run_dir)
+                    sampler.start()
+                    fn = run_video if endpoint == "video" else run_text
+                    t0 = time.perf_counter()
+                    with httpx.Client(base_url=base_url, timeout=None) as client, \
+                            ThreadPoolExecutor(max_workers=level) as pool:
+                        results = list(pool.map(lambda p: fn(client, p, args), files))
+                    wall = time.perf_counter() - t0
+                    sampler.stop()
+                    for p in files:
+                        p.unlink(missing_ok=True)
+
+                    summary = summarize(results, wall)
+                    summary.update({
+                        "endpoint": endpoint, "seconds": seconds, "concurrency": level,
+                        "peak_rss_mb": round(sampler.peak_rss / 1024 ** 2, 1),
+                        "peak_ffmpeg_rss_mb": round(sampler.peak_children_rss / 1024 ** 2, 1),
+                        "peak_disk_mb": round(sampler.peak_disk / 1024 ** 2, 1),
+                        "schedulers": {s.name: s.stats() for s in (walnut.whisper_scheduler, walnut.gemini_scheduler)},
+                    })
+                    report["runs"].append(summary)
+                    print_run(summary)
+    finally:
+        server.should_exit = True
+        thread.join(timeout=5)
+        report["fake_calls"] = fakes.calls
+        if args.json:
+            Path(args.json).write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+            print(f"📝 결과 저장: {args.json}")
+        if args.keep:
+            print(f"작업 폴더: {work}")
+        else:
+            shutil.rmtree(work, ignore_errors=True)
+
+    print(f"가짜 API 호출: {fakes.calls}")
+    # 실패율을 안 줬는데 실패한 작업이 있으면 회귀
+    expect_failures = args.stt_fail or args.llm_fail
+    return 0 if expect_failures or all(r["failed"] == 0 for r in report["runs"]) else 1
+
+
+def print_run(s):
+    print("------------------------------------------------")
+    print(f"[{s['endpoint']}] {s['seconds']:g}초 영상 · 동시 {s['concurrency']} · 작업 {s['jobs']}개 "
+          f"(성공 {s['ok']} / 실패 {s['failed']})")
+    print(f"  전체 {s['wall_sec']:.2f}s · 분당 {s['jobs_per_min']:.1f}건 · "
+          f"지연 p50 {s['latency_p50']:.2f}s / p95 {s['latency_p95']:.2f}s")
+    print(f"  최대 RSS {s['peak_rss_mb']:.0f}MB (FFmpeg {s['peak_ffmpeg_rss_mb']:.0f}MB) · "
+          f"최대 디스크 {s['peak_disk_mb']:.1f}MB")
+    if s["stages"]:
+        print(f"  {'단계':<14}{'p50':>8}{'p95':>8}{'대기p95':>9}")
+        for name, st in s["stages"].items():
+            print(f"  {name:<14}{st['p50']:>8.3f}{st['p95']:>8.3f}{st['wait_p95']:>9.3f}")
+    for name, st in s.get("schedulers", {}).items():
+        print(f"  {name} 스케줄러: 동시 한도 {st['limit']} · 429 누적 {st['rate_limited']}회 · 일시 오류 재시도 {st['transient_errors']}회")
+    for err in s["errors"]:
+        print(f"  ⚠️ {err}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
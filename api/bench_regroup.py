@@ -0,0 +1,141 @@
+import sys
+import time
+import random
+import argparse
+import tracemalloc
+from types import SimpleNamespace
+
+import segmentation
+from segmentation import regroup
+
+# ========================================================
+# 자막 분할 벤치마크: 기존 regroup_words_dynamic vs 배열 기반 엔진
+# 사용법: python bench_regroup.py --words 100000
+# ========================================================
+
+
+# 분할 엔진으로 바꾸기 전 main.py 에 있던 구현 (결과 비교/속도 기준용)
+def regroup_words_dynamic(words):
+    segments = []
+    current = {"text": "", "start": 0, "end": 0, "words": []}
+    MAX_SILENCE = 0.3
+    MAX_CHARS = 35
+
+    for word_obj in words:
+        word = word_obj.word
+        start = word_obj.start
+        end = word_obj.end
+
+        if current["words"]:
+            silence = start - current["words"][-1].end
+            if silence > MAX_SILENCE:
+                current["end"] = current["words"][-1].end
+                segments.append(current)
+                current = {"text": "", "start": start, "end": 0, "words": []}
+
+        if not current["words"]:
+            current["start"] = start
+        current["text"] += word
+        current["words"].append(word_obj)
+        current["end"] = end
+
+        too_long = len(current["text"]) > MAX_CHARS
+        sentence_end = word.strip() and word.strip()[-1] in ".?!"
+
+        if too_long or sentence_end:
+            segments.append(current)
+            current = {"text": "", "start": 0, "end": 0, "words": []}
+
+    if current["words"]:
+        segments.append(current)
+    return segments
+
+
+def make_words(n, seed):
+    rnd = random.Random(seed)
+    vocab = ["the", "a", "really", "okay", "so", "we", "going", "to", "talk", "about",
+             "this", "model", "actually", "lecture", "right", "you", "know", "data"]
+    words, t = [], 0.0
+    for _ in range(n):
+        w = " " + rnd.choice(vocab)
+        r = rnd.random()
+        if r < 0.06:
+            w += rnd.choice(".?!")
+        elif r < 0.08:
+            w += ","
+        dur = rnd.uniform(0.08, 0.45)
+        words.append({"word": w, "start": round(t, 3), "end": round(t + dur, 3)})
+        # 가끔 긴 무음
+        t += dur + (rnd.uniform(0.31, 2.0) if rnd.random() < 0.05 else rnd.uniform(0.0, 0.25))
+    return words
+
+
+def timed(fn, *args, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        out = fn(*args)
+        best = min(best, time.perf_counter() - t0)
+    return out, best
+
+
+def memory(fn, *args):
+    # 시간 측정이랑 따로 (tracemalloc 켜면 느려짐). 결과를 들고 있는 상태의 메모리 + 피크
+    tracemalloc.start()
+    out = fn(*args)
+    held, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del out
+    return held, peak
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--words", type=int, default=100_000)
+    parser.add_argument("--seed", type=int, default=1022)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    words = make_words(args.words, args.seed)
+    objs = [SimpleNamespace(**w) for w in words]
+
+    # 기존: Whisper 단어 객체 그대로 / 파이프라인처럼 JSON(dict) 에서 객체로 바꾸는 비용 포함
+    legacy, t_legacy = timed(regroup_words_dynamic, objs, repeat=args.repeat)
+    _, t_legacy_json = timed(lambda: regroup_words_dynamic([SimpleNamespace(**w) for w in words]), repeat=args.repeat)
+    engine, t_engine = timed(regroup, words, repeat=args.repeat)
+    _, t_engine_obj = timed(regroup, objs, repeat=args.repeat)
+
+    cols = segmentation.WordColumns.from_words(words)
+    _, t_segment = timed(segmentation.segment, cols, repeat=args.repeat)
+
+    # 파이프라인이 실제로 들고 있는 것 (regroup 결과 dict 목록) 기준
+    m_legacy = memory(regroup_words_dynamic, objs)
+    m_engine = memory(regroup, words)
+
+    legacy = [(s["text"], s["start"], s["end"]) for s in legacy]
+    engine = [(s["text"], s["start"], s["end"]) for s in engine]
+    same = legacy == engine
+
+    mb = 1024 ** 2
+    print("------------------------------------------------")
+    print(f"단어 {args.words:,}개 → 세그먼트 {len(engine):,}개 (numpy: {'O' if segmentation.np is not None else 'X'})")
+    print(f"기존 (단어 객체)       : {t_legacy * 1000:8.1f}ms")
+    print(f"기존 (dict → 객체 포함) : {t_legacy_json * 1000:8.1f}ms")
+    print(f"엔진 (dict 입력)       : {t_engine * 1000:8.1f}ms   x{t_legacy_json / t_engine:.2f}")
+    print(f"엔진 (단어 객체 입력)   : {t_engine_obj * 1000:8.1f}ms   x{t_legacy / t_engine_obj:.2f}")
+    print(f"엔진 분할만 (열 재사용)  : {t_segment * 1000:8.1f}ms")
+    print(f"메모리 기존 : 결과 보유 {m_legacy[0] / mb:6.1f}MB / 피크 {m_legacy[1] / mb:6.1f}MB")
+    print(f"메모리 엔진 : 결과 보유 {m_engine[0] / mb:6.1f}MB / 피크 {m_engine[1] / mb:6.1f}MB")
+    print(f"결과 동일: {'✅' if same else '❌'}")
+    print("------------------------------------------------")
+    if not same:
+        for i, (a, b) in enumerate(zip(legacy, engine)):
+            if a != b:
+                print(f"첫 차이 #{i}: {a} != {b}")
+                break
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,86 @@
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+from pathlib import Path
+
+from render import burn_single, burn_parallel, X264_PRESET, X264_CRF, RENDER_WORKERS
+from audio import probe_duration
+
+# ========================================================
+# 하드서브 벤치마크: 기존 단일 패스 vs 키프레임 분할 병렬
+# 사용법: python bench_render.py --seconds 600 --workers 8
+# ========================================================
+STYLE = "Fontname=Malgun Gothic,Fontsize=18,PrimaryColour=&H00FFFFFF,OutlineColour=&H00000000,BorderStyle=1,Outline=2,Shadow=1,MarginV=35"
+
+
+def make_video(ffmpeg, path, seconds, size, gop):
+    subprocess.run([
+        ffmpeg, "-hide_banner", "-loglevel", "error", "-y",
+        "-f", "lavfi", "-i", f"testsrc2=size={size}:rate=30",
+        "-f", "lavfi", "-i", "sine=frequency=440:sample_rate=48000",
+        "-t", str(seconds), "-c:v", "libx264", "-preset", "ultrafast", "-g", str(gop),
+        "-c:a", "aac", "-shortest", str(path)
+    ], check=True)
+
+
+def make_srt(path, seconds):
+    lines = []
+    t, i = 0.0, 1
+    while t < seconds:
+        a, b = t, min(t + 2.5, seconds)
+        fmt = lambda x: f"{int(x // 3600):02d}:{int(x % 3600 // 60):02d}:{int(x % 60):02d},{int(x % 1 * 1000):03d}"
+        lines.append(f"{i}\n{fmt(a)} --> {fmt(b)}\n자막 테스트 {i}번 문장입니다\n\n")
+        t += 3.0
+        i += 1
+    Path(path).write_text("".join(lines), encoding="utf-8")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seconds", type=int, default=300)
+    parser.add_argument("--size", default="1280x720")
+    parser.add_argument("--gop", type=int, default=60, help="키프레임 간격 (프레임)")
+    parser.add_argument("--workers", type=int, default=RENDER_WORKERS)
+    parser.add_argument("--preset", default=X264_PRESET)
+    parser.add_argument("--crf", default=X264_CRF)
+    parser.add_argument("--ffmpeg", default="ffmpeg")
+    parser.add_argument("--keep", action="store_true")
+    args = parser.parse_args()
+
+    work = Path(tempfile.mkdtemp(prefix="walnut-bench-"))
+    src, srt = work / "src.mp4", work / "sub.srt"
+    print(f"🎬 테스트 영상 생성 중... ({args.seconds}초, {args.size})")
+    make_video(args.ffmpeg, src, args.seconds, args.size, args.gop)
+    make_srt(srt, args.seconds)
+
+    t0 = time.perf_counter()
+    burn_single(args.ffmpeg, src, srt, work / "single.mp4", STYLE, args.preset, args.crf)
+    single = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    burn_parallel(args.ffmpeg, src, srt, work / "parallel.mp4", STYLE, work / "pieces",
+                  args.workers, args.preset, args.crf)
+    parallel = time.perf_counter() - t0
+
+    d_single = probe_duration(args.ffmpeg, work / "single.mp4")
+    d_parallel = probe_duration(args.ffmpeg, work / "parallel.mp4")
+
+    print("------------------------------------------------")
+    print(f"preset={args.preset} crf={args.crf} workers={args.workers} cpu={os.cpu_count()}")
+    print(f"단일 패스 : {single:7.2f}s  (결과 길이 {d_single:.2f}s)")
+    print(f"병렬      : {parallel:7.2f}s  (결과 길이 {d_parallel:.2f}s)")
+    print(f"속도 향상 : x{single / parallel:.2f}")
+    print("------------------------------------------------")
+
+    if args.keep:
+        print(f"결과물: {work}")
+    else:
+        shutil.rmtree(work, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
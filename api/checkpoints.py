@@ -0,0 +1,111 @@
+import time
+import threading
+
+# ========================================================
+# 작업 매니페스트 (해시 폴더마다 manifest.json)
+# ========================================================
+# 단계가 끝날 때마다 여기 적어둠 → 서버가 죽거나 FFmpeg 가 터져도 어디까지 했는지 남음.
+# 실제 체크포인트는 각 단계가 해시 폴더에 이미 쓰는 파일들:
+#   audio.mp3 / window.<창길이>.<번호>.json / transcript.json / segments.json /
+#   genre.<tag>.txt / 번역 메모리(배치마다 저장) / ko.<tag>.srt
+# 이어서 돌리면 파이프라인이 있는 파일은 건너뛰니까, 여기는 상태 조회 + 작업 id → 해시 찾기용.
+# 번역 끝내 실패한 줄이 있으면 status=partial, translate/srt/output 은 done=False 로 남음
+# (결과물은 .partial 이름 → 이어서 하면 실패한 줄만 다시 번역)
+MANIFEST_NAME = "manifest.json"
+
+# 이어서 할 지점 계산용 단계 순서
+STAGES = ("audio", "stt", "segments", "genre", "translate", "srt", "output")
+
+
+class ManifestStore:
+    def __init__(self, artifacts):
+        self.artifacts = artifacts
+        self._lock = threading.Lock()
+        self._by_job = {}   # job_id → digest (재시작하면 폴더를 뒤져서 다시 채움)
+
+    def load(self, digest):
+        if not self.artifacts.has(digest, MANIFEST_NAME):
+            return None
+        return self.artifacts.read_json(digest, MANIFEST_NAME)
+
+    def _update(self, digest, fn):
+        # 창 단위 파이프라인은 여러 스레드에서 동시에 기록함
+        with self._lock:
+            data = self.load(digest) or {"digest": digest, "jobs": [], "attempts": 0, "stages": {}}
+            fn(data)
+            data["updated_at"] = time.time()
+            self.artifacts.write_json(digest, MANIFEST_NAME, data)
+            return data
+
+    def begin(self, digest, job_id, output):
+        def fn(data):
+            data["jobs"].append(job_id)
+            data["attempts"] += 1
+            data["output"] = output
+            data["status"] = "running"
+            data["error"] = None
+            data["failed_stage"] = None
+        self._by_job[job_id] = digest
+        return self._update(digest, fn)
+
+    def stage(self, digest, name, done=True, **info):
+        # done=False: 아직 진행 중 (창 STT n/m, 번역 세그먼트 n개 등)
+        def fn(data):
+            data["stages"][name] = {"done": done, "at": time.time(), **info}
+        return self._update(digest, fn)
+
+    def finish(self, digest, status, error=None, stage=None):
+        def fn(data):
+            data["status"] = status
+            data["error"] = error
+            data["failed_stage"] = stage
+        return self._update(digest, fn)
+
+    def find(self, job_id):
+        digest = self._by_job.get(job_id)
+        if digest is not None:
+            return digest
+        for digest, data in self.scan():
+            for jid in data.get("jobs", []):
+                self._by_job[jid] = digest
+        return self._by_job.get(job_id)
+
+    def scan(self):
+        out = []
+        for path in self.artifacts.root.glob(f"*/{MANIFEST_NAME}"):
+            try:
+                out.append((path.parent.name, self.artifacts.read_json(path.parent.name, MANIFEST_NAME)))
+            except (OSError, ValueError) as e:
+                print(f"⚠️ 매니페스트 읽기 실패 ({path}): {e}")
+        return out
+
+    def recover(self):
+        # 서버 시작할 때: "running" 으로 남은 건 이전 프로세스가 죽은 것 → interrupted
+        stale = []
+        for digest, data in self.scan():
+            for jid in data.get("jobs", []):
+                self._by_job[jid] = digest
+            if data.get("status") == "running":
+                stale.append((digest, self.finish(digest, "interrupted", "서버가 작업 도중 종료됨")))
+        return stale
+
+    @staticmethod
+    def resume_point(data):
+        # 아직 안 끝난 첫 단계 (다 끝났으면 None)
+        stages = data.get("stages", {})
+        for name in STAGES:
+            if not stages.get(name, {}).get("done"):
+                return name
+        return None
+
+    @staticmethod
+    def summary(data):
+        return {
+            "status": data.get("status"),
+            "attempts": data.get("attempts"),
+            "error": data.get("error"),
+            "failed_stage": data.get("failed_stage"),
+            "completed_stages": [n for n in STAGES if data.get("stages", {}).get(n, {}).get("done")],
+            "resume_from": ManifestStore.resume_point(data),
+            "stages": data.get("stages", {}),
+        }
@@ -0,0 +1,88 @@
+import os
+import re
+from email.utils import formatdate
+from urllib.parse import quote
+
+from fastapi.responses import Response, StreamingResponse
+
+# ========================================================
+# 이어받기/탐색 가능한 파일 응답 (Range, ETag, HEAD)
+# ========================================================
+CHUNK_SIZE = 1024 * 1024
+_RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def _etag(st):
+    return f'"{st.st_size:x}-{st.st_mtime_ns:x}"'
+
+
+def _iter_file(path, start, length):
+    with open(path, "rb") as f:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+def _parse_range(header, size):
+    """(start, end) 포함 범위. 형식이 이상하면 None (전체 전송), 범위 밖이면 ValueError"""
+    m = _RANGE.match(header.strip())
+    if not m:
+        return None  # 여러 구간 요청 등은 전체 파일로 응답
+    first, last = m.groups()
+    if first == "" and last == "":
+        return None
+    if first == "":
+        # bytes=-500 → 마지막 500바이트
+        length = int(last)
+        if length == 0:
+            raise ValueError
+        return max(0, size - length), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise ValueError
+    return start, end
+
+
+def ranged_file_response(request, path, media_type, filename=None, download=False):
+    st = os.stat(path)
+    size = st.st_size
+    etag = _etag(st)
+    headers = {
+        "Accept-Ranges": "bytes",
+        "ETag": etag,
+        "Last-Modified": formatdate(st.st_mtime, usegmt=True),
+        "Cache-Control": "private, max-age=0, must-revalidate",
+    }
+    if filename:
+        kind = "attachment" if download else "inline"
+        headers["Content-Disposition"] = f"{kind}; filename*=utf-8''{quote(filename)}"
+
+    # 이미 같은 파일을 갖고 있으면 304
+    inm = request.headers.get("if-none-match")
+    if inm and (inm.strip() == "*" or etag in [t.strip() for t in inm.split(",")]):
+        return Response(status_code=304, headers=headers)
+
+    start, end, status = 0, size - 1, 200
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    # If-Range 가 현재 ETag 와 다르면 파일이 바뀐 것 → 전체 전송
+    if range_header and (not if_range or if_range.strip() == etag):
+        try:
+            parsed = _parse_range(range_header, size)
+        except ValueError:
+            return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+        if parsed:
+            start, end = parsed
+            status = 206
+            headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+
+    length = end - start + 1 if size else 0
+    headers["Content-Length"] = str(length)
+    if request.method == "HEAD":
+        return Response(status_code=status, headers=headers, media_type=media_type)
+    return StreamingResponse(_iter_file(path, start, length), status_code=status, headers=headers, media_type=media_type)
@@ -1,13 +1,21 @@
-from fastapi import FastAPI, BackgroundTasks
+from fastapi import FastAPI, BackgroundTasks, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
 from pydantic import BaseModel
-import yt_dlp
+from pathlib import Path
+from typing import Optional
 import math
-import whisper
 import os
-import torch
+import time
+import uuid
+import shutil
+import threading
 import subprocess # FFmpeg 명령어 실행용
+from concurrent.futures import ThreadPoolExecutor
+from downloads import ranged_file_response
+from metrics import REGISTRY, CONTENT_TYPE, span
+from local_stt import WhisperPool, WARMUP
+from media_source import get_source
+from info_cache import InfoCache
 
 app = FastAPI()
 
@@ -23,18 +31,35 @@ app.add_middleware(
 # 2. 가상 DB (지갑)
 fake_db = {"balance": 500}
 
-# 3. AI 모델 로딩 (서버 켤 때 한 번만!)
-print("------------------------------------------------")
-print("🚀 AI 모델 로딩 중... (그래픽카드 예열 시작)")
-# GPU(cuda)가 있으면 쓰고, 없으면 CPU를 씁니다.
-device = "cuda" if torch.cuda.is_available() else "cpu"
-print(f"🔥 사용 장치: {device} (RTX 4070Ti 성능을 보여줘!)")
+# 3. AI 모델 (서버 프로세스가 아니라 워커 프로세스들이 올려둠 → 서버는 바로 뜸)
+# 모델 크기: WALNUT_WHISPER_MODEL (기본 'medium', 더 정확하게는 'large-v3')
+# 연산 방식: WALNUT_WHISPER_COMPUTE (auto / fp32 / fp16 / int8 — CPU 서버면 int8 추천)
+# 워커 수: WALNUT_WHISPER_WORKERS (기본: 코어 수 / 메모리 보고 자동)
+# 로딩 시점: WALNUT_WHISPER_WARMUP (startup: 뜨자마자 백그라운드 / lazy: 첫 작업 때)
+whisper_pool = WhisperPool()
 
-# 모델 크기 설정: 'medium' 추천 (속도와 성능의 균형)
-# 더 정확하게 하고 싶으면 'large-v3'로 바꾸세요 (메모리 충분함)
-model = whisper.load_model("medium", device=device)
-print("✅ 모델 로딩 완료! 준비 끝.")
-print("------------------------------------------------")
+@app.on_event("startup")
+def start_whisper_pool():
+    if WARMUP == "lazy":
+        print("💤 Whisper 모델은 첫 작업 때 로딩")
+        return
+    print("------------------------------------------------")
+    whisper_pool.start()
+    print("------------------------------------------------")
+
+@app.on_event("shutdown")
+def stop_whisper_pool():
+    whisper_pool.shutdown()
+
+# 4. 작업별 폴더 (동시에 결제해도 서로 파일 안 덮어씀)
+current_dir = Path(__file__).parent
+work_dir = Path(os.getenv("WALNUT_WORK_DIR", current_dir / "jobs"))
+work_dir.mkdir(parents=True, exist_ok=True)
+# 끝난 작업 폴더 보관 시간 (초)
+JOB_TTL_SEC = int(os.getenv("WALNUT_JOB_TTL_SEC", str(24 * 3600)))
+
+jobs = {}
+jobs_lock = threading.Lock()
 
 class VideoRequest(BaseModel):
     url: str
@@ -42,6 +67,8 @@ class VideoRequest(BaseModel):
 class PaymentRequest(BaseModel):
     cost: int
     url: str
+    # video: 자막 구운 영상 / text: 자막(SRT)만 (영상은 아예 안 받음)
+    mode: str = "video"
 
 # [보조 함수] 시간 포맷 변환 (00:00:00,000)
 def format_timestamp(seconds):
@@ -51,97 +78,213 @@ def format_timestamp(seconds):
     millis = int((seconds - int(seconds)) * 1000)
     return f"{hours:02}:{minutes:02}:{secs:02},{millis:03}"
 
-# [핵심 함수] 다운로드 -> AI 분석 -> 자막 굽기
-def process_video_task(url: str):
+# URL 다운로드 (yt-dlp, 테스트 때는 로컬 파일)
+source = get_source()
+# 견적(/get-info) 때 받은 메타데이터 캐시 → 같은 URL 재조회, 결제 후 다운로드에 재사용
+info_cache = InfoCache()
+
+def new_job(url, mode="video"):
+    job_id = uuid.uuid4().hex
+    job = {"job_id": job_id, "url": url, "mode": mode, "status": "queued", "error": None, "trace": [],
+           "dir": work_dir / job_id, "created_at": time.time(), "finished_at": None}
+    job["dir"].mkdir(parents=True)
+    with jobs_lock:
+        jobs[job_id] = job
+    return job
+
+def prune_jobs():
+    # 오래된 작업 폴더 정리 (결제할 때마다 한 번씩)
+    cutoff = time.time() - JOB_TTL_SEC
+    with jobs_lock:
+        old = [j for j in jobs.values() if j["finished_at"] and j["finished_at"] < cutoff]
+        for j in old:
+            del jobs[j["job_id"]]
+    for j in old:
+        shutil.rmtree(j["dir"], ignore_errors=True)
+
+def latest_done_job():
+    with jobs_lock:
+        done = [j for j in jobs.values() if j["status"] == "done"]
+    return max(done, key=lambda j: j["finished_at"]) if done else None
+
+def download_video(job):
+    with span(job["trace"], "download_video") as sp:
+        path = source.download_video(job["url"], job["dir"], info=job["info"])
+        sp["bytes_out"] = os.path.getsize(path)
+    return path
+
+# [핵심 함수] 오디오 다운로드 -> AI 분석 -> (영상 다운로드와 동시에) -> 자막 굽기
+def process_video_task(job):
+    trace = job["trace"]
+    job_dir = job["dir"]
+    url = job["url"]
+    job["status"] = "running"
+    # 견적 때 받아둔 메타데이터가 아직 유효하면 다운로드할 때 URL 재조회 안 함
+    job["info"] = info_cache.peek(url)
+    # 영상은 굽는 단계에서만 필요 → 오디오 받고 자막 만드는 동안 옆에서 받아둠 (text 모드는 안 받음)
+    video_pool = ThreadPoolExecutor(max_workers=1) if job["mode"] == "video" else None
     try:
-        print(f"🎬 [작업 시작] URL: {url}")
+        print(f"🎬 [작업 시작] {job['job_id']} URL: {url} ({job['mode']})")
         
-        # 파일명 정의
-        video_input = "input.mp4"
-        audio_input = "input.mp3" # Whisper용 오디오
-        srt_output = "subtitle.srt"
-        video_output = "final_output.mp4"
-
-        # 기존 파일 청소
-        for f in [video_input, audio_input, srt_output, video_output]:
-            if os.path.exists(f): os.remove(f)
-
-        # 1. 영상 다운로드 (yt-dlp)
-        print("⬇️ 영상 다운로드 중...")
-        ydl_opts = {
-            'format': 'bestvideo[ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4]/best',
-            'outtmpl': 'input.%(ext)s',
-            'quiet': True,
-        }
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            ydl.download([url])
-
-        # 2. 오디오 추출 (FFmpeg) - Whisper는 오디오만 있으면 됨
-        print("🎵 오디오 추출 중...")
-        subprocess.run(f'ffmpeg -i {video_input} -vn -acodec libmp3lame -q:a 4 {audio_input} -y', shell=True, check=True)
-
-        # 3. AI 자막 생성 (Whisper)
+        # 파일명 정의 (전부 작업 폴더 안)
+        srt_output = job_dir / "subtitle.srt"
+        video_output = job_dir / "final_output.mp4"
+
+        video_future = video_pool.submit(download_video, job) if video_pool else None
+
+        # 1. 오디오만 먼저 다운로드 (yt-dlp) - Whisper는 오디오만 있으면 됨, MP3 변환도 안 함
+        print("⬇️ 오디오 다운로드 중...")
+        with span(trace, "download_audio") as sp:
+            sp["info_cached"] = job["info"] is not None
+            audio_input = source.download_audio(url, job_dir, info=job["info"])
+            sp["bytes_out"] = os.path.getsize(audio_input)
+
+        # 2. AI 자막 생성 (Whisper 워커 풀 → 놀고 있는 워커가 가져감)
         print("🤖 AI 자막 생성 중 (Whisper)...")
         # task="transcribe"는 원래 언어 그대로 받아쓰기
         # task="translate"는 영어로 번역하기 (일본어->한국어는 바로 안됨. 일단 transcribe로 진행!)
-        result = model.transcribe(audio_input)
+        with span(trace, "stt_local", bytes_in=os.path.getsize(audio_input)) as sp:
+            result = whisper_pool.transcribe(audio_input)
+            sp["segments"] = len(result["segments"])
+            sp["device"] = whisper_pool.device
 
         # SRT 파일 만들기
-        with open(srt_output, "w", encoding="utf-8") as f:
-            for i, segment in enumerate(result["segments"]):
-                start = format_timestamp(segment["start"])
-                end = format_timestamp(segment["end"])
-                text = segment["text"]
-                f.write(f"{i+1}\n{start} --> {end}\n{text}\n\n")
-        
-        # 4. 자막 영상에 박기 (Hardsub)
-        print("🔥 자막 굽는 중 (Burning)...")
-        # 윈도우 폰트 설정 (맑은 고딕)
-        font_style = "FontName=Malgun Gothic,FontSize=16,PrimaryColour=&H00FFFFFF,OutlineColour=&H00000000,BorderStyle=1,Outline=1,Shadow=0"
-        
-        # FFmpeg 명령어로 자막 합성
-        # 경로 문제 방지를 위해 절대 경로 사용 추천하나, 일단 상대 경로로 시도
-        cmd = f'ffmpeg -i {video_input} -vf "subtitles={srt_output}:force_style=\'{font_style}\'" -c:a copy {video_output} -y'
-        subprocess.run(cmd, shell=True, check=True)
+        with span(trace, "write_srt") as sp:
+            with open(srt_output, "w", encoding="utf-8") as f:
+                for i, segment in enumerate(result["segments"]):
+                    start = format_timestamp(segment["start"])
+                    end = format_timestamp(segment["end"])
+                    text = segment["text"]
+                    f.write(f"{i+1}\n{start} --> {end}\n{text}\n\n")
+            sp["bytes_out"] = os.path.getsize(srt_output)
+
+        if video_future is not None:
+            # 3. 영상 다운로드 끝나길 기다림 (보통 이미 끝나 있음)
+            with span(trace, "wait_video"):
+                video_input = video_future.result()
+
+            # 4. 자막 영상에 박기 (Hardsub) + 오디오 파일 소리 합치기
+            print("🔥 자막 굽는 중 (Burning)...")
+            # 윈도우 폰트 설정 (맑은 고딕)
+            font_style = "FontName=Malgun Gothic,FontSize=16,PrimaryColour=&H00FFFFFF,OutlineColour=&H00000000,BorderStyle=1,Outline=1,Shadow=0"
+
+            # FFmpeg 명령어로 자막 합성
+            # subtitles 필터는 경로 이스케이프가 까다로워서(윈도우 C:) 작업 폴더에서 상대 경로로 실행
+            # m4a(AAC) 는 그대로 복사, webm(Opus) 등은 mp4 에 맞게 AAC 로
+            audio_codec = "copy" if audio_input.suffix == ".m4a" else "aac"
+            cmd = ['ffmpeg', '-i', video_input.name, '-i', audio_input.name,
+                   '-map', '0:v:0', '-map', '1:a:0?',
+                   '-vf', f"subtitles={srt_output.name}:force_style='{font_style}'",
+                   '-c:a', audio_codec, video_output.name, '-y']
+            with span(trace, "hardsub", bytes_in=os.path.getsize(video_input)) as sp:
+                subprocess.run(cmd, check=True, cwd=job_dir)
+                sp["bytes_out"] = os.path.getsize(video_output)
         
-        print(f"✨ 모든 작업 완료! 결과물: {video_output}")
+        job["status"] = "done"
+        print(f"✨ 모든 작업 완료! 결과물: {video_output if video_future else srt_output}")
 
     except Exception as e:
+        job["status"] = "failed"
+        job["error"] = str(e)
         print(f"❌ 에러 발생: {str(e)}")
+    finally:
+        if video_pool is not None:
+            video_pool.shutdown(wait=True)
+        job.pop("info", None)
+        job["finished_at"] = time.time()
+        print("⏱️ 단계별 시간: " + ", ".join(f"{t['stage']} {t['sec']:.1f}s" for t in trace))
 
 # [API] 견적 조회
 @app.post("/get-info")
 def get_video_info(req: VideoRequest):
-    ydl_opts = {'quiet': True}
-    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-        info = ydl.extract_info(req.url, download=False)
-        duration = info.get('duration', 0)
-        title = info.get('title', '제목 없음')
-        cost = math.ceil(duration / 60) * 10
-        return {"status": "success", "title": title, "duration_sec": duration, "cost": cost}
+    # 같은 영상이면 캐시에서 바로, 동시에 들어온 같은 요청은 추출 한 번만
+    info = info_cache.get(req.url, source.info)
+    duration = info.get('duration', 0)
+    title = info.get('title', '제목 없음')
+    cost = math.ceil(duration / 60) * 10
+    return {"status": "success", "title": title, "duration_sec": duration, "cost": cost}
 
 # [API] 결제 및 작업 시작
 @app.post("/pay")
 async def pay_walnut(req: PaymentRequest, background_tasks: BackgroundTasks):
     global fake_db
     
+    if req.mode not in ("video", "text"):
+        return {"status": "fail", "message": "mode 는 video / text 중 하나!"}
     if fake_db["balance"] < req.cost:
         return {"status": "fail", "message": "잔액 부족!"}
     
     fake_db["balance"] -= req.cost
     
     # ★ 백그라운드에서 작업 시작 (사용자는 기다리지 않음)
-    background_tasks.add_task(process_video_task, req.url)
+    prune_jobs()
+    job = new_job(req.url, req.mode)
+    background_tasks.add_task(process_video_task, job)
     
     return {
         "status": "success", 
+        "job_id": job["job_id"],
         "new_balance": fake_db["balance"],
         "message": "결제 성공! AI가 자막 제작을 시작했습니다. (터미널 확인)"
     }
 
-# [API] 결과물 다운로드
-@app.get("/download")
-def download_file():
-    if os.path.exists("final_output.mp4"):
-        return FileResponse("final_output.mp4", media_type="video/mp4", filename="walnut_video.mp4")
-    return {"error": "아직 파일이 없습니다. 조금만 더 기다려주세요!"}
\ No newline at end of file
+# [API] 작업 상태
+def job_view(job):
+    return {k: v for k, v in job.items() if k not in ("dir", "trace", "info")}
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str):
+    job = jobs.get(job_id)
+    if job is None:
+        return {"error": "그런 작업이 없습니다."}
+    return job_view(job)
+
+# [API] 결과물 다운로드 (Range / ETag / HEAD 지원 → 이어받기, 탐색 재생 가능)
+# job_id 없으면 가장 최근에 끝난 작업, kind=srt 면 자막 파일
+@app.api_route("/download", methods=["GET", "HEAD"])
+def download_file(request: Request, job_id: Optional[str] = None, kind: str = "video"):
+    job = jobs.get(job_id) if job_id else latest_done_job()
+    if kind == "srt":
+        name, media_type, filename = "subtitle.srt", "application/x-subrip", "walnut_subtitle.srt"
+    else:
+        name, media_type, filename = "final_output.mp4", "video/mp4", "walnut_video.mp4"
+    output = job["dir"] / name if job and job["status"] == "done" else None
+    if output is not None and output.exists():
+        return ranged_file_response(request, str(output), media_type, filename, download=True)
+    return {"error": "아직 파일이 없습니다. 조금만 더 기다려주세요!"}
+
+# [API] 헬스체크 (서버만 살아 있으면 바로 200) / 준비 상태 (모델까지 올라와야 200)
+@app.get("/health")
+def health():
+    return {"status": "ok", "whisper": whisper_pool.stats()}
+
+# lazy 모드는 첫 작업이 와야 모델을 올리니까, 안 띄운 상태(idle)도 준비된 걸로 봄 (아니면 첫 작업이 영영 안 옴)
+@app.get("/ready")
+def ready(response: Response):
+    stats = whisper_pool.stats()
+    if WARMUP == "lazy" and stats["state"] == "idle":
+        stats["state"] = "lazy"
+    elif stats["state"] != "ready":
+        response.status_code = 503
+    return stats
+
+# [API] 단계별 시간 (Prometheus) / 마지막 작업 trace
+@app.get("/metrics")
+def get_metrics():
+    return Response(REGISTRY.render(), media_type=CONTENT_TYPE)
+
+@app.get("/trace")
+def get_last_trace(job_id: Optional[str] = None):
+    # job_id 없으면 가장 최근에 끝난 작업
+    if job_id:
+        job = jobs.get(job_id)
+    else:
+        with jobs_lock:
+            finished = [j for j in jobs.values() if j["finished_at"]]
+        job = max(finished, key=lambda j: j["finished_at"]) if finished else None
+    return {"job_id": job["job_id"] if job else None, "trace": job["trace"] if job else []}
+
+REGISTRY.gauge("walnut_info_cache", "영상 메타데이터 캐시 (/get-info)",
+               lambda: {(k,): v for k, v in info_cache.stats().items()}, ("kind",))
+REGISTRY.gauge("walnut_whisper_workers", "로컬 Whisper 워커 상태별 수",
+               lambda: {(k,): whisper_pool.stats()[k] for k in ("workers", "ready", "busy", "queued")}, ("state",))
@@ -0,0 +1,138 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from urllib.parse import urlparse, parse_qs, urlencode
+
+# ========================================================
+# 영상 메타데이터 캐시 (/get-info 견적 → /pay 작업까지 재사용)
+# ========================================================
+# 견적 화면이 같은 URL 을 몇 초 간격으로 여러 번 묻고, 바로 결제까지 이어지는 경우가 많음.
+# - URL 을 정규화해서 (youtu.be / shorts / m. / 추적 파라미터 등) 같은 영상은 같은 키
+# - 한 번 받은 뒤에는 추출기+영상 id 로도 찾을 수 있게 별칭 등록
+# - 같은 키를 동시에 물으면 추출은 한 번만 하고 나머지는 그 결과를 기다림
+TTL_SEC = int(os.getenv("WALNUT_INFO_TTL_SEC", "600"))
+MAX_ITEMS = int(os.getenv("WALNUT_INFO_CACHE_ITEMS", "512"))
+
+# 영상 구분에 상관없는 쿼리 파라미터
+_DROP_PARAMS = {"si", "feature", "pp", "ab_channel", "t", "start", "fbclid", "gclid"}
+
+
+def normalize_url(url):
+    url = url.strip()
+    parsed = urlparse(url if "://" in url else f"https://{url}")
+    host = (parsed.hostname or "").lower()
+    for prefix in ("www.", "m.", "music."):
+        if host.startswith(prefix):
+            host = host[len(prefix):]
+    path = parsed.path.rstrip("/")
+    query = parse_qs(parsed.query)
+
+    # 유튜브는 주소 모양이 여러 개라 영상 id 로 통일
+    video_id = None
+    if host == "youtu.be":
+        video_id = path.lstrip("/").split("/")[0]
+    elif host.endswith("youtube.com"):
+        if path == "/watch":
+            video_id = (query.get("v") or [None])[0]
+        elif path.startswith(("/shorts/", "/embed/", "/live/", "/v/")):
+            video_id = path.split("/")[2]
+    if video_id:
+        return f"youtube:{video_id}"
+
+    params = sorted((k, v) for k, vs in query.items() for v in vs
+                    if k not in _DROP_PARAMS and not k.startswith("utm_"))
+    return f"{host}{path}" + (f"?{urlencode(params)}" if params else "")
+
+
+def info_key(info):
+    # 추출 결과의 (추출기, id) → 다른 모양의 URL 도 같은 영상이면 같은 키
+    extractor = (info.get("extractor_key") or info.get("extractor") or "").lower()
+    if not info.get("id"):
+        return None
+    return f"{'youtube' if extractor == 'youtube' else extractor}:{info['id']}"
+
+
+class InfoCache:
+    def __init__(self, ttl_sec=TTL_SEC, max_items=MAX_ITEMS):
+        self.ttl_sec = ttl_sec
+        self.max_items = max_items
+        self._items = OrderedDict()   # 키 → (저장 시각, info)
+        self._aliases = {}            # URL 키 → id 키
+        self._inflight = {}           # 키 → Future (추출 중)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def _resolve(self, key):
+        return self._aliases.get(key, key)
+
+    def _fresh(self, key, now):
+        entry = self._items.get(self._resolve(key))
+        if entry is None:
+            return None
+        saved_at, info = entry
+        if now - saved_at > self.ttl_sec:
+            return None
+        self._items.move_to_end(self._resolve(key))
+        return info
+
+    def _store(self, key, info, now):
+        main = info_key(info) or key
+        if main != key:
+            self._aliases[key] = main
+        self._items[main] = (now, info)
+        self._items.move_to_end(main)
+        while len(self._items) > self.max_items:
+            old, _ = self._items.popitem(last=False)
+            # 지워진 항목을 가리키던 별칭도 정리
+            for alias in [a for a, target in self._aliases.items() if target == old]:
+                del self._aliases[alias]
+
+    def peek(self, url):
+        # 있으면 주고 없으면 None (추출 안 함) — 결제 후 작업에서 견적 때 받은 info 재사용
+        with self._lock:
+            return self._fresh(normalize_url(url), time.monotonic())
+
+    def get(self, url, loader):
+        """loader(url) 로 추출. 캐시에 있으면 바로, 같은 키를 누가 추출 중이면 그 결과를 기다림"""
+        key = normalize_url(url)
+        with self._lock:
+            info = self._fresh(key, time.monotonic())
+            if info is not None:
+                self.hits += 1
+                return info
+            fut = self._inflight.get(key)
+            owner = fut is None
+            if owner:
+                fut = self._inflight[key] = Future()
+                self.misses += 1
+            else:
+                self.coalesced += 1
+        if not owner:
+            return fut.result()
+
+        try:
+            info = loader(url)
+        except Exception as e:
+            # 실패는 캐시 안 함 (기다리던 요청들한테만 같은 에러)
+            with self._lock:
+                del self._inflight[key]
+            fut.set_exception(e)
+            raise
+        with self._lock:
+            self._store(key, info, time.monotonic())
+            del self._inflight[key]
+        fut.set_result(info)
+        return info
+
+    def stats(self):
+        with self._lock:
+            return {
+                "items": len(self._items),
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+            }
@@ -0,0 +1,171 @@
+import os
+import time
+import uuid
+import threading
+import traceback
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import REGISTRY, STAGE_WAIT_SECONDS, span
+
+# ========================================================
+# 작업 큐 설정 (환경변수로 조절)
+# ========================================================
+# 동시에 돌릴 파이프라인 개수
+MAX_JOBS = int(os.getenv("WALNUT_MAX_JOBS", "4"))
+
+# 단계별 동시 실행 한도
+# - ffmpeg: CPU 먹는 작업이라 코어 수 기준
+# - Whisper / Gemini 호출은 scheduler.py 가 요청 한도(RPM/TPM)와 429 에 맞춰 조절
+STAGE_LIMITS = {
+    "ffmpeg": int(os.getenv("WALNUT_FFMPEG_CONCURRENCY", str(max(1, (os.cpu_count() or 2) // 2)))),
+}
+
+JOB_SECONDS = REGISTRY.histogram("walnut_job_seconds", "작업 전체 실행 시간", ("kind", "status"))
+JOB_QUEUE_SECONDS = REGISTRY.histogram("walnut_job_queue_seconds", "작업이 실행되기 전 대기열에서 기다린 시간", ("kind",))
+
+
+class Job:
+    def __init__(self, kind):
+        self.id = str(uuid.uuid4())
+        self.kind = kind
+        self.status = "queued"   # queued → running → done / failed
+        self.stage = None
+        self.progress = 0.0
+        self.result = None
+        self.error = None
+        self.metrics = {}
+        # 단계별 span 기록 (metrics.span 참고)
+        self.trace = []
+        # 번역 끝난 자막 (배치가 끝나는 순서대로 쌓임, 스트리밍/중간 SRT 용)
+        self.subtitles = []
+        self.subtitles_total = None
+        self._subs_lock = threading.Lock()
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    def publish(self, items):
+        with self._subs_lock:
+            self.subtitles.extend(items)
+
+    def subtitles_since(self, cursor):
+        with self._subs_lock:
+            return self.subtitles[cursor:]
+
+    @property
+    def finished(self):
+        return self.status in ("done", "failed")
+
+    def to_dict(self, trace=False):
+        data = {
+            "job_id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "stage": self.stage,
+            "progress": round(self.progress, 3),
+            "error": self.error,
+            "metrics": self.metrics,
+            "subtitles_ready": len(self.subtitles),
+            "subtitles_total": self.subtitles_total,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+        if trace:
+            data["trace"] = list(self.trace)
+        return data
+
+
+class JobManager:
+    """
+    파이프라인을 스레드 풀에서 돌리고, 단계별 세마포어로 FFmpeg 동시 실행 수를 제한한다.
+    작업 함수는 동기 함수라서 이벤트 루프를 막지 않는다.
+    """
+
+    def __init__(self, max_jobs=MAX_JOBS, stage_limits=None):
+        self.max_jobs = max_jobs
+        self.stage_limits = dict(stage_limits or STAGE_LIMITS)
+        self._pool = ThreadPoolExecutor(max_workers=max_jobs, thread_name_prefix="walnut-job")
+        self._stages = {name: threading.BoundedSemaphore(n) for name, n in self.stage_limits.items()}
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, kind, fn, *args, trace=None, **kwargs):
+        # trace: 작업 등록 전에 잰 span (업로드 저장 등)
+        job = Job(kind)
+        job.trace.extend(trace or [])
+        with self._lock:
+            self._jobs[job.id] = job
+        self._pool.submit(self._run, job, fn, args, kwargs)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def prune(self, ttl_sec):
+        # 끝난 지 ttl 지난 작업 기록은 메모리에서 지움
+        cutoff = time.time() - ttl_sec
+        with self._lock:
+            old = [j.id for j in self._jobs.values() if j.finished_at and j.finished_at < cutoff]
+            for job_id in old:
+                del self._jobs[job_id]
+        return len(old)
+
+    def counts(self):
+        # 상태별 작업 수 (/metrics 용)
+        out = {}
+        with self._lock:
+            for j in self._jobs.values():
+                out[(j.status,)] = out.get((j.status,), 0) + 1
+        return out
+
+    def _run(self, job, fn, args, kwargs):
+        job.status = "running"
+        job.started_at = time.time()
+        JOB_QUEUE_SECONDS.observe(job.started_at - job.created_at, kind=job.kind)
+        try:
+            job.result = fn(job, *args, **kwargs)
+            job.progress = 1.0
+            job.status = "done"
+        except Exception as e:
+            traceback.print_exc()
+            job.error = str(e)
+            job.status = "failed"
+        finally:
+            job.stage = None
+            job.finished_at = time.time()
+            JOB_SECONDS.observe(job.finished_at - job.started_at, kind=job.kind, status=job.status)
+
+    @contextmanager
+    def stage(self, job, name, slot=None, **attrs):
+        # name: 상태 조회에 보일 단계 이름, slot: 동시 실행 한도를 나눠 쓰는 그룹 (ffmpeg)
+        # with ... as sp: sp 에 bytes_in / words 같은 값을 채우면 span 에 같이 기록됨
+        sem = self._stages.get(slot or name)
+        trace = job.trace if job is not None else None
+        if job is not None:
+            job.stage = name
+        if sem is None:
+            with span(trace, name, **attrs) as sp:
+                yield sp
+            return
+        t0 = time.perf_counter()
+        with sem:
+            wait = time.perf_counter() - t0
+            STAGE_WAIT_SECONDS.observe(wait, slot=slot or name)
+            with span(trace, name, wait, **attrs) as sp:
+                yield sp
+
+    def try_acquire(self, slot):
+        # 슬롯이 비어 있을 때만 잡음 (이벤트 루프에서 기다리면 안 되는 곳에서 사용)
+        sem = self._stages.get(slot)
+        return sem.acquire(blocking=False) if sem else True
+
+    def release(self, slot):
+        sem = self._stages.get(slot)
+        if sem:
+            sem.release()
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
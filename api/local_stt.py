@@ -0,0 +1,343 @@
+import os
+import time
+import uuid
+import threading
+import traceback
+import multiprocessing as mp
+from concurrent.futures import Future
+
+# ========================================================
+# 로컬 Whisper 워커 풀 (index.py 셀프호스팅용)
+# ========================================================
+# 서버 프로세스에서 모델을 안 들고, 모델을 미리 올려둔 워커 프로세스 여러 개가
+# 공용 대기열에서 하나씩 꺼내 감 → 놀고 있는 워커가 바로 다음 오디오를 맡음.
+# CPU 만 있는 서버에서도 코어 수만큼 나눠서 돌릴 수 있음.
+MODEL_NAME = os.getenv("WALNUT_WHISPER_MODEL", "medium")
+# auto / cpu / cuda
+DEVICE = os.getenv("WALNUT_WHISPER_DEVICE", "auto")
+# auto(GPU fp16, CPU fp32) / fp32 / fp16 / int8 (CPU 전용, Linear 레이어 동적 양자화 → 메모리↓ 속도↑)
+COMPUTE_TYPE = os.getenv("WALNUT_WHISPER_COMPUTE", "auto")
+# startup: 서버 뜨자마자 백그라운드로 모델 로딩 / lazy: 첫 자막 작업 들어올 때 로딩
+WARMUP = os.getenv("WALNUT_WHISPER_WARMUP", "startup")
+
+# 0 이면 코어 수 / 메모리 보고 자동
+WORKERS = int(os.getenv("WALNUT_WHISPER_WORKERS", "0"))
+# 워커 하나가 쓸 CPU 스레드 수 (torch)
+THREADS_PER_WORKER = int(os.getenv("WALNUT_WHISPER_THREADS", "4"))
+
+# 모델별 대략 메모리 (GB, openai-whisper README 기준 + 여유)
+MODEL_MEMORY_GB = {"tiny": 1, "base": 1, "small": 2, "medium": 5, "large": 10, "turbo": 6}
+
+
+def available_memory_gb():
+    # 리눅스는 /proc/meminfo 의 MemAvailable, 그 외에는 전체 메모리
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) / 1024 ** 2
+    except OSError:
+        pass
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") / 1024 ** 3
+    except (ValueError, OSError, AttributeError):
+        return 8.0
+
+
+def auto_workers(model_name=MODEL_NAME, threads=THREADS_PER_WORKER, quantized=False, memory_gb=None):
+    # quantized: 워커가 실제로 int8 양자화된 걸 확인했을 때만 True (설정값만 보고 반으로 잡으면 메모리 부족 위험)
+    cores = os.cpu_count() or 1
+    by_cpu = max(1, cores // max(1, threads))
+    need = MODEL_MEMORY_GB.get(model_name.split(".")[0].split("-")[0], 5)
+    if quantized:
+        need = max(1, need / 2)
+    memory_gb = available_memory_gb() if memory_gb is None else memory_gb
+    by_mem = max(1, int(memory_gb // need))
+    return min(by_cpu, by_mem)
+
+
+# --------------------------------------------------------
+# 워커 프로세스 (spawn 으로 띄우니까 모듈 최상위 함수여야 함)
+# --------------------------------------------------------
+def _plain_linears(torch, module):
+    # quantize_dynamic 은 타입이 딱 nn.Linear 인 것만 바꿈 → openai-whisper 는 nn.Linear 를 상속한 자기 Linear 를 씀
+    # 같은 모양의 nn.Linear 로 갈아끼우고 가중치/편향은 그대로 옮김 (CPU fp32 라 dtype 맞추는 forward 는 필요 없음)
+    swapped = 0
+    for name, child in module.named_children():
+        if isinstance(child, torch.nn.Linear) and type(child) is not torch.nn.Linear:
+            plain = torch.nn.Linear(child.in_features, child.out_features, bias=child.bias is not None)
+            plain.weight = child.weight
+            plain.bias = child.bias
+            setattr(module, name, plain)
+            swapped += 1
+        else:
+            swapped += _plain_linears(torch, child)
+    return swapped
+
+
+def _load_model(model_name, device, compute, threads):
+    # torch / whisper 는 워커 안에서만 import (서버 프로세스는 가볍게)
+    import torch
+    import whisper
+
+    if device == "auto":
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+    if compute == "auto":
+        compute = "fp16" if device == "cuda" else "fp32"
+    if compute == "int8" and device != "cpu":
+        print("⚠️ int8 은 CPU 에서만 됨 → fp16 으로")
+        compute = "fp16"
+    if compute == "fp16" and device == "cpu":
+        print("⚠️ CPU 는 fp16 안 됨 → fp32 로")
+        compute = "fp32"
+    if device == "cpu":
+        torch.set_num_threads(threads)
+
+    model = whisper.load_model(model_name, device=device)
+    if compute == "int8":
+        _plain_linears(torch, model)
+        model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        quantized = sum(1 for m in model.modules() if type(m).__module__.startswith(("torch.ao.nn.quantized", "torch.nn.quantized")))
+        if quantized:
+            print(f"✅ int8 양자화: Linear 레이어 {quantized}개")
+        else:
+            print("⚠️ 양자화된 레이어가 없음 → fp32 로 돌아감")
+            compute = "fp32"
+    return model, f"{device}/{compute}", {"fp16": compute == "fp16"}
+
+
+def _worker_main(model_name, device, compute, threads, tasks, results):
+    try:
+        model, label, defaults = _load_model(model_name, device, compute, threads)
+    except Exception:
+        results.put(("dead", os.getpid(), traceback.format_exc()))
+        return
+    results.put(("ready", os.getpid(), label))
+
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        task_id, audio_path, kwargs = task
+        results.put(("start", task_id, os.getpid()))
+        try:
+            out = model.transcribe(audio_path, **{**defaults, **kwargs})
+            # 텐서 같은 건 빼고 피클 가능한 것만
+            data = {
+                "text": out.get("text", ""),
+                "language": out.get("language"),
+                "segments": [
+                    {"start": s["start"], "end": s["end"], "text": s["text"]}
+                    for s in out.get("segments", [])
+                ],
+            }
+            results.put(("done", task_id, data))
+        except Exception as e:
+            results.put(("error", task_id, f"{type(e).__name__}: {e}"))
+
+
+class WhisperPool:
+    def __init__(self, model_name=MODEL_NAME, workers=WORKERS, threads=THREADS_PER_WORKER,
+                 device=DEVICE, compute=COMPUTE_TYPE):
+        self.model_name = model_name
+        self.workers = workers
+        self.threads = threads
+        self.device_pref = device
+        self.compute = compute
+        self._ctx = mp.get_context("spawn")
+        self._tasks = self._ctx.Queue()
+        # 결과는 SimpleQueue: put 이 바로 파이프에 씀 (워커가 갑자기 죽어도 "start" 는 전달됨)
+        self._results = self._ctx.SimpleQueue()
+        self._procs = {}        # pid → Process
+        self._ready = set()     # 모델 로딩 끝난 pid
+        self._running = {}      # task_id → pid (워커가 잡은 작업)
+        self._futures = {}      # task_id → Future
+        self._lock = threading.Lock()
+        self._closed = False
+        self.device = None      # 실제로 잡힌 장치/연산 방식 (예: "cpu/int8")
+        self.error = None
+        self._collector = None
+        self._started_at = None
+        self.load_sec = None    # 시작부터 첫 워커 준비까지
+        self._auto_sized = not workers
+        self._memory_gb = None  # 띄우는 시점의 여유 메모리 (int8 확인 후 워커 더 띄울 때 기준)
+
+    # --------------------------------------------------------
+    # 시작 / 종료
+    # --------------------------------------------------------
+    def start(self):
+        with self._lock:
+            if self._started_at is not None:
+                return self
+            self._started_at = time.monotonic()
+        # 워커 수는 띄우는 시점 메모리 기준 (lazy 면 첫 작업 때)
+        # int8 이어도 처음엔 fp32 크기로 잡고, 워커가 양자화된 걸 알려주면 그때 더 띄움
+        self._memory_gb = available_memory_gb()
+        self.workers = self.workers or auto_workers(self.model_name, self.threads, memory_gb=self._memory_gb)
+        print(f"🚀 Whisper 워커 {self.workers}개 띄우는 중... (모델: {self.model_name}, 워커당 스레드 {self.threads})")
+        for _ in range(self.workers):
+            self._spawn()
+        self._collector = threading.Thread(target=self._collect, name="walnut-whisper-results", daemon=True)
+        self._collector.start()
+        return self
+
+    def _spawn(self):
+        proc = self._ctx.Process(
+            target=_worker_main, daemon=True,
+            args=(self.model_name, self.device_pref, self.compute, self.threads, self._tasks, self._results),
+        )
+        proc.start()
+        with self._lock:
+            self._procs[proc.pid] = proc
+
+    def shutdown(self):
+        self._closed = True
+        for _ in list(self._procs):
+            self._tasks.put(None)
+        for proc in list(self._procs.values()):
+            proc.join(timeout=5)
+            if proc.is_alive():
+                proc.kill()
+
+    # --------------------------------------------------------
+    # 작업
+    # --------------------------------------------------------
+    def submit(self, audio_path, **kwargs):
+        # lazy 모드면 여기서 처음 띄움
+        self.start()
+        task_id = uuid.uuid4().hex
+        fut = Future()
+        with self._lock:
+            if self.error and not self._procs:
+                raise RuntimeError("Whisper 모델 로딩 실패")
+            self._futures[task_id] = fut
+        self._tasks.put((task_id, str(audio_path), kwargs))
+        return fut
+
+    def transcribe(self, audio_path, **kwargs):
+        return self.submit(audio_path, **kwargs).result()
+
+    def wait_ready(self, timeout=None):
+        # 워커가 하나라도 모델을 다 올릴 때까지
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not self._ready:
+            if self.error and not self._procs:
+                raise RuntimeError(self.error)
+            if deadline is not None and time.monotonic() > deadline:
+                return False
+            time.sleep(0.1)
+        return True
+
+    def state(self):
+        # idle(안 띄움) → loading → ready / failed
+        if self._started_at is None:
+            return "idle"
+        if self._ready:
+            return "ready"
+        if self.error and not self._procs:
+            return "failed"
+        return "loading"
+
+    def stats(self):
+        with self._lock:
+            return {
+                "state": self.state(),
+                "model": self.model_name,
+                "device": self.device,
+                "compute": self.compute,
+                "load_sec": self.load_sec,
+                "workers": len(self._procs),
+                "ready": len(self._ready),
+                "busy": len(self._running),
+                "queued": len(self._futures) - len(self._running),
+            }
+
+    # --------------------------------------------------------
+    # 결과 수집 + 죽은 워커 정리 (백그라운드 스레드)
+    # --------------------------------------------------------
+    def _collect(self):
+        while not self._closed:
+            if self._results.empty():
+                self._reap()
+                time.sleep(0.1)
+                continue
+            kind, key, value = self._results.get()
+            failed = []
+            grow = 0
+            with self._lock:
+                if kind == "ready":
+                    if self.load_sec is None:
+                        self.load_sec = round(time.monotonic() - self._started_at, 2)
+                    self._ready.add(key)
+                    self.device = value
+                    print(f"✅ Whisper 워커 준비 완료 (pid {key}, {value})")
+                    if self._auto_sized and value.endswith("/int8"):
+                        # 진짜로 양자화된 게 확인됐으니 절반 메모리 기준으로 모자란 만큼 더 띄움 (한 번만)
+                        self._auto_sized = False
+                        target = auto_workers(self.model_name, self.threads, quantized=True, memory_gb=self._memory_gb)
+                        grow = max(0, target - self.workers)
+                        self.workers += grow
+                    fut = None
+                elif kind == "start":
+                    self._running[key] = value
+                    continue
+                elif kind == "dead":
+                    print(f"❌ Whisper 워커 모델 로딩 실패 (pid {key})\n{value}")
+                    self.error = value
+                    self._procs.pop(key, None)
+                    failed = self._orphaned()
+                    fut = None
+                else:
+                    self._running.pop(key, None)
+                    fut = self._futures.pop(key, None)
+            if grow:
+                print(f"🚀 int8 확인 → Whisper 워커 {grow}개 더 띄움 (총 {self.workers}개)")
+                for _ in range(grow):
+                    self._spawn()
+            for f in failed:
+                f.set_exception(RuntimeError("Whisper 모델 로딩 실패"))
+            if fut is None:
+                continue
+            if kind == "done":
+                fut.set_result(value)
+            else:
+                fut.set_exception(RuntimeError(value))
+
+    def _orphaned(self):
+        # 살아 있는 워커가 하나도 없으면 기다리던 작업은 영영 안 끝남 → 꺼내서 실패 처리 (lock 잡고 호출)
+        if self._procs:
+            return []
+        futures = list(self._futures.values())
+        self._futures.clear()
+        self._running.clear()
+        return futures
+
+    def _reap(self):
+        # 작업 중에 죽은 워커(메모리 부족 등)는 그 작업만 실패 처리하고 새로 띄움
+        # 모델 로딩 중에 죽은 워커는 다시 띄워도 또 죽을 테니 그대로 둠
+        respawn, lost, orphaned = 0, [], []
+        with self._lock:
+            for pid, proc in list(self._procs.items()):
+                if proc.is_alive():
+                    continue
+                del self._procs[pid]
+                if pid in self._ready:
+                    self._ready.discard(pid)
+                    respawn += 1
+                    print(f"⚠️ Whisper 워커 종료됨 (pid {pid}) → 새로 띄움")
+                    for tid in [tid for tid, owner in self._running.items() if owner == pid]:
+                        del self._running[tid]
+                        if tid in self._futures:
+                            lost.append(self._futures.pop(tid))
+                else:
+                    self.error = self.error or f"Whisper 워커가 모델 로딩 중에 종료됨 (exit {proc.exitcode})"
+                    print(f"❌ {self.error}")
+            if not respawn or self._closed:
+                orphaned = self._orphaned()
+        for fut in lost:
+            fut.set_exception(RuntimeError("Whisper 워커가 작업 중에 종료됨"))
+        for fut in orphaned:
+            fut.set_exception(RuntimeError(self.error or "Whisper 워커 없음"))
+        if not self._closed:
+            for _ in range(respawn):
+                self._spawn()
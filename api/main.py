@@ -2,29 +2,40 @@ import os
 from pathlib import Path
 from fastapi import FastAPI, UploadFile, File, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.responses import Response, StreamingResponse
 from dotenv import load_dotenv
 import google.generativeai as genai
 from openai import OpenAI
 import math
-import uuid
 import shutil
-import subprocess
 import json
 import asyncio
 import re
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from jobs import JobManager
+from scheduler import ApiScheduler, GEMINI_RPM, GEMINI_TPM, WHISPER_RPM, STT_CONCURRENCY, LLM_CONCURRENCY
+from metrics import REGISTRY, CONTENT_TYPE, span, gemini_usage
+from translation_cache import TranslationCache, PROMPT_VERSION
+from artifacts import ArtifactStore
+from checkpoints import ManifestStore
+from audio import extract_audio, extract_window, plan_windows, probe_duration, split_audio, StreamingExtractor
+from downloads import ranged_file_response
+from segmentation import regroup, regroup_partial
+from render import OUTPUT_MODES, burn_subtitles, mux_soft, parse_srt, to_vtt
 
 # ========================================================
 # 기본 설정
 # ========================================================
 current_dir = Path(__file__).resolve().parent
 env_path = current_dir / ".env"
-upload_dir = current_dir / "tempuploads"
 
 if env_path.exists():
     load_dotenv(dotenv_path=env_path)
 
-upload_dir.mkdir(exist_ok=True)
+upload_dir = Path(os.getenv("WALNUT_UPLOAD_DIR", str(current_dir / "tempuploads")))
+upload_dir.mkdir(parents=True, exist_ok=True)
 
 # FFmpeg 경로
 local_ffmpeg = current_dir / "ffmpeg.exe"
@@ -44,6 +55,84 @@ app.add_middleware(
 
 GEMINI_MODEL = "gemini-3-pro-preview"  # 최신 버전으로 강제
 
+# 업로드 내용 해시별 산출물 저장소 (같은 파일 재업로드 시 재사용)
+artifacts = ArtifactStore(upload_dir)
+
+# 단계별 진행 기록 (실패/재시작 후 POST /jobs/{id}/resume 으로 이어서)
+manifests = ManifestStore(artifacts)
+# 1 이면 서버 켤 때 중단된 작업을 자동으로 이어서 돌림
+RESUME_ON_STARTUP = os.getenv("WALNUT_RESUME_ON_STARTUP", "0") == "1"
+
+# 번역 메모리 캐시 (같은 문장 + 같은 장르 가이드면 Gemini 안 부름)
+translation_cache = TranslationCache(os.getenv("WALNUT_TM_PATH", str(current_dir / "cache" / "translations.sqlite3")))
+
+# 작업 큐 (파이프라인은 여기서 돌고, 요청은 job id만 받아감)
+job_manager = JobManager()
+
+# Whisper / Gemini 호출은 전부 여기 줄 세움 (요청 한도, 429 대응, 작업 간 공평하게)
+whisper_scheduler = ApiScheduler("whisper", rpm=WHISPER_RPM, max_concurrency=STT_CONCURRENCY)
+gemini_scheduler = ApiScheduler("gemini", rpm=GEMINI_RPM, tpm=GEMINI_TPM, max_concurrency=LLM_CONCURRENCY)
+
+# --------------------------------------------------------
+# API 클라이언트 (서버 켤 때 한 번 만들고 모든 작업이 같이 씀 → 연결 재사용)
+# --------------------------------------------------------
+_clients = {}
+_clients_lock = threading.Lock()
+
+def openai_client():
+    with _clients_lock:
+        if "openai" not in _clients:
+            # 429 / 5xx / 연결 오류 재시도는 스케줄러가 하니까 SDK 자체 재시도는 끔 (두 번 겹쳐서 재시도 안 되게)
+            _clients["openai"] = OpenAI(api_key=os.getenv("OPENAI_API_KEY"), max_retries=0)
+        return _clients["openai"]
+
+def gemini_model(kind="default"):
+    with _clients_lock:
+        if "gemini" not in _clients:
+            genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+            _clients["gemini"] = {}
+        models = _clients["gemini"]
+        if kind not in models:
+            config = {"response_mime_type": "application/json", "temperature": 0.7} if kind == "json" else None
+            models[kind] = genai.GenerativeModel(model_name=GEMINI_MODEL, generation_config=config)
+        return models[kind]
+
+def gemini_tokens(response):
+    usage = gemini_usage(response)
+    return usage["prompt_tokens"] + usage["completion_tokens"] if usage else None
+
+@app.on_event("startup")
+def start_janitor():
+    # 오래된 산출물/작업 기록은 백그라운드에서 정리
+    artifacts.start_janitor(on_sweep=lambda: job_manager.prune(artifacts.ttl_sec))
+
+@app.on_event("startup")
+def init_clients():
+    if os.getenv("OPENAI_API_KEY"):
+        openai_client()
+    if os.getenv("GEMINI_API_KEY"):
+        gemini_model("json")
+        gemini_model()
+
+@app.on_event("startup")
+def recover_jobs():
+    # 이전 프로세스가 돌리다 죽은 작업 (산출물은 해시 폴더에 남아 있음)
+    stale = manifests.recover()
+    if not stale:
+        return
+    print(f"⏸️ 중단된 작업 {len(stale)}개 발견 (POST /jobs/{{job_id}}/resume 으로 이어서 가능)")
+    if RESUME_ON_STARTUP and os.getenv("OPENAI_API_KEY") and os.getenv("GEMINI_API_KEY"):
+        for digest, data in stale:
+            if artifacts.has(digest, "source.mp4"):
+                artifacts.pin(digest)
+                job = job_manager.submit("video", run_video_pipeline, digest, data.get("output") or "soft")
+                print(f"▶️ 이어서 시작: {data['jobs'][-1]} → {job.id} (남은 단계: {ManifestStore.resume_point(data)})")
+
+@app.on_event("shutdown")
+def shutdown_jobs():
+    artifacts.stop_janitor()
+    job_manager.shutdown()
+
 def format_timestamp(seconds):
     hours = math.floor(seconds / 3600)
     seconds %= 3600
@@ -52,48 +141,13 @@ def format_timestamp(seconds):
     ms = int((seconds % 1) * 1000)
     return f"{hours:02d}:{minutes:02d}:{int(seconds):02d},{ms:03d}"
 
-# --------------------------------------------------------
-# 자막 분할 (그대로 잘 됨)
-# --------------------------------------------------------
-def regroup_words_dynamic(words):
-    segments = []
-    current = {"text": "", "start": 0, "end": 0, "words": []}
-    MAX_SILENCE = 0.3
-    MAX_CHARS = 35
-
-    for word_obj in words:
-        word = word_obj.word
-        start = word_obj.start
-        end = word_obj.end
-
-        if current["words"]:
-            silence = start - current["words"][-1].end
-            if silence > MAX_SILENCE:
-                current["end"] = current["words"][-1].end
-                segments.append(current)
-                current = {"text": "", "start": start, "end": 0, "words": []}
-
-        if not current["words"]:
-            current["start"] = start
-        current["text"] += word
-        current["words"].append(word_obj)
-        current["end"] = end
-
-        too_long = len(current["text"]) > MAX_CHARS
-        sentence_end = word.strip() and word.strip()[-1] in ".?!"
-
-        if too_long or sentence_end:
-            segments.append(current)
-            current = {"text": "", "start": 0, "end": 0, "words": []}
-
-    if current["words"]:
-        segments.append(current)
-    return segments
-
 # --------------------------------------------------------
 # Gemini 번역 (완전 방어형)
 # --------------------------------------------------------
-def translate_batch_gemini(segments, genre_guide):
+def translate_batch_gemini(segments, genre_guide, usage=None, job_key=None):
+    # segments 와 같은 길이의 번역 목록. 빠졌거나 이상한 항목은 None (호출한 쪽에서 그것만 다시 보냄)
+    # 호출 자체가 실패하면 (인증, 5xx, 스케줄러 재시도 끝난 429 등) 예외를 그대로 올림 → 응답 누락이랑 구분
+    # usage: dict 를 넘기면 토큰 사용량/대기 시간을 채워줌 (span 기록용), job_key: 스케줄러 공평 분배 단위
     input_data = [{"id": i, "text": seg["text"]} for i, seg in enumerate(segments)]
     
     prompt = f"""
@@ -126,15 +180,18 @@ def translate_batch_gemini(segments, genre_guide):
     [{{"id": 0, "ko": "번역문1"}}, {{"id": 1, "ko": "번역문2"}}]
     """
 
+    model = gemini_model("json")
+    # 토큰 예상치: 프롬프트 글자 수 / 3 + 문장당 응답 40 토큰 (응답 받으면 실제 사용량으로 정산)
+    response = gemini_scheduler.call(
+        job_key, lambda: model.generate_content(prompt),
+        tokens=len(prompt) // 3 + 40 * len(input_data), span=usage, usage=gemini_tokens,
+    )
+    if usage is not None:
+        # 재시도로 여러 번 부르면 누적
+        for k, v in gemini_usage(response).items():
+            usage[k] = usage.get(k, 0) + v
+
     try:
-        model = genai.GenerativeModel(
-            model_name=GEMINI_MODEL,
-            generation_config={
-                "response_mime_type": "application/json",
-                "temperature": 0.7
-            }
-        )
-        response = model.generate_content(prompt)
         raw = response.text.strip()
 
         print(f"[Gemini 응답] {raw[:500]}")  # 디버그용
@@ -146,177 +203,912 @@ def translate_batch_gemini(segments, genre_guide):
 
         data = json.loads(raw)
 
-        # 키 보정
-        result = []
-        for i, item in enumerate(data):
-            ko_text = item.get("ko") or item.get("korean") or item.get("text") or "번역없음"
-            result.append({"id": item.get("id", i), "ko": ko_text})
+    except Exception as e:
+        # 응답은 왔는데 못 읽음 (JSON 깨짐, 잘림, 차단 등) → 전부 누락으로 보고 나눠서 다시
+        print(f"Gemini 응답 해석 실패: {e}")
+        return [None] * len(segments)
+
+    # id 로 맞춰 넣음 (순서/개수는 믿지 않음 → 하나 빠져도 뒤 자막이 밀리지 않게)
+    result = [None] * len(segments)
+    for item in data if isinstance(data, list) else []:
+        if not isinstance(item, dict):
+            continue
+        idx = item.get("id")
+        if isinstance(idx, str) and idx.isdigit():
+            idx = int(idx)
+        if not isinstance(idx, int) or not 0 <= idx < len(segments) or result[idx] is not None:
+            continue
+        ko_text = item.get("ko") or item.get("korean")
+        if isinstance(ko_text, str) and ko_text.strip():
+            result[idx] = ko_text.strip()
+    return result
+
+# 배치 하나가 다시 보낼 수 있는 최대 횟수 (나눠 보내기 + 호출 실패 재시도 합쳐서)
+TRANSLATE_MAX_RETRIES = int(os.getenv("WALNUT_TRANSLATE_MAX_RETRIES", "16"))
+
+def translate_bisect(segments, genre_guide, usage=None, job_key=None, tries=2, budget=None):
+    """
+    빠진/깨진 id 만 골라서 반씩 나눠 다시 보냄 (100개 중 1개 틀렸다고 100개 다시 번역하지 않게)
+    한 문장만 남았는데도 계속 실패하면 tries 번까지만. 끝내 안 되면 None 으로 남김
+    호출 자체가 실패하면 나눠봐야 똑같으니 같은 묶음으로 배치당 한 번만 다시 보냄
+    budget: 배치 전체가 같이 쓰는 남은 재시도 횟수 (재귀로 넘겨줌)
+    """
+    if budget is None:
+        budget = {"left": TRANSLATE_MAX_RETRIES, "call_retry": True}
+    result = None
+    while result is None:
+        try:
+            result = translate_batch_gemini(segments, genre_guide, usage, job_key)
+        except Exception as e:
+            print(f"Gemini 호출 실패: {type(e).__name__}: {e}")
+            if not budget["call_retry"] or budget["left"] <= 0:
+                return [None] * len(segments)
+            budget["call_retry"] = False
+            budget["left"] -= 1
+            if usage is not None:
+                usage["retries"] = usage.get("retries", 0) + 1
+                usage["retried_segments"] = usage.get("retried_segments", 0) + len(segments)
+    missing = [i for i, ko in enumerate(result) if ko is None]
+    if not missing:
         return result
+    if len(segments) == 1:
+        if tries <= 1:
+            return result
+        groups, tries = [missing], tries - 1
+    else:
+        half = (len(missing) + 1) // 2
+        groups = [g for g in (missing[:half], missing[half:]) if g]
+    for group in groups:
+        if budget["left"] <= 0:
+            print(f"⚠️ 번역 재시도 한도({TRANSLATE_MAX_RETRIES}회) 초과 → {len(group)}개는 실패로 남김")
+            break
+        budget["left"] -= 1
+        if usage is not None:
+            usage["retries"] = usage.get("retries", 0) + 1
+            usage["retried_segments"] = usage.get("retried_segments", 0) + len(group)
+        retried = translate_bisect([segments[i] for i in group], genre_guide, usage, job_key, tries, budget)
+        for i, ko in zip(group, retried):
+            result[i] = ko
+    return result
 
-    except Exception as e:
-        print(f"Gemini 완전 실패: {e}")
-        return [{"id": d["id"], "ko": d["text"] + " (번역실패)"} for d in input_data]
+# --------------------------------------------------------
+# 배치 병렬 번역 (순서 보장)
+# --------------------------------------------------------
+# 배치 크기는 문장 수가 아니라 예상 토큰으로 자름 (긴 문장이 많으면 배치가 작아짐)
+BATCH_TOKENS = int(os.getenv("WALNUT_BATCH_TOKENS", "4000"))
+BATCH_MAX_SEGMENTS = int(os.getenv("WALNUT_BATCH_MAX_SEGMENTS", "100"))
+# 작업 하나가 동시에 날리는 Gemini 배치 수 (전체 한도는 llm 슬롯)
+TRANSLATE_CONCURRENCY = int(os.getenv("WALNUT_TRANSLATE_CONCURRENCY", "4"))
+
+def segment_tokens(text):
+    # 대충 잡은 값: 영어 입력 ~글자/4 + 한국어 출력 ~글자/4 + JSON 틀
+    return len(text) // 2 + 12
+
+def plan_batches(segments, keys, cached):
+    # 이어진 구간으로 자름 (스트리밍 on_batch 가 시작 인덱스로 내보내니까)
+    # 캐시에 있는 문장/배치 안 중복 문장은 토큰 예산에 안 셈
+    bounds, start, budget, misses, seen = [], 0, 0, 0, set()
+    for i, (seg, k) in enumerate(zip(segments, keys)):
+        if k in cached or k in seen:
+            continue
+        cost = segment_tokens(seg["text"])
+        if misses and (budget + cost > BATCH_TOKENS or misses >= BATCH_MAX_SEGMENTS):
+            bounds.append((start, i))
+            start, budget, misses, seen = i, 0, 0, set()
+        budget += cost
+        misses += 1
+        seen.add(k)
+    if start < len(segments):
+        bounds.append((start, len(segments)))
+    return bounds
+
+def translate_segments(job, segments, genre_guide, on_batch=None, progress=True):
+    # on_batch(시작 인덱스, 번역 목록): 배치 하나 끝날 때마다 (끝나는 순서대로) 호출
+    # progress=False: 진행률은 호출한 쪽에서 (창 단위 파이프라인)
+    # 돌려주는 건 (번역 목록, 끝내 실패한 문장 수). 실패한 건 원문 + (번역실패) 로 채워둠
+    keys = [translation_cache.key(seg["text"], genre_guide, GEMINI_MODEL) for seg in segments]
+    cached = translation_cache.get_many(keys)
+    bounds = plan_batches(segments, keys, cached)
+    results = [None] * len(bounds)
+    latencies = [0.0] * len(bounds)
+    cache_hits = [0] * len(bounds)
+    failed = [0] * len(bounds)
+    done = 0
+
+    def run(batch_idx):
+        lo, hi = bounds[batch_idx]
+        chunk, chunk_keys = segments[lo:hi], keys[lo:hi]
+
+        # 캐시에 있는 건 빼고, 없는 문장만 (중복 제거해서) Gemini로
+        out = [cached.get(k) for k in chunk_keys]
+        cache_hits[batch_idx] = sum(1 for ko in out if ko is not None)
+        miss_keys = list(dict.fromkeys(k for k in chunk_keys if k not in cached))
+        if not miss_keys:
+            return out
+
+        miss_chunk = [chunk[chunk_keys.index(k)] for k in miss_keys]
+        with job_manager.stage(job, "translate", batch=batch_idx, segments=len(miss_chunk),
+                               cache_hits=cache_hits[batch_idx]) as sp:
+            t0 = time.perf_counter()
+            translated = translate_bisect(miss_chunk, genre_guide, sp, job.id if job else None)
+            latencies[batch_idx] = time.perf_counter() - t0
+            failed[batch_idx] = sp["failed"] = sum(1 for ko in translated if ko is None)
+
+        # 끝내 실패한 건 원문 + 표시, 캐시에는 성공한 것만
+        by_key, fresh = {}, {}
+        for seg, k, ko in zip(miss_chunk, miss_keys, translated):
+            if ko is None:
+                by_key[k] = seg["text"] + " (번역실패)"
+            else:
+                by_key[k] = fresh[k] = ko
+        translation_cache.put_many(fresh)
+        return [ko if ko is not None else by_key[k] for k, ko in zip(chunk_keys, out)]
+
+    with ThreadPoolExecutor(max_workers=max(1, TRANSLATE_CONCURRENCY)) as pool:
+        futures = {pool.submit(run, b): b for b in range(len(bounds))}
+        for fut in as_completed(futures):
+            b = futures[fut]
+            results[b] = fut.result()
+            done += len(results[b])
+            if on_batch is not None:
+                on_batch(bounds[b][0], results[b])
+            if job is not None and progress:
+                job.progress = 0.3 + 0.4 * done / max(len(segments), 1)
+            print(f" → 배치 {b + 1}/{len(bounds)} 완료 ({latencies[b]:.2f}s) · {done}/{len(segments)}")
+
+    if job is not None:
+        # 창 단위로 여러 번 부르면 누적
+        m = job.metrics
+        m["translate_batch_sec"] = m.get("translate_batch_sec", []) + [round(t, 3) for t in latencies]
+        m["tm_hits"] = m.get("tm_hits", 0) + sum(cache_hits)
+        m["tm_misses"] = m.get("tm_misses", 0) + len(segments) - sum(cache_hits)
+        m["translate_failed"] = m.get("translate_failed", 0) + sum(failed)
+
+    # 배치 순서대로 다시 이어붙임
+    return [ko for batch in results for ko in batch], sum(failed)
 
 # --------------------------------------------------------
-# 메인 엔드포인트
+# Whisper STT (업로드 내용 해시별로 한 번만)
 # --------------------------------------------------------
-@app.post("/upload/video")
-async def upload_video(file: UploadFile = File(..., max_size=10_000_000_000)):
-    file_id = str(uuid.uuid4())
-    filename = f"{file_id}.mp4"
-    file_path = upload_dir / filename
-    audio_path = upload_dir / f"{file_id}.mp3"
-    srt_path = upload_dir / f"{file_id}.srt"
-    output_path = upload_dir / f"subtitled_{file_id}.mp4"
+def transcript_to_dict(transcript):
+    data = transcript.model_dump() if hasattr(transcript, "model_dump") else dict(transcript)
+    return {
+        "language": data.get("language"),
+        "text": (data.get("text") or "").strip(),
+        "words": [
+            {"word": w["word"], "start": w["start"], "end": w["end"]}
+            for w in data.get("words") or []
+        ],
+        "segments": [
+            {"start": seg["start"], "end": seg["end"], "text": seg["text"]}
+            for seg in data.get("segments") or []
+        ],
+    }
 
-    try:
-        # 1. 파일 저장
-        print("파일 저장 중...")
-        with open(file_path, "wb") as f:
-            shutil.copyfileobj(file.file, f)
-        print(f"✅ 파일 저장 완료: {file_path}")
-
-        # 2. 오디오 추출 (FFmpeg)
-        print("오디오 추출 중...")
-        subprocess.run([
-            FFMPEG_CMD, "-y", "-i", str(file_path), 
-            "-vn", "-acodec", "libmp3lame", str(audio_path)
-        ], check=True, creationflags=subprocess.CREATE_NO_WINDOW if os.name == "nt" else 0)
-        print(f"✅ 오디오 추출 완료: {audio_path}")
-
-        # 3. Whisper STT
-        print("Whisper STT 시작...")
-        openai_key = os.getenv("OPENAI_API_KEY")
-        gemini_key = os.getenv("GEMINI_API_KEY")
-        
-        if not openai_key:
-            raise HTTPException(status_code=500, detail="OPENAI_API_KEY가 .env에 없습니다!")
-        if not gemini_key:
-            raise HTTPException(status_code=500, detail="GEMINI_API_KEY가 .env에 없습니다!")
-        
-        client = OpenAI(api_key=openai_key)
-        genai.configure(api_key=gemini_key)
-        
-        with open(audio_path, "rb") as af:
-            transcript = client.audio.transcriptions.create(
+def merge_transcripts(parts):
+    # 청크별 결과를 시작 오프셋만큼 밀어서 하나의 단어 목록으로
+    merged = {"language": None, "text": "", "words": [], "segments": []}
+    texts = []
+    for data, offset in parts:
+        merged["language"] = merged["language"] or data["language"]
+        texts.append(data["text"])
+        merged["words"] += [
+            {"word": w["word"], "start": w["start"] + offset, "end": w["end"] + offset}
+            for w in data["words"]
+        ]
+        merged["segments"] += [
+            {"start": seg["start"] + offset, "end": seg["end"] + offset, "text": seg["text"]}
+            for seg in data["segments"]
+        ]
+    merged["text"] = " ".join(t for t in texts if t)
+    return merged
+
+def transcribe_file(job, path, offset=0.0):
+    def request():
+        # 429 로 다시 보낼 때 처음부터 읽도록 매번 새로 엶
+        with open(path, "rb") as af:
+            return openai_client().audio.transcriptions.create(
                 model="whisper-1",
                 file=af,
                 response_format="verbose_json",
-                timestamp_granularities=["word"]
+                timestamp_granularities=["word", "segment"]
             )
-        print(f"✅ STT 완료: {len(transcript.words)} 단어")
 
-        # 4. 자막 분할
-        print("자막 분할 중...")
-        segments = regroup_words_dynamic(transcript.words)
-        print(f"✅ 분할 완료: {len(segments)} 세그먼트")
+    with job_manager.stage(job, "stt", bytes_in=os.path.getsize(path), offset=offset) as sp:
+        transcript = whisper_scheduler.call(job.id if job else "text", request, span=sp)
+        data = transcript_to_dict(transcript)
+        sp["words"] = len(data["words"])
+    return data
+
+def transcribe_cached(job, digest, audio_path):
+    # /upload/video 와 /upload/text 가 같은 transcript.json 을 공유
+    if artifacts.has(digest, "transcript.json"):
+        print("♻️ STT 캐시 사용")
+        return artifacts.read_json(digest, "transcript.json")
+
+    # Whisper 업로드 한도 넘으면 무음 위치에서 잘라서 병렬로
+    chunk_dir = artifacts.tmp_path(digest, "chunks")
+    chunk_dir.mkdir()
+    try:
+        with job_manager.stage(job, "split_audio", "ffmpeg") as sp:
+            chunks = split_audio(FFMPEG_CMD, audio_path, chunk_dir)
+            sp["chunks"] = len(chunks)
+
+        def run(chunk):
+            path, offset = chunk
+            return transcribe_file(job, path, offset), offset
+
+        print(f"Whisper STT 시작... ({len(chunks)}개 조각)")
+        with ThreadPoolExecutor(max_workers=len(chunks)) as pool:
+            parts = list(pool.map(run, chunks))
+    finally:
+        shutil.rmtree(chunk_dir, ignore_errors=True)
+
+    data = merge_transcripts(parts)
+    artifacts.write_json(digest, "transcript.json", data)
+    return data
 
-        # 5. 장르 분석
+def ensure_audio(job, digest, file_path):
+    # STT 프로필(16kHz 모노)로 추출한 audio.mp3 를 두 엔드포인트가 같이 씀
+    if not artifacts.has(digest, "audio.mp3"):
+        with job_manager.stage(job, "extract_audio", "ffmpeg", bytes_in=os.path.getsize(file_path)) as sp:
+            print("오디오 추출 중...")
+            tmp = artifacts.tmp_path(digest, "audio.mp3")
+            extract_audio(FFMPEG_CMD, file_path, tmp)
+            sp["bytes_out"] = os.path.getsize(tmp)
+            artifacts.commit(tmp, digest, "audio.mp3")
+            print("✅ 오디오 추출 완료")
+    return artifacts.path(digest, "audio.mp3")
+
+# --------------------------------------------------------
+# 비디오 파이프라인 (작업 스레드에서 실행)
+# --------------------------------------------------------
+def subtitle_items(offset, segments, translations):
+    # 스트리밍으로 내보낼 자막 한 줄씩 (index 는 최종 SRT 순번 - 1)
+    return [
+        {"index": offset + i, "start": seg["start"], "end": seg["end"], "text": seg["text"], "ko": ko}
+        for i, (seg, ko) in enumerate(zip(segments, translations))
+    ]
+
+def publish_cached_srt(job, digest, srt_path):
+    # 캐시된 자막도 스트리밍으로 한 번에 흘려줌 (원문은 segments.json 이 남아 있을 때만)
+    cues = parse_srt(srt_path.read_text(encoding="utf-8"))
+    originals = artifacts.read_json(digest, "segments.json") if artifacts.has(digest, "segments.json") else []
+    if len(originals) != len(cues):
+        originals = [{"text": ""}] * len(cues)
+    job.subtitles_total = len(cues)
+    job.publish(subtitle_items(
+        0, [{**seg, "start": a, "end": b} for seg, (a, b, _) in zip(originals, cues)], [ko for _, _, ko in cues]
+    ))
+
+def genre_guide_for(job, digest, segments, tag):
+    # 앞부분 30문장만 보고 정함 (창 단위 파이프라인에서는 첫 창만 끝나면 바로)
+    genre_name = f"genre.{tag}.txt"
+    if artifacts.has(digest, genre_name):
+        return artifacts.path(digest, genre_name).read_text(encoding="utf-8")
+    with job_manager.stage(job, "genre") as sp:
         print("장르 분석 중...")
-        sample = " ".join([s["text"] for s in segments[:30]])
-        guide_model = genai.GenerativeModel(GEMINI_MODEL)
-        guide_res = guide_model.generate_content(
-    f"""아래 대본 샘플 보고 딱 3줄로 요약해줘:
-
-    1. 이 영상의 장르/종류는? (영화, 유튜브, 강의, 다큐, 게임 스트리밍, ASMR, 브이로그 등)
-    2. 말하는 사람의 톤은? (반말/존댓말, 캐주얼/진지/감정적/차분/흥분 등)
-    3. 한국어 번역할 때 어떤 말투로 해야 제일 자연스러울지 한 문장으로
-
-    대본 샘플:
-    {sample}
-
-    형식:
-    1. [장르]
-    2. [톤]
-    3. [추천 번역 스타일]"""
-    )
+        sample = " ".join([s["text"] for s in segments[:GENRE_SAMPLE_SEGMENTS]])
+        guide_prompt = f"""아래 대본 샘플 보고 딱 3줄로 요약해줘:
+
+            1. 이 영상의 장르/종류는? (영화, 유튜브, 강의, 다큐, 게임 스트리밍, ASMR, 브이로그 등)
+            2. 말하는 사람의 톤은? (반말/존댓말, 캐주얼/진지/감정적/차분/흥분 등)
+            3. 한국어 번역할 때 어떤 말투로 해야 제일 자연스러울지 한 문장으로
+
+            대본 샘플:
+            {sample}
+
+            형식:
+            1. [장르]
+            2. [톤]
+            3. [추천 번역 스타일]"""
+        guide_res = gemini_scheduler.call(
+            job.id, lambda: gemini_model().generate_content(guide_prompt),
+            tokens=len(guide_prompt) // 3 + 100, span=sp, usage=gemini_tokens,
+        )
+        sp.update(gemini_usage(guide_res))
         genre_guide = guide_res.text.strip()
-        print(f"🎯 분석 결과: {genre_guide}")
+    artifacts.write_text(digest, genre_name, genre_guide)
+    manifests.stage(digest, "genre")
+    print(f"🎯 분석 결과: {genre_guide}")
+    return genre_guide
+
+def write_srt(digest, srt_name, segments, translations):
+    final_srt = []
+    for idx, (seg, ko) in enumerate(zip(segments, translations)):
+        start = format_timestamp(seg["start"])
+        end = format_timestamp(seg["end"])
+        final_srt.append(f"{idx + 1}\n{start} --> {end}\n{ko}\n\n")
+    return artifacts.write_text(digest, srt_name, "".join(final_srt))
+
+def run_sequential(job, digest, file_path, tag):
+    # 2. 오디오 추출 (FFmpeg)
+    audio_path = ensure_audio(job, digest, file_path)
+    manifests.stage(digest, "audio")
+    job.progress = 0.1
+
+    # 3. Whisper STT
+    transcript = transcribe_cached(job, digest, audio_path)
+    manifests.stage(digest, "stt", words=len(transcript["words"]))
+    print(f"✅ STT 완료: {len(transcript['words'])} 단어")
+    job.progress = 0.3
+
+    # 4. 자막 분할
+    if artifacts.has(digest, "segments.json"):
+        segments = artifacts.read_json(digest, "segments.json")
+    else:
+        print("자막 분할 중...")
+        with span(job.trace, "segment", words=len(transcript["words"])) as sp:
+            segments = regroup(transcript["words"])
+            sp["segments"] = len(segments)
+        artifacts.write_json(digest, "segments.json", segments)
+    manifests.stage(digest, "segments", segments=len(segments))
+    print(f"✅ 분할 완료: {len(segments)} 세그먼트")
+
+    # 5. 장르 분석
+    genre_guide = genre_guide_for(job, digest, segments, tag)
+
+    # 6. 번역 (배치마다 번역 메모리에 저장 → 중간에 죽어도 끝난 배치는 다시 안 부름)
+    print(f"번역 시작 ({len(segments)}개 세그먼트)")
+    job.subtitles_total = len(segments)
+    translated = 0
 
-        # 6. 번역
-        print(f"번역 시작 ({len(segments)}개 세그먼트)")
-        final_srt = []
-        BATCH_SIZE = 100
+    def on_batch(offset, kos):
+        nonlocal translated
+        job.publish(subtitle_items(offset, segments[offset:offset + len(kos)], kos))
+        translated += len(kos)
+        manifests.stage(digest, "translate", done=False, segments_done=translated, segments_total=len(segments))
 
-        for i in range(0, len(segments), BATCH_SIZE):
-            chunk = segments[i:i+BATCH_SIZE]
-            translated = translate_batch_gemini(chunk, genre_guide)
+    translations, failed = translate_segments(job, segments, genre_guide, on_batch=on_batch)
+    # 실패한 줄이 있으면 번역 단계는 안 끝난 걸로 (이어서 하면 번역 메모리에 없는 실패한 줄만 다시)
+    manifests.stage(digest, "translate", done=not failed, segments_done=len(segments) - failed,
+                    segments_total=len(segments), failed=failed)
+    return segments, translations, failed
 
-            # 안전 매핑
-            trans_map = {}
-            for idx, item in enumerate(translated):
-                orig_text = chunk[idx]["text"]
-                ko_text = item.get("ko", orig_text + " (오류)")
-                trans_map[item.get("id", idx)] = ko_text
+# --------------------------------------------------------
+# 창 단위 파이프라인 (긴 영상)
+# --------------------------------------------------------
+# 창 k 를 STT 하는 동안 창 k+1 을 추출하고, 장르 가이드가 나오면 끝난 창부터 바로 번역.
+# 전체 시간이 단계 합이 아니라 제일 느린 단계 쪽으로 수렴함. 0 이면 끔
+WINDOW_SEC = float(os.getenv("WALNUT_WINDOW_SEC", "300"))
+WINDOW_OVERLAP_SEC = 2.0
+GENRE_SAMPLE_SEGMENTS = 30
+
+def run_windowed(job, digest, file_path, duration, tag):
+    # 스트리밍 업로드로 audio.mp3 가 이미 있으면 그걸 자르고, 없으면 영상에서 바로 구간 추출
+    source = artifacts.path(digest, "audio.mp3") if artifacts.has(digest, "audio.mp3") else file_path
+    windows = plan_windows(duration, WINDOW_SEC, WINDOW_OVERLAP_SEC)
+    n = len(windows)
+    print(f"🪟 창 단위 파이프라인: {duration:.0f}초 → {n}개 창")
+    # 오디오는 창마다 STT 직전에 뽑으니까 따로 기다릴 단계 없음
+    manifests.stage(digest, "audio", windows=n)
+    window_dir = artifacts.tmp_path(digest, "windows")
+    window_dir.mkdir()
+    # 창별 STT 결과는 바로 해시 폴더에 저장 (중간에 죽으면 끝난 창은 다시 안 부름)
+    # 창 길이가 바뀌면 구간이 달라지니까 이름에 넣어둠
+    def checkpoint_name(i):
+        return f"window.{WINDOW_SEC:g}.{i:03d}.json"
+
+    ckpt_lock = threading.Lock()
+    stt_done = [sum(1 for i in range(n) if artifacts.has(digest, checkpoint_name(i)))]
+    tr_done = [0]
+
+    def extract(i):
+        _, _, a, b = windows[i]
+        dst = window_dir / f"window{i:03d}.mp3"
+        with job_manager.stage(job, "extract_window", "ffmpeg", window=i) as sp:
+            extract_window(FFMPEG_CMD, source, dst, a, b - a)
+            sp["bytes_out"] = os.path.getsize(dst)
+        return dst
+
+    def transcribe(i, extracted):
+        if extracted is None:
+            saved = artifacts.read_json(digest, checkpoint_name(i))
+            return saved["data"], saved["words"]
+        keep_start, keep_end, a, _ = windows[i]
+        path = extracted.result()
+        try:
+            data = transcribe_file(job, path, a)
+        finally:
+            path.unlink(missing_ok=True)
+        # 겹쳐 뽑은 부분은 가운데 시점이 맡은 구간 안인 단어/Whisper 세그먼트만 (마지막 창은 끝까지)
+        if i == n - 1:
+            keep_end = float("inf")
+
+        def kept(items, key):
+            out = []
+            for item in items:
+                start, end = item["start"] + a, item["end"] + a
+                if keep_start <= (start + end) / 2 < keep_end:
+                    out.append({key: item[key], "start": start, "end": end})
+            return out
+
+        words = kept(data["words"], "word")
+        data = {"language": data["language"], "segments": kept(data["segments"], "text")}
+        artifacts.write_json(digest, checkpoint_name(i), {"data": data, "words": words})
+        with ckpt_lock:
+            stt_done[0] += 1
+            manifests.stage(digest, "stt", done=False, windows_done=stt_done[0], windows_total=n)
+        return data, words
+
+    segments, pending, futures = [], [], []
+    words_all, whisper_segments, language = [], [], None
+    carry, genre_guide = [], None
+    windows_done = 0
+    translated, failed = [0], [0]
 
-            for idx, seg in enumerate(chunk):
-                ko = trans_map.get(idx, seg["text"])
-                start = format_timestamp(seg["start"])
-                end = format_timestamp(seg["end"])
-                num = i + idx + 1
-                final_srt.append(f"{num}\n{start} --> {end}\n{ko}\n\n")
+    def progress():
+        job.progress = 0.05 + 0.65 * (windows_done / n) * (0.5 + 0.5 * translated[0] / max(len(segments), 1))
 
-            print(f" → {min(i+BATCH_SIZE, len(segments))}/{len(segments)} 완료")
+    def translate(lo, hi):
+        chunk = segments[lo:hi]
+
+        def on_batch(offset, kos):
+            job.publish(subtitle_items(lo + offset, chunk[offset:offset + len(kos)], kos))
+            with ckpt_lock:
+                tr_done[0] += len(kos)
+                manifests.stage(digest, "translate", done=False, segments_done=tr_done[0])
+
+        kos, n_failed = translate_segments(job, chunk, genre_guide, progress=False, on_batch=on_batch)
+        translated[0] += len(chunk)
+        failed[0] += n_failed
+        progress()
+        return kos
+
+    def flush(final=False):
+        # 장르 가이드가 아직 없으면 샘플이 모일 때까지 (또는 마지막 창까지) 기다림
+        nonlocal genre_guide, pending
+        if genre_guide is None:
+            if len(segments) < GENRE_SAMPLE_SEGMENTS and not final:
+                return
+            genre_guide = genre_guide_for(job, digest, segments, tag)
+        if pending:
+            futures.append((pending[0], translate_pool.submit(translate, pending[0], pending[-1] + 1)))
+            pending = []
+
+    # 추출은 한 줄로 (FFmpeg 슬롯), STT 는 창마다 병렬, 분할/장르는 이 스레드에서 창 순서대로
+    extract_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="walnut-window")
+    stt_pool = ThreadPoolExecutor(max_workers=max(1, STT_CONCURRENCY), thread_name_prefix="walnut-window-stt")
+    translate_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="walnut-window-tr")
+    try:
+        if stt_done[0]:
+            print(f"♻️ 창 STT 체크포인트 {stt_done[0]}/{n}개 재사용")
+        extracted = [
+            None if artifacts.has(digest, checkpoint_name(i)) else extract_pool.submit(extract, i)
+            for i in range(n)
+        ]
+        transcribed = [stt_pool.submit(transcribe, i, extracted[i]) for i in range(n)]
+        for i in range(n):
+            data, words = transcribed[i].result()
+            language = language or data["language"]
+            whisper_segments += data.get("segments", [])
+            words_all += words
+            last = i == n - 1
+            with span(job.trace, "segment", words=len(words), window=i) as sp:
+                if last:
+                    done, carry = regroup(carry + words), []
+                else:
+                    done, carry = regroup_partial(carry + words)
+                sp["segments"] = len(done)
+            pending += range(len(segments), len(segments) + len(done))
+            segments += done
+            windows_done += 1
+            progress()
+            flush(final=last)
+        job.subtitles_total = len(segments)
+        translations = []
+        for _, fut in futures:
+            translations += fut.result()
+    finally:
+        for pool in (extract_pool, stt_pool, translate_pool):
+            pool.shutdown(wait=True, cancel_futures=True)
+        shutil.rmtree(window_dir, ignore_errors=True)
+
+    # 한 번에 돌린 것과 같은 캐시 (/upload/text 도 같이 씀)
+    # 창별 text 에는 겹친 구간 말이 두 번 들어가니까 전체 텍스트는 남긴 단어로 다시 만듦
+    artifacts.write_json(digest, "transcript.json", {
+        "language": language, "text": "".join(w["word"] for w in words_all).strip(), "words": words_all,
+        "segments": whisper_segments,
+    })
+    artifacts.write_json(digest, "segments.json", segments)
+    manifests.stage(digest, "stt", windows_done=n, windows_total=n, words=len(words_all))
+    manifests.stage(digest, "segments", segments=len(segments))
+    manifests.stage(digest, "translate", done=not failed[0], segments_done=len(segments) - failed[0],
+                    segments_total=len(segments), failed=failed[0])
+    # transcript.json 에 다 들어갔으니 창별 체크포인트는 지움
+    for i in range(n):
+        artifacts.path(digest, checkpoint_name(i)).unlink(missing_ok=True)
+    print(f"✅ 창 단위 처리 완료: {len(words_all)} 단어 · {len(segments)} 세그먼트")
+    return segments, translations, failed[0]
+
+def run_video_pipeline(job, digest, output="soft"):
+    # 같은 파일이 동시에 들어오면 먼저 온 작업이 끝난 뒤 캐시를 그대로 씀
+    # 업로드 때 걸어둔 pin 은 작업이 끝나면 풀어서 정리 대상이 되게 함
+    # 진행 상황은 manifest.json 에 남고, 실패해도 끝난 단계 산출물은 안 지움 → /jobs/{id}/resume
+    try:
+        with artifacts.lock(digest):
+            manifests.begin(digest, job.id, output)
+            result = _run_video_pipeline(job, digest, output)
+            # 번역 실패한 줄이 섞였으면 결과는 주되 매니페스트에는 partial (이어서 하면 그 줄만 다시)
+            manifests.finish(digest, "partial" if result.get("translate_failed") else "done")
+            return result
+    except Exception as e:
+        print(f"❌ [CRITICAL ERROR] {e}")
+        # 쓰다 만 파일만 정리 (완성된 산출물은 재업로드/이어서 하기 때 재사용)
+        artifacts.discard_tmp(digest)
+        try:
+            manifests.finish(digest, "failed", str(e), job.stage)
+            print(f"⏸️ {job.stage} 단계에서 실패 → POST /jobs/{job.id}/resume 으로 이어서 가능")
+        except Exception as me:
+            print(f"⚠️ 매니페스트 기록 실패: {me}")
+        raise
+    finally:
+        artifacts.unpin(digest)
+
+def _run_video_pipeline(job, digest, output):
+    file_path = artifacts.path(digest, "source.mp4")
+    tag = f"{GEMINI_MODEL}.p{PROMPT_VERSION}"
+    srt_name = f"ko.{tag}.srt"
+    ext, media_type = OUTPUT_MODES[output]
+    output_name = f"{'subtitled' if output == 'hard' else 'softsub'}.{tag}.{ext}"
+
+    def result(output_path, srt_path, failed=0):
+        return {
+            "output_path": str(output_path),
+            "srt_path": str(srt_path),
+            "media_type": media_type,
+            "filename": f"walnut_subtitled.{ext}",
+            "translate_failed": failed,
+        }
+
+    # 정리는 파일 단위라 영상만 남고 자막이 지워졌을 수도 있음 → 그럼 자막부터 다시 만듦
+    if artifacts.has(digest, output_name) and artifacts.has(digest, srt_name):
+        print("♻️ 이미 만든 영상이 있어서 바로 반환")
+        publish_cached_srt(job, digest, artifacts.path(digest, srt_name))
+        manifests.stage(digest, "output", file=output_name)
+        return result(artifacts.path(digest, output_name), artifacts.path(digest, srt_name))
+
+    failed = 0
+    if artifacts.has(digest, srt_name):
+        print("♻️ 자막은 이미 있음 → 영상만 다시 만듦")
+        srt_path = artifacts.path(digest, srt_name)
+        publish_cached_srt(job, digest, srt_path)
+    else:
+        duration = 0.0 if artifacts.has(digest, "transcript.json") or not WINDOW_SEC else probe_duration(FFMPEG_CMD, file_path)
+        if duration >= 2 * WINDOW_SEC > 0:
+            # 긴 영상: 창 단위로 추출/STT/번역을 겹쳐서
+            segments, translations, failed = run_windowed(job, digest, file_path, duration, tag)
+        else:
+            segments, translations, failed = run_sequential(job, digest, file_path, tag)
 
         # 7. SRT 저장
-        with open(srt_path, "w", encoding="utf-8") as f:
-            f.write("".join(final_srt))
+        # 실패한 줄이 섞인 자막/영상은 캐시 이름으로 안 남김 (재업로드/이어서 할 때 그대로 재사용되면 안 됨)
+        # → .partial 이름으로 결과만 주고, 다시 돌리면 번역 메모리에 없는 실패한 줄만 Gemini로
+        if failed:
+            print(f"⚠️ 번역 실패 {failed}줄 → 부분 결과로 저장 (POST /jobs/{job.id}/resume 으로 실패한 줄만 다시)")
+            srt_name = f"ko.{tag}.partial.srt"
+            output_name = f"{output_name.rsplit('.', 1)[0]}.partial.{ext}"
+        srt_path = write_srt(digest, srt_name, segments, translations)
         print(f"✅ SRT 저장 완료: {srt_path}")
+    manifests.stage(digest, "srt", done=not failed, file=srt_name)
 
-        # 8. 하드서브 (FFmpeg - 완벽 escaping 버전)
-        print("하드서브 시작...")
-        def escape_ffmpeg_path(path):
-            s = str(path)
-            s = s.replace("\\", "/")  # 슬래시로 통일
-            s = s.replace(":", "\\:")  # 드라이브 콜론 escaping
-            s = s.replace("'", "'\\''")  # 작은따옴표 escaping
-            return s
+    tmp_output = artifacts.tmp_path(digest, output_name)
+    if output == "hard":
+        # 8. 하드서브 (길면 키프레임 단위로 나눠서 병렬로 굽고 이어붙임)
+        style = "Fontname=Malgun Gothic,Fontsize=18,PrimaryColour=&H00FFFFFF,OutlineColour=&H00000000,BorderStyle=1,Outline=2,Shadow=1,MarginV=35"
 
-        safe_srt_path = escape_ffmpeg_path(srt_path)
-        print(f"[DEBUG] FFmpeg SRT 경로: {safe_srt_path}")
+        with job_manager.stage(job, "hardsub", "ffmpeg", bytes_in=os.path.getsize(file_path)) as sp:
+            print("하드서브 시작...")
+            burn_subtitles(FFMPEG_CMD, file_path, srt_path, tmp_output, style, artifacts.tmp_path(digest, "render"))
+            sp["bytes_out"] = os.path.getsize(tmp_output)
+            output_path = artifacts.commit(tmp_output, digest, output_name)
+            print("✅ 하드서브 완료!")
+    else:
+        # 8. 소프트 자막 (재인코딩 없이 자막 트랙만 추가, 몇 초면 끝)
+        with job_manager.stage(job, "mux", "ffmpeg", bytes_in=os.path.getsize(file_path)) as sp:
+            print(f"자막 트랙 추가 중... ({ext})")
+            mux_soft(FFMPEG_CMD, file_path, srt_path, tmp_output, ext)
+            sp["bytes_out"] = os.path.getsize(tmp_output)
+            output_path = artifacts.commit(tmp_output, digest, output_name)
+            print("✅ 자막 트랙 추가 완료!")
 
-        style = "Fontname=Malgun Gothic,Fontsize=18,PrimaryColour=&H00FFFFFF,OutlineColour=&H00000000,BorderStyle=1,Outline=2,Shadow=1,MarginV=35"
+    manifests.stage(digest, "output", done=not failed, file=output_name)
+    print("🎉 모든 작업 완료!")
+    return result(output_path, srt_path, failed)
 
-        ffmpeg_cmd = [
-            FFMPEG_CMD, "-y",
-            "-i", str(file_path),
-            "-vf", f"subtitles='{safe_srt_path}':force_style='{style}'",
-            "-c:a", "copy",
-            str(output_path)
-        ]
+# --------------------------------------------------------
+# 메인 엔드포인트 (작업 등록만 하고 바로 응답)
+# --------------------------------------------------------
+def require_keys():
+    openai_key = os.getenv("OPENAI_API_KEY")
+    gemini_key = os.getenv("GEMINI_API_KEY")
 
-        print(f"[FFmpeg 명령어]: {' '.join(ffmpeg_cmd)}")
+    if not openai_key:
+        raise HTTPException(status_code=500, detail="OPENAI_API_KEY가 .env에 없습니다!")
+    if not gemini_key:
+        raise HTTPException(status_code=500, detail="GEMINI_API_KEY가 .env에 없습니다!")
+    return openai_key, gemini_key
 
-        result = subprocess.run(
-            ffmpeg_cmd,
-            check=True,
-            capture_output=True,
-            text=True,
-            creationflags=subprocess.CREATE_NO_WINDOW if os.name == "nt" else 0
-        )
-        print(f"✅ 하드서브 완료! FFmpeg 출력: {result.stdout[:200]}...")
+def check_output(output):
+    if output not in OUTPUT_MODES:
+        raise HTTPException(status_code=400, detail=f"지원하지 않는 출력 형식입니다: {output} ({', '.join(OUTPUT_MODES)})")
+    return output
 
-        print("🎉 모든 작업 완료! 파일 전송")
-        return FileResponse(output_path, media_type="video/mp4", filename="walnut_subtitled.mp4")
+# output: soft (기본, MP4 자막 트랙) / soft_mkv (MKV ASS 트랙) / hard (영상에 굽기)
+@app.post("/upload/video")
+async def upload_video(file: UploadFile = File(..., max_size=10_000_000_000), output: str = "soft"):
+    require_keys()
+    check_output(output)
 
-    except HTTPException:
-        raise  # 이미 HTTPException이면 그대로 뱉기
+    # 1. 파일 저장 (저장하면서 SHA-256 계산)
+    print("파일 저장 중...")
+    trace = []
+    digest = None
+    try:
+        with span(trace, "save") as sp:
+            digest, file_path = await artifacts.ingest(file, "mp4")
+            sp["bytes_in"] = os.path.getsize(file_path)
     except Exception as e:
-        import traceback
-        print(f"❌ [CRITICAL ERROR] {e}")
-        traceback.print_exc()
-        # 임시 파일들 삭제 (정리)
-        for path in [file_path, audio_path, srt_path, output_path]:
-            if path.exists():
-                path.unlink()
-        raise HTTPException(status_code=500, detail=f"서버 오류: {str(e)}")
-    
+        # ingest 가 끝났으면 pin 이 걸린 상태 → 풀어야 정리 대상이 됨
+        if digest:
+            artifacts.unpin(digest)
+        raise HTTPException(status_code=500, detail=f"파일 저장 실패: {str(e)}")
+    print(f"✅ 파일 저장 완료: {file_path}")
+
+    job = job_manager.submit("video", run_video_pipeline, digest, output, trace=trace)
+    return {**job.to_dict(), "content_sha256": digest}
+
+# 스트리밍 업로드: multipart 말고 요청 본문에 파일 그대로 (Content-Type: video/mp4)
+# 디스크에 한 번 쓰면서 같은 바이트를 FFmpeg stdin 으로 넘겨서, 업로드 끝날 때쯤 오디오도 끝남
+@app.post("/upload/video/stream")
+async def upload_video_stream(request: Request, output: str = "soft"):
+    require_keys()
+    check_output(output)
+
+    # FFmpeg 슬롯이 꽉 차 있으면 그냥 저장만 하고 추출은 파이프라인에서
+    extractor = None
+    if job_manager.try_acquire("ffmpeg"):
+        try:
+            extractor = await StreamingExtractor(FFMPEG_CMD, artifacts.staging_path("mp3")).start()
+        except Exception as e:
+            print(f"⚠️ 스트리밍 추출 시작 실패, 저장 후 추출로 진행: {e}")
+            job_manager.release("ffmpeg")
+
+    print("파일 저장 중... (스트리밍)")
+    trace = []
+    digest = None
+    try:
+        with span(trace, "save", streamed_audio=False) as sp:
+            digest, file_path = await artifacts.ingest_stream(
+                request.stream(), "mp4", tee=extractor.feed if extractor else None
+            )
+            sp["bytes_in"] = os.path.getsize(file_path)
+            sp["streamed_audio"] = bool(extractor and await extractor.finish(file_path))
+        if sp["streamed_audio"]:
+            artifacts.adopt(extractor.dst, digest, "audio.mp3")
+            print("✅ 업로드와 동시에 오디오 추출 완료")
+        elif extractor:
+            print("⚠️ 파이프 추출 실패 (moov 위치 등) → 파이프라인에서 파일로 다시 추출")
+    except Exception as e:
+        if extractor:
+            await extractor.abort()
+        # ingest_stream 이 끝난 뒤 (추출 마무리/adopt 등) 실패했으면 pin 이 걸린 상태 → 풀어줌
+        if digest:
+            artifacts.unpin(digest)
+        raise HTTPException(status_code=500, detail=f"파일 저장 실패: {str(e)}")
+    finally:
+        if extractor:
+            job_manager.release("ffmpeg")
+    print(f"✅ 파일 저장 완료: {file_path}")
+
+    job = job_manager.submit("video", run_video_pipeline, digest, output, trace=trace)
+    return {**job.to_dict(), "content_sha256": digest}
+
+# ?trace=1 이면 단계별 span (시간, 슬롯 대기, 바이트, 단어/세그먼트 수, 토큰) 도 같이
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str, trace: bool = False):
+    job = job_manager.get(job_id)
+    if not job:
+        # 재시작 등으로 메모리에 없으면 매니페스트 기준으로라도 (이어서 할 수 있는지 보여줌)
+        data = await asyncio.to_thread(load_job_manifest, job_id)
+        if data is None:
+            raise HTTPException(status_code=404, detail="작업을 찾을 수 없습니다.")
+        latest = data["jobs"][-1]
+        summary = ManifestStore.summary(data)
+        # 이어서 돌린 작업이 따로 있으면 그쪽이 최신 상태
+        status = summary["status"] if latest == job_id else "superseded"
+        return {"job_id": job_id, "kind": "video", "latest_job_id": latest, "content_sha256": data["digest"],
+                **summary, "status": status}
+    return job.to_dict(trace)
+
+def load_job_manifest(job_id):
+    digest = manifests.find(job_id)
+    return manifests.load(digest) if digest else None
+
+async def manifest_job_result(job_id):
+    # 재시작 등으로 메모리에 없는 작업: GET /jobs/{id} 가 done 이라고 하면 결과도 매니페스트에 적힌 파일로 줌
+    data = await asyncio.to_thread(load_job_manifest, job_id)
+    if data is None:
+        raise HTTPException(status_code=404, detail="작업을 찾을 수 없습니다.")
+    latest = data["jobs"][-1]
+    if latest != job_id:
+        raise HTTPException(status_code=409, detail=f"같은 파일로 나중에 돌린 작업이 있습니다 (superseded): {latest}")
+    status = data.get("status")
+    if status == "failed":
+        raise HTTPException(status_code=500, detail=f"서버 오류: {data.get('error')}")
+    if status == "interrupted":
+        raise HTTPException(status_code=409, detail=f"중단된 작업입니다. POST /jobs/{job_id}/resume 으로 이어서 해주세요.")
+    if status not in ("done", "partial"):
+        raise HTTPException(status_code=409, detail="아직 작업 중입니다.")
+    stages = data.get("stages", {})
+    output_file = stages.get("output", {}).get("file")
+    srt_file = stages.get("srt", {}).get("file")
+    if not output_file or not srt_file:
+        raise HTTPException(status_code=410, detail="보관 기간이 지나 결과물이 삭제되었습니다. 다시 업로드해주세요.")
+    ext, media_type = OUTPUT_MODES[data.get("output") or "soft"]
+    return {
+        "output_path": str(artifacts.path(data["digest"], output_file)),
+        "srt_path": str(artifacts.path(data["digest"], srt_file)),
+        "media_type": media_type,
+        "filename": f"walnut_subtitled.{ext}",
+        "translate_failed": stages.get("translate", {}).get("failed", 0),
+    }
+
+# 실패했거나 서버가 죽어서 멈춘 작업을 끝난 단계 다음부터 다시 돌림
+# (오디오/STT/분할/장르/번역 배치/SRT 중 저장된 건 건너뜀 → Whisper/Gemini 다시 안 부름)
+# output 을 주면 출력 형식만 바꿔서 (자막까지는 그대로 재사용)
+@app.post("/jobs/{job_id}/resume")
+async def resume_job(job_id: str, output: str = ""):
+    require_keys()
+    job = job_manager.get(job_id)
+    if job and not job.finished:
+        raise HTTPException(status_code=409, detail="아직 진행 중인 작업입니다.")
+    data = await asyncio.to_thread(load_job_manifest, job_id)
+    if data is None:
+        raise HTTPException(status_code=404, detail="작업을 찾을 수 없습니다.")
+    for other in data["jobs"]:
+        running = job_manager.get(other)
+        if running and not running.finished:
+            raise HTTPException(status_code=409, detail=f"이미 이어서 진행 중인 작업이 있습니다: {other}")
+    digest = data["digest"]
+    if not artifacts.has(digest, "source.mp4"):
+        raise HTTPException(status_code=410, detail="원본 영상이 정리되어 이어서 할 수 없습니다. 다시 업로드해 주세요.")
+    output = check_output(output or data.get("output") or "soft")
+
+    summary = ManifestStore.summary(data)
+    print(f"▶️ 작업 이어서 시작: {job_id} → 남은 단계: {summary['resume_from'] or '없음 (결과만 다시 확인)'}")
+    artifacts.pin(digest)
+    new_job = job_manager.submit("video", run_video_pipeline, digest, output)
+    return {**new_job.to_dict(), "content_sha256": digest, "resumed_from": job_id,
+            "completed_stages": summary["completed_stages"], "resume_from": summary["resume_from"]}
+
+# --------------------------------------------------------
+# Prometheus 메트릭 (단계별 히스토그램 + 캐시/디스크/작업 상태)
+# --------------------------------------------------------
+REGISTRY.gauge("walnut_jobs", "상태별 작업 수 (메모리에 남아 있는 것 기준)", job_manager.counts, ("status",))
+REGISTRY.gauge("walnut_translation_cache_hits_total", "번역 캐시 적중 수",
+               lambda: translation_cache.stats()["hits"], kind="counter")
+REGISTRY.gauge("walnut_translation_cache_misses_total", "번역 캐시 미스 수",
+               lambda: translation_cache.stats()["misses"], kind="counter")
+REGISTRY.gauge("walnut_translation_cache_items", "번역 캐시 항목 수",
+               lambda: {("memory",): translation_cache.stats()["memory_items"],
+                        ("disk",): translation_cache.stats()["disk_items"]}, ("tier",))
+REGISTRY.gauge("walnut_api_concurrency_limit", "API 별 현재 동시 호출 한도 (429 받으면 줄어듦)",
+               lambda: {(s.name,): s.limit for s in (whisper_scheduler, gemini_scheduler)}, ("api",))
+REGISTRY.gauge("walnut_api_inflight", "API 별 진행 중인 호출 수",
+               lambda: {(s.name,): s.inflight for s in (whisper_scheduler, gemini_scheduler)}, ("api",))
+REGISTRY.gauge("walnut_api_queued", "API 별 대기 중인 호출 수",
+               lambda: {(s.name,): s.stats()["queued"] for s in (whisper_scheduler, gemini_scheduler)}, ("api",))
+REGISTRY.gauge("walnut_artifact_bytes", "산출물 저장소 디스크 사용량", lambda: artifacts.usage()["bytes"])
+REGISTRY.gauge("walnut_artifact_quota_bytes", "산출물 저장소 디스크 한도", lambda: artifacts.quota_bytes)
+REGISTRY.gauge("walnut_artifact_evicted_bytes_total", "정리로 지운 산출물 바이트",
+               lambda: artifacts.evicted_bytes, kind="counter")
+
+@app.get("/metrics")
+async def get_metrics():
+    # 디스크 사용량 계산이 폴더를 훑어서 스레드에서
+    return Response(await asyncio.to_thread(REGISTRY.render), media_type=CONTENT_TYPE)
+
+# Range / ETag / HEAD 지원 → 플레이어에서 바로 탐색 재생, 끊겨도 이어받기 가능
+# ?download=1 이면 첨부파일로 내려줌
+@app.api_route("/jobs/{job_id}/result", methods=["GET", "HEAD"])
+async def get_job_result(job_id: str, request: Request, download: bool = False):
+    job = job_manager.get(job_id)
+    if not job:
+        result = await manifest_job_result(job_id)
+    elif job.status == "failed":
+        raise HTTPException(status_code=500, detail=f"서버 오류: {job.error}")
+    elif job.status != "done":
+        raise HTTPException(status_code=409, detail="아직 작업 중입니다.")
+    else:
+        result = job.result
+    if not os.path.exists(result["output_path"]):
+        raise HTTPException(status_code=410, detail="보관 기간이 지나 결과물이 삭제되었습니다. 다시 업로드해주세요.")
+    artifacts.touch_file(result["output_path"])
+    return ranged_file_response(request, result["output_path"], result["media_type"], result["filename"], download)
+
+# 번역 끝난 자막을 배치 단위로 바로바로 흘려줌 (전체 작업이 끝날 때까지 안 기다림)
+# format=ndjson (기본, 한 줄에 JSON 하나) / sse (EventSource 용, 끊기면 Last-Event-ID 부터 이어서)
+SUBTITLE_POLL_SEC = 0.25
+
+@app.get("/jobs/{job_id}/segments")
+async def stream_job_segments(job_id: str, request: Request, format: str = "ndjson", since: int = 0):
+    job = job_manager.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="작업을 찾을 수 없습니다.")
+    if format not in ("ndjson", "sse"):
+        raise HTTPException(status_code=400, detail="ndjson 또는 sse 만 지원합니다.")
+    last_id = request.headers.get("last-event-id")
+    cursor = int(last_id) + 1 if last_id and last_id.isdigit() else max(0, since)
+
+    def encode(event, data, event_id=None):
+        body = json.dumps(data, ensure_ascii=False)
+        if format == "ndjson":
+            return body + "\n"
+        head = f"id: {event_id}\n" if event_id is not None else ""
+        return f"{head}event: {event}\ndata: {body}\n\n"
+
+    async def events():
+        nonlocal cursor
+        while True:
+            # 상태를 먼저 보고 나서 자막을 읽어야 끝나기 직전에 올라온 배치를 안 놓침
+            finished = job.finished
+            for item in job.subtitles_since(cursor):
+                cursor += 1
+                yield encode("segment", {"type": "segment", **item}, cursor - 1)
+            if finished:
+                yield encode("end", {"type": "end", "status": job.status, "error": job.error,
+                                     "total": job.subtitles_total})
+                return
+            if await request.is_disconnected():
+                return
+            await asyncio.sleep(SUBTITLE_POLL_SEC)
+
+    media_type = "application/x-ndjson" if format == "ndjson" else "text/event-stream"
+    return StreamingResponse(events(), media_type=media_type,
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+def partial_srt(job):
+    done = sorted(job.subtitles_since(0), key=lambda item: item["index"])
+    return "".join(
+        f"{n + 1}\n{format_timestamp(item['start'])} --> {format_timestamp(item['end'])}\n{item['ko']}\n\n"
+        for n, item in enumerate(done)
+    )
+
+# 자막 파일만 따로 (srt / vtt)
+# 작업 중이면 지금까지 번역된 자막만 담아서 줌 (X-Walnut-Partial: 1)
+@app.api_route("/jobs/{job_id}/subtitles.{fmt}", methods=["GET", "HEAD"])
+async def get_job_subtitles(job_id: str, fmt: str, request: Request):
+    if fmt not in ("srt", "vtt"):
+        raise HTTPException(status_code=400, detail="srt 또는 vtt 만 지원합니다.")
+    job = job_manager.get(job_id)
+    # 메모리에 없으면 매니페스트에 적힌 자막 파일로 (재시작 뒤에도 GET /jobs/{id} 와 같은 상태)
+    result = await manifest_job_result(job_id) if not job else job.result
+    if job and job.status != "done":
+        if not job.subtitles:
+            if job.status == "failed":
+                raise HTTPException(status_code=500, detail=f"서버 오류: {job.error}")
+            raise HTTPException(status_code=409, detail="아직 번역된 자막이 없습니다.")
+        srt = partial_srt(job)
+        body, media_type = (srt, "application/x-subrip") if fmt == "srt" else (to_vtt(parse_srt(srt)), "text/vtt; charset=utf-8")
+        return Response(body if request.method == "GET" else None, media_type=media_type, headers={
+            "Content-Disposition": f'attachment; filename="walnut_ko.partial.{fmt}"',
+            "Cache-Control": "no-store",
+            "X-Walnut-Partial": "1",
+        })
+    if not os.path.exists(result["srt_path"]):
+        raise HTTPException(status_code=410, detail="보관 기간이 지나 자막 파일이 삭제되었습니다.")
+    artifacts.touch_file(result["srt_path"])
+    if fmt == "srt":
+        return ranged_file_response(request, result["srt_path"], "application/x-subrip", "walnut_ko.srt", True)
+    with open(result["srt_path"], "r", encoding="utf-8") as f:
+        vtt = to_vtt(parse_srt(f.read()))
+    return Response(vtt, media_type="text/vtt; charset=utf-8",
+                    headers={"Content-Disposition": 'attachment; filename="walnut_ko.vtt"'})
+
     # === 새로운 엔드포인트: 텍스트만 추출 (30 호두) ===
 @app.post("/upload/text")
 async def extract_text(file: UploadFile = File(...)):
-    file_id = str(uuid.uuid4())
-    file_path = upload_dir / f"{file_id}_audio"
-    
     # 지원 확장자 (mp4, mp3, wav, m4a 등)
     allowed = ["mp4", "mp3", "wav", "m4a", "webm", "ogg"]
     ext = file.filename.lower().split(".")[-1]
@@ -324,24 +1116,25 @@ async def extract_text(file: UploadFile = File(...)):
         raise HTTPException(status_code=400, detail="지원하지 않는 파일 형식입니다.")
 
     try:
-        # 파일 저장
-        with open(file_path, "wb") as f:
-            shutil.copyfileobj(file.file, f)
+        # 파일 저장 (저장하면서 SHA-256 계산)
+        digest, file_path = await artifacts.ingest(file, ext)
 
         print("텍스트 추출 시작... (Whisper 자동 언어 감지)")
 
-        client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-        with open(file_path, "rb") as af:
-            transcript = client.audio.transcriptions.create(
-                model="whisper-1",
-                file=af,
-                response_format="verbose_json",           # ← 이거 있으면 언어 감지 + 세그먼트 줌
-                timestamp_granularities=["word"]          # ← 단어별 타임스탬프 (필수는 아님)
-            )
+        # 원본(MP4 일 수도 있음)을 그대로 올리지 않고 STT 프로필 오디오로 뽑아서 전송
+        # 비디오 작업이랑 같은 슬롯, 같은 audio.mp3 / transcript.json 을 나눠 씀
+        def transcribe():
+            if not artifacts.has(digest, "transcript.json"):
+                ensure_audio(None, digest, file_path)
+            return transcribe_cached(None, digest, artifacts.path(digest, "audio.mp3"))
+        try:
+            transcript = await asyncio.to_thread(transcribe)
+        finally:
+            artifacts.unpin(digest)
 
         # 언어 감지 결과 (Whisper가 자동으로 알려줌!)
-        detected_lang = transcript.language
-        full_text = transcript.text.strip()
+        detected_lang = transcript["language"]
+        full_text = transcript["text"]
 
         print(f"감지된 언어: {detected_lang.upper()}")
         print(f"텍스트 길이: {len(full_text)}자")
@@ -350,19 +1143,9 @@ async def extract_text(file: UploadFile = File(...)):
         result = {
             "language": detected_lang,
             "text": full_text,
-            "segments": [
-                {
-                    "start": seg.start,
-                    "end": seg.end,
-                    "text": seg.text
-                } for seg in transcript.segments
-            ] if hasattr(transcript, "segments") else []
+            "segments": transcript["segments"],
         }
 
-        # 임시 파일 정리
-        if file_path.exists():
-            file_path.unlink()
-
         return result
 
     except Exception as e:
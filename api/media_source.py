@@ -0,0 +1,89 @@
+import os
+import copy
+import shutil
+from pathlib import Path
+from urllib.parse import urlparse, unquote
+
+from audio import probe_duration
+
+# ========================================================
+# URL → 메타데이터 / 오디오 / 영상 (yt-dlp 감싸기)
+# ========================================================
+# index.py 는 여기만 부름 → 테스트할 때는 WALNUT_MEDIA_MOCK_DIR 로 로컬 파일을 대신 씀
+#   WALNUT_MEDIA_MOCK_DIR=/tmp/media  →  url "abc" 또는 "https://.../abc" 는 /tmp/media/abc.mp4
+MOCK_DIR = os.getenv("WALNUT_MEDIA_MOCK_DIR")
+
+# 오디오만 받을 때 (Whisper 는 m4a/webm 도 바로 읽음 → MP3 변환 안 함)
+AUDIO_FORMAT = "bestaudio[ext=m4a]/bestaudio/best"
+# 영상만 받을 때 (소리는 오디오 파일에서 가져와서 합침)
+VIDEO_FORMAT = "bestvideo[ext=mp4]/bestvideo/best[ext=mp4]/best"
+
+
+def _downloaded_path(ydl, info):
+    # 실제로 저장된 경로 (확장자는 받아봐야 앎)
+    for d in info.get("requested_downloads") or []:
+        if d.get("filepath"):
+            return Path(d["filepath"])
+    return Path(ydl.prepare_filename(info))
+
+
+class YtDlpSource:
+    def info(self, url):
+        import yt_dlp
+        with yt_dlp.YoutubeDL({"quiet": True}) as ydl:
+            return ydl.extract_info(url, download=False)
+
+    def _download(self, url, dst_dir, name, fmt, info=None):
+        import yt_dlp
+        opts = {"format": fmt, "outtmpl": str(Path(dst_dir) / f"{name}.%(ext)s"), "quiet": True}
+        with yt_dlp.YoutubeDL(opts) as ydl:
+            # 견적 때 받아둔 info 가 있으면 다시 조회 안 하고 바로 다운로드
+            if info is not None:
+                # 캐시에 든 원본은 다른 요청도 같이 보니까 복사본으로 (yt-dlp 가 안에서 고침)
+                info = ydl.process_ie_result(copy.deepcopy(info), download=True)
+            else:
+                info = ydl.extract_info(url, download=True)
+            return _downloaded_path(ydl, info)
+
+    def download_audio(self, url, dst_dir, info=None):
+        return self._download(url, dst_dir, "audio", AUDIO_FORMAT, info)
+
+    def download_video(self, url, dst_dir, info=None):
+        return self._download(url, dst_dir, "video", VIDEO_FORMAT, info)
+
+
+class LocalSource:
+    """테스트용: 네트워크 없이 폴더 안 파일을 그대로 씀 (영상 파일 하나를 오디오/영상 둘 다로)"""
+
+    def __init__(self, root):
+        self.root = Path(root)
+
+    def _file(self, url):
+        name = unquote(Path(urlparse(url).path).name or url)
+        path = self.root / name
+        if not path.suffix:
+            path = path.with_suffix(".mp4")
+        if not path.exists():
+            raise FileNotFoundError(f"테스트 파일 없음: {path}")
+        return path
+
+    def info(self, url):
+        path = self._file(url)
+        return {"id": path.stem, "title": path.stem, "duration": round(probe_duration("ffmpeg", path)),
+                "webpage_url": url}
+
+    def _copy(self, url, dst_dir, name):
+        src = self._file(url)
+        dst = Path(dst_dir) / f"{name}{src.suffix}"
+        shutil.copyfile(src, dst)
+        return dst
+
+    def download_audio(self, url, dst_dir, info=None):
+        return self._copy(url, dst_dir, "audio")
+
+    def download_video(self, url, dst_dir, info=None):
+        return self._copy(url, dst_dir, "video")
+
+
+def get_source():
+    return LocalSource(MOCK_DIR) if MOCK_DIR else YtDlpSource()
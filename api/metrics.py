@@ -0,0 +1,200 @@
+import time
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# ========================================================
+# 단계별 시간 측정 + Prometheus /metrics (텍스트 형식 직접 출력, 추가 패키지 없음)
+# ========================================================
+# 초 단위 버킷: FFmpeg/Whisper 는 수십 초~수십 분, Gemini 배치는 수 초
+SECONDS_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+
+# 작업 하나에 쌓는 span 최대 개수 (배치가 수백 개여도 메모리 안 터지게)
+MAX_TRACE_SPANS = 500
+
+
+def _escape(v):
+    return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    return "{" + ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values)) + "}"
+
+
+def _num(v):
+    return "+Inf" if v == float("inf") else repr(float(v)) if isinstance(v, float) else str(v)
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help, labelnames=()):
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(n, "") for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, self.labelnames, key, v) for key, v in self._values.items()]
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=SECONDS_BUCKETS):
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        self._values = {}  # labels → [버킷별 개수, 합계, 개수]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(n, "") for n in self.labelnames)
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.setdefault(key, [[0] * len(self.buckets), 0.0, 0])
+            state[0][i] += 1
+            state[1] += value
+            state[2] += 1
+
+    def samples(self):
+        out = []
+        names = self.labelnames + ("le",)
+        with self._lock:
+            items = [(k, list(c), s, n) for k, (c, s, n) in self._values.items()]
+        for key, counts, total, n in items:
+            acc = 0
+            for bound, c in zip(self.buckets, counts):
+                acc += c
+                out.append((f"{self.name}_bucket", names, key + (_num(bound),), acc))
+            out.append((f"{self.name}_sum", self.labelnames, key, total))
+            out.append((f"{self.name}_count", self.labelnames, key, n))
+        return out
+
+
+class Gauge:
+    """
+    값을 들고 있지 않고 /metrics 요청 때마다 콜백으로 읽음 (캐시 크기, 디스크 사용량 등)
+    다른 모듈이 이미 세고 있는 누적값은 kind="counter" 로 내보냄
+    """
+
+    def __init__(self, name, help, fn, labelnames=(), kind="gauge"):
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+        self.fn = fn
+        self.kind = kind
+
+    def samples(self):
+        value = self.fn()
+        if not self.labelnames:
+            return [(self.name, (), (), value)]
+        # 라벨이 있으면 fn 은 {라벨값 튜플: 값}
+        return [(self.name, self.labelnames, key, v) for key, v in value.items()]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, *args, **kwargs):
+        return self.register(Counter(*args, **kwargs))
+
+    def histogram(self, *args, **kwargs):
+        return self.register(Histogram(*args, **kwargs))
+
+    def gauge(self, *args, **kwargs):
+        return self.register(Gauge(*args, **kwargs))
+
+    def render(self):
+        lines = []
+        for m in self._metrics:
+            try:
+                samples = m.samples()
+            except Exception as e:
+                print(f"⚠️ 메트릭 수집 실패 ({m.name}): {e}")
+                continue
+            lines.append(f"# HELP {m.name} {m.help}")
+            lines.append(f"# TYPE {m.name} {m.kind}")
+            for name, labelnames, values, v in samples:
+                lines.append(f"{name}{_labels(labelnames, values)} {_num(v)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+STAGE_SECONDS = REGISTRY.histogram("walnut_stage_seconds", "단계별 실행 시간 (슬롯 대기 제외)", ("stage",))
+STAGE_WAIT_SECONDS = REGISTRY.histogram("walnut_stage_wait_seconds", "동시 실행 슬롯을 기다린 시간", ("slot",))
+STAGE_BYTES = REGISTRY.counter("walnut_stage_bytes_total", "단계별 입출력 바이트", ("stage", "direction"))
+STAGE_ITEMS = REGISTRY.counter("walnut_stage_items_total", "단계별 처리 개수 (단어/세그먼트 등)", ("stage", "unit"))
+STAGE_ERRORS = REGISTRY.counter("walnut_stage_errors_total", "예외로 끝난 단계 수", ("stage",))
+LLM_SECONDS = REGISTRY.histogram("walnut_llm_request_seconds", "LLM/STT API 호출 시간", ("kind",))
+LLM_TOKENS = REGISTRY.counter("walnut_llm_tokens_total", "LLM 토큰 사용량", ("kind", "direction"))
+
+
+# --------------------------------------------------------
+# span: 단계 하나의 기록 (작업별 trace 에 쌓이고 히스토그램에도 반영)
+# --------------------------------------------------------
+# attrs 에 넣을 수 있는 키
+#   bytes_in / bytes_out        → walnut_stage_bytes_total
+#   words / segments / ...      → 정수면 walnut_stage_items_total{unit=키}
+#   prompt_tokens / completion_tokens / llm_sec → LLM 메트릭
+ITEM_KEYS = ("words", "segments", "chunks", "cache_hits", "retries", "retried_segments", "failed")
+
+
+def record(trace, name, started, duration, wait, attrs, error=None):
+    STAGE_SECONDS.observe(duration, stage=name)
+    if error:
+        STAGE_ERRORS.inc(stage=name)
+    for direction in ("in", "out"):
+        if attrs.get(f"bytes_{direction}"):
+            STAGE_BYTES.inc(attrs[f"bytes_{direction}"], stage=name, direction=direction)
+    for unit in ITEM_KEYS:
+        if attrs.get(unit):
+            STAGE_ITEMS.inc(attrs[unit], stage=name, unit=unit)
+    if "llm_sec" in attrs:
+        LLM_SECONDS.observe(attrs["llm_sec"], kind=name)
+    for direction in ("prompt", "completion"):
+        if attrs.get(f"{direction}_tokens"):
+            LLM_TOKENS.inc(attrs[f"{direction}_tokens"], kind=name, direction=direction)
+    if trace is not None and len(trace) < MAX_TRACE_SPANS:
+        entry = {"stage": name, "start": round(started, 3), "sec": round(duration, 3)}
+        if wait:
+            entry["wait_sec"] = round(wait, 3)
+        if error:
+            entry["error"] = error
+        entry.update((k, round(v, 3) if isinstance(v, float) else v) for k, v in attrs.items())
+        trace.append(entry)
+
+
+@contextmanager
+def span(trace, name, wait=0.0, **attrs):
+    """with span(job.trace, "stt") as sp: sp["bytes_in"] = ... — trace 가 None 이면 메트릭만"""
+    started = time.time()
+    t0 = time.perf_counter()
+    try:
+        yield attrs
+    except Exception as e:
+        record(trace, name, started, time.perf_counter() - t0, wait, attrs, type(e).__name__)
+        raise
+    record(trace, name, started, time.perf_counter() - t0, wait, attrs)
+
+
+def gemini_usage(response):
+    # google.generativeai 응답의 usage_metadata (없으면 빈 dict)
+    usage = getattr(response, "usage_metadata", None)
+    if usage is None:
+        return {}
+    return {
+        "prompt_tokens": getattr(usage, "prompt_token_count", 0) or 0,
+        "completion_tokens": getattr(usage, "candidates_token_count", 0) or 0,
+    }
@@ -0,0 +1,187 @@
+import os
+import re
+import csv
+import shutil
+import subprocess
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+from audio import CREATE_NO_WINDOW, probe_duration
+
+# ========================================================
+# 자막 굽기 (하드서브)
+# ========================================================
+# single: 기존처럼 FFmpeg 한 번 / parallel: 키프레임 기준으로 나눠서 여러 프로세스로
+RENDER_MODE = os.getenv("WALNUT_RENDER_MODE", "parallel")
+RENDER_WORKERS = int(os.getenv("WALNUT_RENDER_WORKERS", str(max(1, (os.cpu_count() or 2) // 2))))
+X264_PRESET = os.getenv("WALNUT_X264_PRESET", "medium")
+X264_CRF = os.getenv("WALNUT_X264_CRF", "23")
+# 이것보다 짧은 영상은 나눠봤자 오버헤드가 더 큼
+PARALLEL_MIN_SEC = float(os.getenv("WALNUT_RENDER_PARALLEL_MIN_SEC", "120"))
+
+# 결과물 형식: (확장자, media type)
+# hard: 자막을 영상에 굽기 (재인코딩) / soft: MP4 mov_text 트랙 / soft_mkv: MKV ASS 트랙
+OUTPUT_MODES = {
+    "hard": ("mp4", "video/mp4"),
+    "soft": ("mp4", "video/mp4"),
+    "soft_mkv": ("mkv", "video/x-matroska"),
+}
+
+
+def escape_ffmpeg_path(path):
+    s = str(path)
+    s = s.replace("\\", "/")  # 슬래시로 통일
+    s = s.replace(":", "\\:")  # 드라이브 콜론 escaping
+    s = s.replace("'", "'\\''")  # 작은따옴표 escaping
+    return s
+
+
+def _run(cmd):
+    return subprocess.run(cmd, check=True, capture_output=True, text=True, creationflags=CREATE_NO_WINDOW)
+
+
+def burn_single(ffmpeg, src, srt, dst, style, preset=X264_PRESET, crf=X264_CRF, threads=0):
+    cmd = [
+        ffmpeg, "-y",
+        "-i", str(src),
+        "-vf", f"subtitles='{escape_ffmpeg_path(srt)}':force_style='{style}'",
+        "-c:v", "libx264", "-preset", preset, "-crf", str(crf),
+        "-c:a", "copy",
+        str(dst)
+    ]
+    if threads:
+        cmd[-1:-1] = ["-threads", str(threads)]
+    print(f"[FFmpeg 명령어]: {' '.join(cmd)}")
+    return _run(cmd)
+
+
+# --------------------------------------------------------
+# SRT 시간 밀기 (조각별 자막)
+# --------------------------------------------------------
+_TS = re.compile(r"(\d+):(\d+):(\d+),(\d+)\s*-->\s*(\d+):(\d+):(\d+),(\d+)")
+
+
+def _sec(h, m, s, ms):
+    return int(h) * 3600 + int(m) * 60 + int(s) + int(ms) / 1000
+
+
+def _ts(seconds):
+    ms = int(round(seconds * 1000))
+    h, ms = divmod(ms, 3600_000)
+    m, ms = divmod(ms, 60_000)
+    s, ms = divmod(ms, 1000)
+    return f"{h:02d}:{m:02d}:{s:02d},{ms:03d}"
+
+
+def parse_srt(text):
+    cues = []
+    for block in re.split(r"\n\s*\n", text.strip()):
+        lines = block.splitlines()
+        for i, line in enumerate(lines):
+            m = _TS.search(line)
+            if m:
+                g = m.groups()
+                cues.append((_sec(*g[:4]), _sec(*g[4:]), "\n".join(lines[i + 1:])))
+                break
+    return cues
+
+
+def to_vtt(cues):
+    return "WEBVTT\n\n" + "".join(
+        f"{_ts(a).replace(',', '.')} --> {_ts(b).replace(',', '.')}\n{text}\n\n" for a, b, text in cues
+    )
+
+
+def shift_srt(cues, start, end):
+    # [start, end) 구간에 걸친 자막만 골라서 start 만큼 앞으로 당김
+    out = []
+    for a, b, text in cues:
+        if b <= start or a >= end:
+            continue
+        out.append((max(a, start) - start, min(b, end) - start, text))
+    return "".join(f"{i + 1}\n{_ts(a)} --> {_ts(b)}\n{text}\n\n" for i, (a, b, text) in enumerate(out))
+
+
+# --------------------------------------------------------
+# 병렬 하드서브
+# --------------------------------------------------------
+def split_at_keyframes(ffmpeg, src, work_dir, pieces, duration):
+    """재인코딩 없이 키프레임에서 잘라 [(조각 경로, 원본 기준 시작, 끝), ...] 반환"""
+    work_dir = Path(work_dir)
+    times = ",".join(f"{duration * i / pieces:.3f}" for i in range(1, pieces))
+    listing = work_dir / "pieces.csv"
+    _run([
+        ffmpeg, "-y", "-hide_banner", "-loglevel", "error",
+        "-i", str(src), "-map", "0:v:0", "-an", "-c", "copy",
+        "-f", "segment", "-segment_times", times, "-reset_timestamps", "1",
+        "-segment_list", str(listing), "-segment_list_type", "csv",
+        str(work_dir / "piece%03d.mp4")
+    ])
+    result = []
+    with open(listing, newline="") as f:
+        for name, start, end in csv.reader(f):
+            result.append((work_dir / name, float(start), float(end)))
+    return result
+
+
+def burn_parallel(ffmpeg, src, srt, dst, style, work_dir, workers=RENDER_WORKERS,
+                  preset=X264_PRESET, crf=X264_CRF, duration=None):
+    work_dir = Path(work_dir)
+    work_dir.mkdir(parents=True, exist_ok=True)
+    duration = duration or probe_duration(ffmpeg, src)
+
+    pieces = split_at_keyframes(ffmpeg, src, work_dir, workers, duration)
+    cues = parse_srt(Path(srt).read_text(encoding="utf-8"))
+    # 조각당 x264 스레드를 나눠서 코어를 과하게 잡지 않게
+    threads = max(1, (os.cpu_count() or 1) // max(1, len(pieces)))
+
+    def burn(idx):
+        piece, start, end = pieces[idx]
+        piece_srt = work_dir / f"piece{idx:03d}.srt"
+        piece_srt.write_text(shift_srt(cues, start, end if idx < len(pieces) - 1 else float("inf")), encoding="utf-8")
+        out = work_dir / f"burned{idx:03d}.mp4"
+        burn_single(ffmpeg, piece, piece_srt, out, style, preset, crf, threads)
+        return out
+
+    with ThreadPoolExecutor(max_workers=len(pieces)) as pool:
+        burned = list(pool.map(burn, range(len(pieces))))
+
+    concat_list = work_dir / "concat.txt"
+    # concat 목록은 목록 파일 기준 상대 경로라 이름만 씀
+    concat_list.write_text("".join(f"file '{p.name}'\n" for p in burned), encoding="utf-8")
+    # 비디오는 조각 이어붙이고, 오디오는 원본에서 그대로 (조각 경계에서 오디오 끊김 방지)
+    return _run([
+        ffmpeg, "-y", "-hide_banner", "-loglevel", "error",
+        "-f", "concat", "-safe", "0", "-i", str(concat_list),
+        "-i", str(src),
+        "-map", "0:v:0", "-map", "1:a?", "-c", "copy",
+        "-movflags", "+faststart",
+        str(dst)
+    ])
+
+
+def burn_subtitles(ffmpeg, src, srt, dst, style, work_dir, mode=RENDER_MODE, workers=RENDER_WORKERS):
+    duration = probe_duration(ffmpeg, src) if mode == "parallel" else 0
+    if mode == "parallel" and workers > 1 and duration >= PARALLEL_MIN_SEC:
+        print(f"병렬 하드서브 ({workers}조각, {duration:.0f}초)")
+        try:
+            return burn_parallel(ffmpeg, src, srt, dst, style, work_dir, workers, duration=duration)
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    return burn_single(ffmpeg, src, srt, dst, style)
+
+
+# --------------------------------------------------------
+# 소프트 자막 (재인코딩 없이 자막 트랙만 추가)
+# --------------------------------------------------------
+def mux_soft(ffmpeg, src, srt, dst, container="mp4"):
+    # mp4 는 mov_text, mkv 는 ASS 로 넣고 비디오/오디오는 -c copy
+    sub_codec = "mov_text" if container == "mp4" else "ass"
+    return _run([
+        ffmpeg, "-y", "-hide_banner", "-loglevel", "error",
+        "-i", str(src), "-i", str(srt),
+        "-map", "0:v", "-map", "0:a?", "-map", "1:0",
+        "-c:v", "copy", "-c:a", "copy", "-c:s", sub_codec,
+        "-metadata:s:s:0", "language=kor", "-disposition:s:0", "default",
+        str(dst)
+    ])
@@ -0,0 +1,255 @@
+import os
+import time
+import threading
+from collections import deque
+
+from metrics import REGISTRY
+
+# ========================================================
+# 외부 API 호출 스케줄러 (Whisper / Gemini 공용)
+# ========================================================
+# - 분당 요청 수(RPM) / 분당 토큰 수(TPM) 토큰 버킷
+# - 동시 호출 수는 429 받으면 절반으로 줄이고, 잘 되면 하나씩 늘림 (AIMD)
+# - 작업별 대기열을 번갈아 꺼내서 큰 작업 하나가 다른 작업을 굶기지 않게
+# 0 이면 제한 없음
+GEMINI_RPM = float(os.getenv("WALNUT_GEMINI_RPM", "60"))
+GEMINI_TPM = float(os.getenv("WALNUT_GEMINI_TPM", "1000000"))
+WHISPER_RPM = float(os.getenv("WALNUT_WHISPER_RPM", "50"))
+
+# 동시 호출 상한 (429 없으면 여기까지 늘어남)
+STT_CONCURRENCY = int(os.getenv("WALNUT_STT_CONCURRENCY", "4"))
+LLM_CONCURRENCY = int(os.getenv("WALNUT_LLM_CONCURRENCY", "8"))
+
+# 429 재시도 횟수 / 대기 (Retry-After 없으면 1초부터 두 배씩)
+RATE_LIMIT_RETRIES = int(os.getenv("WALNUT_RATE_LIMIT_RETRIES", "5"))
+BACKOFF_BASE_SEC = 1.0
+BACKOFF_MAX_SEC = 60.0
+# 5xx / 타임아웃 / 연결 끊김 재시도 횟수 (SDK 자체 재시도는 꺼뒀으니 여기서). 1초부터 두 배씩 기다림
+TRANSIENT_RETRIES = int(os.getenv("WALNUT_TRANSIENT_RETRIES", "2"))
+
+API_QUEUE_SECONDS = REGISTRY.histogram("walnut_api_queue_seconds", "스케줄러 대기열에서 기다린 시간", ("api",))
+API_RATE_LIMITED = REGISTRY.counter("walnut_api_rate_limited_total", "429 (요청 한도 초과) 응답 수", ("api",))
+API_TRANSIENT_ERRORS = REGISTRY.counter("walnut_api_transient_errors_total", "재시도한 5xx/타임아웃/연결 오류 수", ("api",))
+
+
+def is_rate_limited(e):
+    # openai.RateLimitError / google.api_core ResourceExhausted / 그 외 429 달고 오는 예외
+    if getattr(e, "status_code", None) == 429 or getattr(e, "code", None) == 429:
+        return True
+    return type(e).__name__ in ("RateLimitError", "ResourceExhausted", "TooManyRequests")
+
+
+def is_transient(e):
+    # 잠깐 기다렸다 다시 보내면 될 만한 오류 (인증/요청 형식 오류 같은 4xx 는 다시 보내도 똑같음)
+    status = getattr(e, "status_code", None) or getattr(e, "code", None)
+    if isinstance(status, int) and (status in (408, 409) or status >= 500):
+        return True
+    if isinstance(e, (ConnectionError, TimeoutError)):
+        return True
+    # openai: APIConnectionError / APITimeoutError / InternalServerError
+    # google.api_core: ServiceUnavailable / DeadlineExceeded / GatewayTimeout / InternalServerError
+    return type(e).__name__ in (
+        "APIConnectionError", "APITimeoutError", "InternalServerError",
+        "ServiceUnavailable", "DeadlineExceeded", "GatewayTimeout",
+    )
+
+
+def retry_after(e):
+    headers = getattr(getattr(e, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """분당 rate 만큼 차오르는 버킷 (최대 1분치). rate 0 이면 무제한"""
+
+    def __init__(self, per_minute):
+        self.rate = per_minute / 60.0
+        self.capacity = per_minute
+        self.level = per_minute
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, amount, now):
+        if self.rate <= 0:
+            return 0.0
+        self._refill(now)
+        amount = min(amount, self.capacity)  # 한 번에 버킷보다 큰 요청은 가득 찼을 때 보냄
+        return 0.0 if self.level >= amount else (amount - self.level) / self.rate
+
+    def take(self, amount, now):
+        # 실제 사용량 정산 때 음수(빚)도 허용
+        if self.rate > 0:
+            self._refill(now)
+            self.level -= amount
+
+
+class _Ticket:
+    __slots__ = ("key", "tokens", "created", "granted_at")
+
+    def __init__(self, key, tokens):
+        self.key = key
+        self.tokens = tokens
+        self.created = time.monotonic()
+        self.granted_at = None
+
+
+class ApiScheduler:
+    def __init__(self, name, rpm=0, tpm=0, max_concurrency=8, min_concurrency=1, retries=RATE_LIMIT_RETRIES,
+                 transient_retries=TRANSIENT_RETRIES):
+        self.name = name
+        self.max_concurrency = max(1, max_concurrency)
+        self.min_concurrency = max(1, min(min_concurrency, self.max_concurrency))
+        self.limit = self.max_concurrency
+        self.retries = retries
+        self.transient_retries = transient_retries
+        self._rpm = TokenBucket(rpm)
+        self._tpm = TokenBucket(tpm)
+        self._cond = threading.Condition()
+        self._queues = {}          # 작업 키 → 대기 중인 티켓들
+        self._order = deque()      # 다음에 꺼낼 작업 순서 (라운드 로빈)
+        self.inflight = 0
+        self._streak = 0
+        self._backoff = BACKOFF_BASE_SEC
+        self._paused_until = 0.0
+        self._last_decrease = 0.0
+        self.rate_limited = 0
+        self.transient_errors = 0
+
+    # --------------------------------------------------------
+    # 대기열
+    # --------------------------------------------------------
+    def _dispatch(self):
+        """보낼 수 있는 만큼 허가. 다음에 다시 볼 때까지 기다릴 초 (None 이면 release 때까지)"""
+        granted = False
+        delay = None
+        while self._order and self.inflight < self.limit:
+            now = time.monotonic()
+            if now < self._paused_until:
+                delay = self._paused_until - now
+                break
+            key = self._order[0]
+            ticket = self._queues[key][0]
+            wait = max(self._rpm.delay(1, now), self._tpm.delay(ticket.tokens, now))
+            if wait > 0:
+                delay = wait
+                break
+            self._rpm.take(1, now)
+            self._tpm.take(ticket.tokens, now)
+            self._order.popleft()
+            queue = self._queues[key]
+            queue.popleft()
+            if queue:
+                self._order.append(key)
+            else:
+                del self._queues[key]
+            ticket.granted_at = now
+            self.inflight += 1
+            granted = True
+        if granted:
+            self._cond.notify_all()
+        return delay
+
+    def acquire(self, key, tokens=0):
+        ticket = _Ticket(key, tokens)
+        with self._cond:
+            if key not in self._queues:
+                self._queues[key] = deque()
+                self._order.append(key)
+            self._queues[key].append(ticket)
+            while ticket.granted_at is None:
+                delay = self._dispatch()
+                if ticket.granted_at is None:
+                    self._cond.wait(timeout=delay)
+        API_QUEUE_SECONDS.observe(ticket.granted_at - ticket.created, api=self.name)
+        return ticket
+
+    def release(self, ticket, rate_limited=False, wait_hint=None, tokens_used=None):
+        with self._cond:
+            now = time.monotonic()
+            self.inflight -= 1
+            if tokens_used is not None:
+                # 예상치로 잡아둔 토큰을 실제 사용량으로 정산
+                self._tpm.take(tokens_used - ticket.tokens, now)
+            if rate_limited:
+                self.rate_limited += 1
+                self._streak = 0
+                # 같은 순간에 몰려온 429 로 여러 번 반토막 나지 않게, 대기 한 번에 한 번만 줄임
+                if now - self._last_decrease >= self._backoff:
+                    self.limit = max(self.min_concurrency, self.limit // 2)
+                    self._last_decrease = now
+                self._paused_until = max(self._paused_until, now + (wait_hint or self._backoff))
+                self._backoff = min(BACKOFF_MAX_SEC, self._backoff * 2)
+            else:
+                self._backoff = BACKOFF_BASE_SEC
+                self._streak += 1
+                if self._streak >= self.limit and self.limit < self.max_concurrency:
+                    self.limit += 1
+                    self._streak = 0
+            self._dispatch()
+            self._cond.notify_all()
+
+    # --------------------------------------------------------
+    # 호출
+    # --------------------------------------------------------
+    def call(self, key, fn, tokens=0, span=None, usage=None):
+        """
+        fn() 을 스케줄러 허가 받고 실행. 429 면 물러났다가 다시 줄 섬 (retries 번까지).
+        5xx / 타임아웃 / 연결 오류는 이 호출만 잠깐 쉬었다가 transient_retries 번까지 (한도는 안 줄임).
+        span: 대기 시간(wait_sec), 호출 시간(llm_sec), 429 횟수(rate_limited), 재시도한 오류 수(transient_errors) 를 채워줄 dict
+        usage: 결과에서 실제 토큰 사용량을 꺼내는 함수 (TPM 정산용)
+        """
+        attempt = transient = 0
+        while True:
+            ticket = self.acquire(key, tokens)
+            t0 = time.perf_counter()
+            if span is not None:
+                span["wait_sec"] = span.get("wait_sec", 0.0) + ticket.granted_at - ticket.created
+            try:
+                result = fn()
+            except Exception as e:
+                limited = is_rate_limited(e)
+                self.release(ticket, rate_limited=limited, wait_hint=retry_after(e) if limited else None)
+                if span is not None:
+                    span["llm_sec"] = span.get("llm_sec", 0.0) + time.perf_counter() - t0
+                if not limited:
+                    if not is_transient(e) or transient >= self.transient_retries:
+                        raise
+                    transient += 1
+                    with self._cond:
+                        self.transient_errors += 1
+                    API_TRANSIENT_ERRORS.inc(api=self.name)
+                    if span is not None:
+                        span["transient_errors"] = span.get("transient_errors", 0) + 1
+                    wait = min(BACKOFF_MAX_SEC, BACKOFF_BASE_SEC * 2 ** (transient - 1))
+                    print(f"⚠️ {self.name} 일시 오류 ({type(e).__name__}) → {wait:.0f}초 뒤 재시도 ({transient}/{self.transient_retries})")
+                    time.sleep(wait)
+                    continue
+                API_RATE_LIMITED.inc(api=self.name)
+                if span is not None:
+                    span["rate_limited"] = span.get("rate_limited", 0) + 1
+                if attempt == self.retries:
+                    raise
+                attempt += 1
+                print(f"⏳ {self.name} 요청 한도 초과 → 동시 {self.limit}개로 줄이고 재시도 ({attempt}/{self.retries})")
+                continue
+            if span is not None:
+                span["llm_sec"] = span.get("llm_sec", 0.0) + time.perf_counter() - t0
+            self.release(ticket, tokens_used=usage(result) if usage else None)
+            return result
+
+    def stats(self):
+        with self._cond:
+            return {
+                "limit": self.limit,
+                "inflight": self.inflight,
+                "queued": sum(len(q) for q in self._queues.values()),
+                "jobs_waiting": len(self._queues),
+                "rate_limited": self.rate_limited,
+                "transient_errors": self.transient_errors,
+            }
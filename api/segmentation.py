@@ -0,0 +1,172 @@
+import os
+import re
+from array import array
+from bisect import bisect_right
+from itertools import accumulate
+from operator import attrgetter, itemgetter
+
+try:
+    import numpy as np
+except ImportError:  # numpy 없으면 같은 알고리즘을 array + bisect 로
+    np = None
+
+# ========================================================
+# 자막 분할 엔진 (단어 열 배열 기반)
+# ========================================================
+# 단어를 객체/딕셔너리로 들고 다니지 않고 start / end / 글자 수 / 문장끝 여부를 배열로만 다룸.
+# 세그먼트는 단어 인덱스 범위만 갖고, 텍스트는 필요할 때 이어붙임.
+
+
+class SegmentRules:
+    __slots__ = ("max_silence", "max_chars", "sentence_end")
+
+    def __init__(self, max_silence=None, max_chars=None, sentence_end=None):
+        self.max_silence = float(max_silence if max_silence is not None else os.getenv("WALNUT_MAX_SILENCE", "0.3"))
+        self.max_chars = int(max_chars if max_chars is not None else os.getenv("WALNUT_MAX_CHARS", "35"))
+        self.sentence_end = sentence_end if sentence_end is not None else os.getenv("WALNUT_SENTENCE_END", ".?!")
+
+
+class Segment:
+    __slots__ = ("first", "last", "start", "end")
+
+    def __init__(self, first, last, start, end):
+        self.first = first
+        self.last = last
+        self.start = start
+        self.end = end
+
+
+class WordColumns:
+    """
+    단어 열 배열. 단어 텍스트는 하나로 이어붙인 문자열 + 끝 오프셋(누적 글자 수)으로만 들고 있어서
+    세그먼트 텍스트는 슬라이스 한 번이면 됨 (기존 current["text"] += word 와 같은 결과).
+    """
+    __slots__ = ("joined", "offsets", "starts", "ends", "sentence_end")
+
+    def __init__(self, words, starts, ends, sentence_end_chars=".?!"):
+        n = len(words)
+        self.joined = "".join(words)
+        # 문장 끝: 뒤 공백 빼고 마지막 글자가 .?! → 이어붙인 문자열에서 정규식 한 번으로 찾음
+        pattern = re.compile(f"[{re.escape(sentence_end_chars)}]\\s*") if sentence_end_chars else None
+        if np is not None:
+            self.offsets = np.cumsum(np.fromiter(map(len, words), dtype=np.int64, count=n))
+            self.starts = np.asarray(starts, dtype=np.float64)
+            self.ends = np.asarray(ends, dtype=np.float64)
+            self.sentence_end = np.zeros(n, dtype=bool)
+        else:
+            self.offsets = array("q", accumulate(map(len, words)))
+            self.starts = array("d", starts)
+            self.ends = array("d", ends)
+            self.sentence_end = array("b", bytes(n))
+        if pattern is None or n == 0:
+            return
+        # 부호가 속한 단어의 끝까지 공백뿐이면 그 단어는 문장 끝
+        spans = [m.span() for m in pattern.finditer(self.joined)]
+        if np is not None:
+            if spans:
+                spans = np.asarray(spans, dtype=np.int64)
+                idx = np.searchsorted(self.offsets, spans[:, 0], side="right")
+                self.sentence_end[idx[spans[:, 1] >= self.offsets[idx]]] = True
+        else:
+            for begin, end in spans:
+                i = bisect_right(self.offsets, begin)
+                if end >= self.offsets[i]:
+                    self.sentence_end[i] = True
+
+    @classmethod
+    def from_words(cls, words, rules=None):
+        # Whisper 단어 객체(.word/.start/.end) 또는 딕셔너리 둘 다 받음
+        rules = rules or SegmentRules()
+        get = itemgetter if words and isinstance(words[0], dict) else attrgetter
+        return cls(
+            list(map(get("word"), words)),
+            list(map(get("start"), words)),
+            list(map(get("end"), words)),
+            rules.sentence_end,
+        )
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def text(self, seg):
+        begin = self.offsets[seg.first - 1] if seg.first else 0
+        return self.joined[begin:self.offsets[seg.last]]
+
+
+def _hard_cuts(cols, rules):
+    """단어 i 뒤에서 무조건 끊기는 위치 (문장 끝 또는 다음 단어와의 무음) — 한 번에 계산"""
+    n = len(cols)
+    if np is not None:
+        cut = cols.sentence_end.copy()
+        if n > 1:
+            cut[:-1] |= (cols.starts[1:] - cols.ends[:-1]) > rules.max_silence
+        cut[-1] = True
+        return np.flatnonzero(cut)
+    s, e, se = cols.starts, cols.ends, cols.sentence_end
+    return [i for i in range(n) if se[i] or i == n - 1 or s[i + 1] - e[i] > rules.max_silence]
+
+
+def segment(cols, rules=None):
+    """
+    기존 regroup_words_dynamic (bench_regroup.py 에서 비교) 과 같은 결과:
+    - 직전 단어와 무음이 max_silence 초과면 그 앞에서 끊음
+    - 누적 글자 수가 max_chars 를 넘는 단어, 문장 끝 단어까지 넣고 끊음
+    """
+    rules = rules or SegmentRules()
+    n = len(cols)
+    if n == 0:
+        return []
+    max_chars = rules.max_chars
+
+    # 무음/문장 끝으로 나뉜 블록 중 글자 수 한도 안인 블록은 그대로 세그먼트 하나 (대부분)
+    # 한도 넘는 블록만 누적 글자 수에서 이진 탐색으로 쪼갬
+    block_ends = _hard_cuts(cols, rules)
+    if np is not None:
+        block_starts = np.concatenate(([0], block_ends[:-1] + 1))
+        totals = cols.offsets[block_ends] - np.where(block_starts > 0, cols.offsets[block_starts - 1], 0)
+        fits = (totals <= max_chars).tolist()
+        block_starts, block_ends = block_starts.tolist(), block_ends.tolist()
+        cum = cols.offsets.tolist()
+        starts, ends = cols.starts.tolist(), cols.ends.tolist()
+    else:
+        block_starts = [0] + [e + 1 for e in block_ends[:-1]]
+        cum, starts, ends = cols.offsets, cols.starts, cols.ends
+        fits = [cum[e] - (cum[b - 1] if b else 0) <= max_chars for b, e in zip(block_starts, block_ends)]
+
+    segments = []
+    append = segments.append
+    for first, block_end, fit in zip(block_starts, block_ends, fits):
+        if fit:
+            append(Segment(first, block_end, starts[first], ends[block_end]))
+            continue
+        while first <= block_end:
+            base = cum[first - 1] if first else 0
+            last = bisect_right(cum, base + max_chars, first, block_end)
+            append(Segment(first, last, starts[first], ends[last]))
+            first = last + 1
+    return segments
+
+
+def regroup(words, rules=None):
+    """파이프라인용: [{"text", "start", "end"}, ...]"""
+    rules = rules or SegmentRules()
+    cols = WordColumns.from_words(words, rules)
+    return [{"text": cols.text(seg), "start": seg.start, "end": seg.end} for seg in segment(cols, rules)]
+
+
+def regroup_partial(words, rules=None):
+    """
+    뒤에 단어가 더 붙을 수 있을 때 (창 단위 파이프라인):
+    확정된 세그먼트와, 다음 단어에 따라 달라질 수 있는 마지막 블록의 단어들을 따로 돌려줌.
+    남은 단어는 다음 창 단어 앞에 붙여서 다시 넘기면 한 번에 돌린 regroup 과 같은 결과
+    """
+    rules = rules or SegmentRules()
+    cols = WordColumns.from_words(words, rules)
+    if not len(cols):
+        return [], []
+    cuts = _hard_cuts(cols, rules)
+    # 마지막 단어 뒤 끊김은 "끝이라서" 넣은 것 → 그 앞 블록까지만 확정
+    stable = int(cuts[-2]) if len(cuts) > 1 else -1
+    done = [seg for seg in segment(cols, rules) if seg.last <= stable]
+    return [{"text": cols.text(seg), "start": seg.start, "end": seg.end} for seg in done], words[stable + 1:]
+
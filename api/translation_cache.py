@@ -0,0 +1,137 @@
+import os
+import re
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+
+# ========================================================
+# 번역 메모리 캐시 (메모리 LRU + SQLite 디스크)
+# ========================================================
+# 프롬프트를 바꾸면 이 값을 올려서 예전 번역이 안 섞이게 한다
+PROMPT_VERSION = "1"
+
+MEMORY_ITEMS = int(os.getenv("WALNUT_TM_MEMORY_ITEMS", "50000"))
+DISK_ITEMS = int(os.getenv("WALNUT_TM_DISK_ITEMS", "2000000"))
+
+
+def normalize_text(text):
+    # 앞뒤 공백, 연속 공백만 정리 (대소문자/구두점은 번역에 영향 있으니 그대로)
+    return re.sub(r"\s+", " ", text).strip()
+
+
+class TranslationCache:
+    def __init__(self, path, memory_items=MEMORY_ITEMS, disk_items=DISK_ITEMS):
+        self.path = str(path)
+        self.memory_items = memory_items
+        self.disk_items = disk_items
+        self._mem = OrderedDict()
+        # _lock: 메모리 LRU + 통계 (짧게만 잡음), _db_lock: SQLite 연결 (다른 작업의 메모리 조회를 안 막게 따로)
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS tm ("
+            " key TEXT PRIMARY KEY,"
+            " ko TEXT NOT NULL,"
+            " last_used REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS tm_last_used ON tm(last_used)")
+        self._db.commit()
+        self._disk_count = self._db.execute("SELECT COUNT(*) FROM tm").fetchone()[0]
+
+    @staticmethod
+    def key(text, genre_guide, model):
+        raw = "\x1f".join([normalize_text(text), genre_guide.strip(), model, PROMPT_VERSION])
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _remember(self, key, ko):
+        self._mem[key] = ko
+        self._mem.move_to_end(key)
+        while len(self._mem) > self.memory_items:
+            self._mem.popitem(last=False)
+
+    def get_many(self, keys):
+        found = {}
+        unique = list(dict.fromkeys(keys))
+        with self._lock:
+            for k in unique:
+                if k in self._mem:
+                    self._mem.move_to_end(k)
+                    found[k] = self._mem[k]
+        missing = [k for k in unique if k not in found]
+
+        # 디스크 조회는 메모리 락 밖에서
+        # 메모리에서 찾은 것도 디스크 last_used 를 같이 갱신 (안 하면 자주 쓰는 문장이 디스크 정리 때 먼저 지워짐)
+        loaded = {}
+        if found or missing:
+            now = time.time()
+            with self._db_lock:
+                for i in range(0, len(missing), 500):
+                    part = missing[i:i+500]
+                    marks = ",".join("?" * len(part))
+                    loaded.update(self._db.execute(f"SELECT key, ko FROM tm WHERE key IN ({marks})", part).fetchall())
+                used = [*found, *loaded]
+                for i in range(0, len(used), 500):
+                    part = used[i:i+500]
+                    marks = ",".join("?" * len(part))
+                    self._db.execute(f"UPDATE tm SET last_used=? WHERE key IN ({marks})", (now, *part))
+                self._db.commit()
+        found.update(loaded)
+
+        hit = sum(1 for k in keys if k in found)
+        with self._lock:
+            for k, ko in loaded.items():
+                self._remember(k, ko)
+            self.hits += hit
+            self.misses += len(keys) - hit
+        return found
+
+    def put_many(self, items):
+        if not items:
+            return
+        now = time.time()
+        with self._lock:
+            for k, ko in items.items():
+                self._remember(k, ko)
+        with self._db_lock:
+            before = self._db.total_changes
+            self._db.executemany(
+                "INSERT OR IGNORE INTO tm(key, ko, last_used) VALUES (?, ?, ?)",
+                [(k, ko, now) for k, ko in items.items()],
+            )
+            self._disk_count += self._db.total_changes - before
+            self._db.executemany("UPDATE tm SET ko=?, last_used=? WHERE key=?", [(ko, now, k) for k, ko in items.items()])
+            if self._disk_count > self.disk_items:
+                self._evict()
+            self._db.commit()
+
+    def _evict(self):
+        # 한 번에 10% 정도 여유를 만들어서 매번 지우지 않게
+        target = int(self.disk_items * 0.9)
+        drop = self._disk_count - target
+        self._db.execute(
+            "DELETE FROM tm WHERE key IN (SELECT key FROM tm ORDER BY last_used LIMIT ?)", (drop,)
+        )
+        self._disk_count = self._db.execute("SELECT COUNT(*) FROM tm").fetchone()[0]
+        self.evictions += drop
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+                "evictions": self.evictions,
+                "memory_items": len(self._mem),
+                "disk_items": self._disk_count,
+            }
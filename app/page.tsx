@@ -15,6 +15,10 @@ export default function Home() {
   const [loading, setLoading] = useState(false);
   const [statusMessage, setStatusMessage] = useState("");
   const [downloadUrl, setDownloadUrl] = useState<string | null>(null);
+  const [srtUrl, setSrtUrl] = useState<string | null>(null);
+  // 번역 끝난 자막 실시간 미리보기 (배치 끝날 때마다 서버가 밀어줌)
+  const [liveSubs, setLiveSubs] = useState<{ index: number; start: number; ko: string }[]>([]);
+  const [liveJobId, setLiveJobId] = useState<string | null>(null);
 
   const fileInputRef = useRef<HTMLInputElement>(null);
 
@@ -81,17 +85,46 @@ export default function Home() {
     }
 
     // === 기존 자막 영상 생성 (video) ===
-    const res = await fetch("http://localhost:8000/upload/video", {
+    // 파일을 본문 그대로 스트리밍 (서버가 받으면서 바로 오디오 추출)
+    // 업로드하면 job id만 바로 받고, 완료될 때까지 상태를 폴링
+    // 미리보기에 자막이 보여야 해서 하드서브로 요청 (soft 는 자막 트랙만 추가)
+    const res = await fetch("http://localhost:8000/upload/video/stream?output=hard", {
       method: "POST",
-      body: formData,
+      headers: { "Content-Type": file.type || "video/mp4" },
+      body: file,
     });
 
     if (!res.ok) throw new Error(`서버 오류: ${res.status}`);
 
-    const blob = await res.blob();
-    const url = window.URL.createObjectURL(blob);
+    const { job_id } = await res.json();
+    setStatusMessage("대기열에 등록되었습니다...");
 
-    setDownloadUrl(url);
+    setLiveSubs([]);
+    setLiveJobId(job_id);
+    const live = new EventSource(`http://localhost:8000/jobs/${job_id}/segments?format=sse`);
+    live.addEventListener("segment", (e) => {
+      const seg = JSON.parse((e as MessageEvent).data);
+      setLiveSubs((prev) => [...prev, seg]);
+    });
+    live.addEventListener("end", () => live.close());
+
+    try {
+      while (true) {
+        await new Promise((r) => setTimeout(r, 2000));
+        const statusRes = await fetch(`http://localhost:8000/jobs/${job_id}`);
+        if (!statusRes.ok) throw new Error(`서버 오류: ${statusRes.status}`);
+        const job = await statusRes.json();
+        if (job.status === "failed") throw new Error(job.error);
+        if (job.status === "done") break;
+        setStatusMessage(`${job.stage ?? "대기 중"} · ${Math.round(job.progress * 100)}%`);
+      }
+    } finally {
+      live.close();
+    }
+
+    // Blob 으로 통째로 받지 않고 결과 URL 을 그대로 사용 (Range 지원 → 바로 탐색 재생, 끊겨도 이어받기)
+    setDownloadUrl(`http://localhost:8000/jobs/${job_id}/result`);
+    setSrtUrl(`http://localhost:8000/jobs/${job_id}/subtitles.srt`);
     setTokens(prev => prev - cost);
     alert("🎉 변환 완료! 아래에서 영상을 확인하세요.");
 
@@ -206,6 +239,22 @@ export default function Home() {
                   AI 작업 중입니다... 🐿️
                 </p>
                 <p className="text-sm text-gray-400 mt-2">{statusMessage}</p>
+                {liveSubs.length > 0 && (
+                  <div className="mt-4 text-left bg-white border border-gray-200 rounded-lg p-3 text-sm">
+                    {[...liveSubs].sort((a, b) => a.index - b.index).slice(-3).map((s) => (
+                      <p key={s.index} className="text-gray-600">
+                        <span className="text-gray-300 mr-2">{new Date(s.start * 1000).toISOString().substring(14, 19)}</span>
+                        {s.ko}
+                      </p>
+                    ))}
+                    <a
+                      href={`http://localhost:8000/jobs/${liveJobId}/subtitles.srt`}
+                      className="block mt-2 text-xs text-orange-600 underline"
+                    >
+                      지금까지 번역된 자막(.srt) 받기 ({liveSubs.length}줄)
+                    </a>
+                  </div>
+                )}
               </div>
             ) : !downloadUrl ? (
               // 결과 없을 때: 버튼들 표시
@@ -253,12 +302,20 @@ export default function Home() {
                 <video src={downloadUrl} controls className="w-full rounded-lg shadow-sm mb-4 bg-black max-h-[300px]" />
                 
                 <a 
-                  href={downloadUrl}
+                  href={`${downloadUrl}?download=1`}
                   download="walnut_result.mp4"
                   className="block w-full py-3 bg-green-600 text-white font-bold rounded-lg hover:bg-green-700 transition shadow-md"
                 >
                   내 컴퓨터에 저장하기
                 </a>
+                {srtUrl && (
+                  <a
+                    href={srtUrl}
+                    className="block w-full mt-2 py-2 border border-green-300 text-green-700 font-bold rounded-lg hover:bg-green-100 transition"
+                  >
+                    자막 파일(.srt)만 받기
+                  </a>
+                )}
                 <button 
                   onClick={() => setDownloadUrl(null)}
                   className="mt-3 text-sm text-gray-400 underline hover:text-gray-600"
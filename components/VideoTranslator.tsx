@@ -24,21 +24,26 @@ export default function VideoTranslator({ userTokens, onTokenUpdate }: Props) {
     setDownloadUrl("");
 
     try {
-      const formData = new FormData();
-      formData.append("file", file);
-
-      // responseType을 blob으로 설정하지 않고, fetch 후 blob()으로 변환
-      const res = await fetch("http://localhost:8000/upload/video", {
+      // 파일을 본문 그대로 스트리밍 (서버가 받으면서 바로 오디오 추출)
+      const res = await fetch("http://localhost:8000/upload/video/stream?output=hard", {
         method: "POST",
-        body: formData,
+        headers: { "Content-Type": file.type || "video/mp4" },
+        body: file,
       });
 
       if (!res.ok) throw new Error("서버 에러 발생");
 
-      // 파일 데이터(Blob) 받기
-      const blob = await res.blob();
-      const url = window.URL.createObjectURL(blob);
-      setDownloadUrl(url); // 다운로드 버튼 활성화
+      // job id 받고 완료될 때까지 폴링
+      const { job_id } = await res.json();
+      while (true) {
+        await new Promise((r) => setTimeout(r, 2000));
+        const job = await (await fetch(`http://localhost:8000/jobs/${job_id}`)).json();
+        if (job.status === "failed") throw new Error(job.error);
+        if (job.status === "done") break;
+      }
+
+      // Blob 대신 결과 URL 그대로 사용 (Range 지원 → 바로 탐색 재생, 끊겨도 이어받기)
+      setDownloadUrl(`http://localhost:8000/jobs/${job_id}/result`); // 다운로드 버튼 활성화
       
       onTokenUpdate(userTokens - 50); // 고급 기능이니 토큰 더 차감
 
@@ -87,7 +92,7 @@ export default function VideoTranslator({ userTokens, onTokenUpdate }: Props) {
           <video controls src={downloadUrl} className="w-full rounded-lg shadow-lg" />
           
           <a 
-            href={downloadUrl} 
+            href={`${downloadUrl}?download=1`} 
             download="walnut_translated.mp4"
             className="block w-full py-3 bg-green-600 text-white font-bold rounded-lg hover:bg-green-700 transition"
           >